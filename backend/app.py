@@ -1,27 +1,46 @@
 # backend/app.py — simple FastAPI backend with consistent tile colors and segments/geojson listing
 
 from pathlib import Path
-from io import BytesIO
-import os, json, uuid, math, hashlib, shutil, base64
+import os, json, uuid, math, hashlib, base64
+
+# headless: nickyspatial imports matplotlib; never load a GUI backend here or in job workers
+os.environ.setdefault("MPLBACKEND", "Agg")
 
 import numpy as np
 import rasterio
 from rasterio.windows import from_bounds
 from rasterio.enums import Resampling
 from rasterio.warp import transform_bounds
-import geopandas as gpd
 
 from fastapi import FastAPI, UploadFile, File, Form, Request, Body, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, Response, FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
 
 # If you have real segmentation helpers, keep these:
-from .obia.segmentation import run_slic_segmentation, layer_to_geojson
-from .obia.classification import classify as run_classification
-from .obia.downsample import downsample_raster
-from .obia.mergeCleanPolygons import merge_clean_polygons
-from nickyspatial.core.layer import Layer
+from .obia.cog import pick_overview_level, raw_size_mb
+from .obia.tilecache import TileCache, tile_key
+from .obia.jobs import JobManager, JobCancelled
+from .obia.tasks import (segment_task, classify_task, merge_clean_task, features_task, predict_task, ingest_task,
+                         merge_regions_task, classmap_task, raster_classmap_task, select_model_task)
+from .obia.modelselect import METHODS as SELECT_METHODS, SCORES as SELECT_SCORES
+from .obia.models import ModelRegistry
+from .obia.vtiles import VectorLayerCache
+from .obia.spatialindex import LayerIndexCache, MAX_FEATURES as QUERY_MAX_FEATURES
+from .obia.storage import LAYER_EXT, LEGACY_EXT, layer_path, geojson_bytes
+from .obia.catalog import ResultsCatalog, CatalogWatcher
+from .obia.features import parse_groups, feature_groups, features_path_for, segment_sidecars
+from .obia.segcache import SegmentCache, segment_key
+from .obia.rasterdb import RasterStore, describe_raster
+from .obia.renderstats import DEFAULT_STRETCH, compute_render_stats, stretch
+from .obia.dspool import DatasetPool
+from .obia.renderpool import RenderPool, RenderAbandoned
+from .obia.render import FORMATS as TILE_FORMATS, StageTimer, stretch_planes, encode_tile
+from .obia.uploads import UploadSessions, UploadConflict, stream_to_file, iter_upload_file
+from .obia.metrics import REGISTRY, STAGE_SECONDS, observe_trace
+from .obia.tracing import TraceBuffer, current_trace, trace as start_trace
 
 import logging
 logger = logging.getLogger("app")
@@ -34,6 +53,31 @@ if not logger.handlers:
 
 MAX_UPLOAD_MB = float(os.getenv("RASTER_MAX_MB", "30"))
 AUTO_DS_FACTOR = float(os.getenv("RASTER_DS_FACTOR", "4"))
+RASTER_INGEST = os.getenv("RASTER_INGEST", "cog").lower()   # cog | downsample | none
+RASTER_DS_WORKERS = int(os.getenv("RASTER_DS_WORKERS", "0")) or None   # downsample reader threads (default: all cores)
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", "86400"))   # seconds an idle chunked upload is kept
+TILE_CACHE_MB = float(os.getenv("TILE_CACHE_MB", "64"))
+TILE_CACHE_DISK_MB = float(os.getenv("TILE_CACHE_DISK_MB", "0"))   # 0 = memory only
+TILE_MAX_AGE = int(os.getenv("TILE_MAX_AGE", "3600"))
+TILE_PNG_LEVEL = int(os.getenv("TILE_PNG_LEVEL", "6"))       # zlib level of PNG tiles, 0-9
+TILE_QUALITY = int(os.getenv("TILE_QUALITY", "80"))          # WebP / JPEG tile quality
+TILE_MAX_OPEN_DATASETS = int(os.getenv("TILE_MAX_OPEN_DATASETS", "64"))
+TILE_RENDER_WORKERS = int(os.getenv("TILE_RENDER_WORKERS", "4"))   # tile renders running at once
+VTILE_CACHE_MB = float(os.getenv("VTILE_CACHE_MB", "64"))
+VTILE_MAX_LAYERS = int(os.getenv("VTILE_MAX_LAYERS", "8"))      # indexed layers kept in memory
+QUERY_MAX_LAYERS = int(os.getenv("OBIA_QUERY_MAX_LAYERS", "8"))  # layers kept indexed for point/bbox queries
+SEG_BLOCK_SIZE = int(os.getenv("OBIA_SEG_BLOCK_SIZE", "0"))     # >0 = windowed SLIC by default
+SEG_OVERLAP = int(os.getenv("OBIA_SEG_OVERLAP", "64"))
+SEG_WORKERS = int(os.getenv("OBIA_SEG_WORKERS", "0")) or None     # block processes (default: all cores)
+SEG_CACHE_MB = float(os.getenv("OBIA_SEG_CACHE_MB", "2048"))
+SEG_CACHE_ENTRIES = int(os.getenv("OBIA_SEG_CACHE_ENTRIES", "500"))
+SEG_FEATURES = os.getenv("OBIA_FEATURES", "spectral,shape")   # groups extracted after segmentation
+MERGE_WORKERS = int(os.getenv("OBIA_MERGE_WORKERS", "0")) or None   # dissolve processes per merge job (default: all cores)
+SELECT_BUDGET = float(os.getenv("OBIA_SELECT_BUDGET", "120"))     # seconds of cross-validation per /models/select
+SELECT_WORKERS = int(os.getenv("OBIA_SELECT_WORKERS", "0")) or None   # fit processes per selection (default: all cores)
+JOB_WORKERS = int(os.getenv("OBIA_JOB_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+TRACE_KEEP = int(os.getenv("OBIA_TRACE_KEEP", "200"))             # finished traces kept for /traces
+TRACE_SLOW_MS = float(os.getenv("OBIA_TRACE_SLOW_MS", "250"))     # tile / polling requests kept only if slower
 
 # ---------------- paths
 BASE = Path(__file__).resolve().parent
@@ -49,6 +93,9 @@ SAMPLES_DIR = RESULTS / "samples"
 
 MERGED_CLEAN_DIR = RESULTS / "merged_cleaned"
 MERGED_CLEAN_DIR.mkdir(parents=True, exist_ok=True)
+TILE_CACHE_DIR = RESULTS / "_tilecache"
+JOBS_DIR = RESULTS / "_jobs"
+MODELS_DIR = RESULTS / "_models"
 
 
 FRONTEND_DIR = BASE.parent / "frontend"  # project/frontend
@@ -58,27 +105,230 @@ INDEX_HTML = FRONTEND_DIR / "index.html"
 for p in (UPLOADS, RESULTS, SEGMENTS_DIR, CLASSIFY_DIR, SAMPLES_DIR):
     p.mkdir(parents=True, exist_ok=True)
 
-METADATA = UPLOADS / "_rasters.json"
-if not METADATA.exists():
-    METADATA.write_text(json.dumps({"items": []}, indent=2), encoding="utf-8")
+# raster metadata: indexed SQLite store (imports the old uploads/_rasters.json once)
+RASTERS = RasterStore(UPLOADS / "_rasters.sqlite", legacy_json=UPLOADS / "_rasters.json")
+
+# files under results/ and uploads/ with per-layer metadata, for listings and /delete;
+# reconciled here and after every job, and kept current by a filesystem watcher
+CATALOG = ResultsCatalog(RESULTS / "_catalog.sqlite", roots=(RESULTS, UPLOADS), samples_dir=SAMPLES_DIR,
+                         skip=(UPLOADS / "tmp", UPLOAD_TMP_DIR))
+CATALOG.scan()
+CATALOG_WATCHER = CatalogWatcher(CATALOG)
+
+# resumable chunked uploads: uploads/tmp/<upload_id>.part + .json
+UPLOAD_SESSIONS = UploadSessions(UPLOAD_TMP_DIR, max_age=UPLOAD_SESSION_TTL)
 
 # 1x1 transparent PNG fallback
 TRANSPARENT_PNG_1x1 = base64.b64decode(
     b"iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR4nGMAAQAABQABDQottAAAAABJRU5ErkJggg=="
 )
 
+# rendered tiles: keyed on (raster id, sha1, render stats, z/x/y)
+TILE_CACHE = TileCache(
+    max_bytes=int(TILE_CACHE_MB * 1024 * 1024),
+    disk_dir=TILE_CACHE_DIR if TILE_CACHE_DISK_MB > 0 else None,
+    disk_max_bytes=int(TILE_CACHE_DISK_MB * 1024 * 1024),
+)
+
+# vector tiles: encoded .pbf keyed on (layer id, file mtime, z/x/y, props), and the indexed layers
+VTILE_CACHE = TileCache(max_bytes=int(VTILE_CACHE_MB * 1024 * 1024))
+VLAYERS = VectorLayerCache(max_layers=VTILE_MAX_LAYERS)
+
+# point / bbox / polygon queries: STRtree per layer in its stored CRS, built on first query
+QUERY_INDEX = LayerIndexCache(max_layers=QUERY_MAX_LAYERS)
+
+# open GDAL handles reused across tile requests (per thread, LRU-closed)
+DATASETS = DatasetPool(max_open=TILE_MAX_OPEN_DATASETS)
+
+# tile renders run here (bounded, coalesced per tile), not in the shared API threadpool
+RENDER_POOL = RenderPool(max_workers=TILE_RENDER_WORKERS)
+
+# content-addressed segmentation results: (raster sha1, params) -> results/segments/<file>
+SEG_CACHE = SegmentCache(
+    index_path=RESULTS / "_segcache.json",
+    segments_dir=SEGMENTS_DIR,
+    max_bytes=int(SEG_CACHE_MB * 1024 * 1024),
+    max_entries=SEG_CACHE_ENTRIES,
+    is_protected=lambda stem: (SAMPLES_DIR / f"{stem}.json").exists(),
+)
+
+# fitted classifiers, reused by /classify and applied by /predict
+MODELS = ModelRegistry(MODELS_DIR)
+
+# ---------------- metrics (GET /metrics) and traces (GET /traces)
+HTTP_REQUESTS = REGISTRY.counter("obia_http_requests_total", "HTTP requests by route template and status.",
+                                 ("method", "route", "status"))
+HTTP_SECONDS = REGISTRY.histogram("obia_http_request_seconds", "HTTP request latency by route template.",
+                                  ("method", "route"))
+HTTP_BYTES = REGISTRY.counter("obia_http_response_bytes_total", "Response body bytes sent, by route template.",
+                              ("route",))
+TILE_ERRORS = REGISTRY.counter("obia_tile_errors_total", "Raster tile renders that failed.")
+JOB_SECONDS = REGISTRY.histogram("obia_job_seconds", "Job run time in the worker, by kind and final state.",
+                                 ("kind", "state"))
+JOB_QUEUE_SECONDS = REGISTRY.histogram("obia_job_queue_seconds", "Time jobs waited for a free worker.", ("kind",))
+
+def _tile_caches(field: str):
+    return lambda: {("raster",): TILE_CACHE.stats()[field] or 0, ("vector",): VTILE_CACHE.stats()[field] or 0}
+
+REGISTRY.callback("obia_tile_cache_hits_total", "Tile cache hits.", _tile_caches("hits"), ("cache",), "counter")
+REGISTRY.callback("obia_tile_cache_misses_total", "Tile cache misses.", _tile_caches("misses"), ("cache",), "counter")
+REGISTRY.callback("obia_tile_cache_hit_ratio", "Tile cache hits / lookups since start.", _tile_caches("hit_ratio"),
+                  ("cache",))
+REGISTRY.callback("obia_tile_cache_bytes", "Tile bytes held in memory.", _tile_caches("bytes"), ("cache",))
+REGISTRY.callback("obia_render_pool_tasks", "Tile renders running / waiting for a render thread.",
+                  lambda: {(k,): RENDER_POOL.stats()[k] for k in ("running", "queued")}, ("state",))
+REGISTRY.callback("obia_open_datasets", "GDAL handles open in the tile dataset pool.",
+                  lambda: DATASETS.stats()["open"])
+REGISTRY.callback("obia_query_index_layers", "Result layers held indexed for spatial queries.",
+                  lambda: QUERY_INDEX.stats()["layers"])
+REGISTRY.callback("obia_segment_cache_hits_total", "Segmentation results served from the cache.",
+                  lambda: SEG_CACHE.stats()["hits"], kind="counter")
+REGISTRY.callback("obia_segment_cache_misses_total", "Segmentations that had to run.",
+                  lambda: SEG_CACHE.stats()["misses"], kind="counter")
+
+def _job_states():
+    counts = {}
+    for j in JOBS.list():
+        counts[(j["state"],)] = counts.get((j["state"],), 0) + 1
+    return counts
+
+REGISTRY.callback("obia_jobs", "Remembered jobs by state.", _job_states, ("state",))
+
+# recent request and job traces
+TRACES = TraceBuffer(TRACE_KEEP)
+
+def _job_outputs(kind: str, res: dict) -> list[Path]:
+    """Files a finished job wrote, from the names in its result."""
+    if kind == "segment":
+        p = SEGMENTS_DIR / res["file"]
+        return [p, *segment_sidecars(p)]
+    if kind == "features":
+        return [SEGMENTS_DIR / Path(res["features_url"]).name]
+    if kind in ("classify", "predict"):
+        return [CLASSIFY_DIR / res["file"]]
+    if kind == "select_model":
+        return [CLASSIFY_DIR / res["classified"]["file"]] if res.get("classified") else []
+    if kind in ("classmap", "merge_clean", "merge_regions"):
+        return [MERGED_CLEAN_DIR / res["output"]]
+    if kind == "ingest":
+        it = RASTERS.get(res["id"])
+        return [Path(it["path"])] if it else []
+    return []
+
+def _job_finished(rec: dict):
+    """JobManager hook: job timings and worker spans -> metrics and /traces, plus a log line."""
+    kind, state = rec["kind"], rec["state"]
+    run = None
+    if rec["started_at"]:
+        JOB_QUEUE_SECONDS.observe(max(0.0, rec["started_at"] - rec["submitted_at"]), kind=kind)
+        run = rec["finished_at"] - rec["started_at"]
+        JOB_SECONDS.observe(run, kind=kind, state=state)
+    if rec.get("trace"):
+        observe_trace(rec["trace"])
+        TRACES.add(rec["trace"])
+    if state == "done" and rec.get("result"):
+        # outputs are in the listings before the waiting request resumes
+        for p in _job_outputs(kind, rec["result"]):
+            CATALOG.refresh(p)
+    log = logger.warning if state == "error" else logger.info
+    log("job %s %s %s in %s%s", kind, rec["id"], state, "-" if run is None else f"{run:.2f}s",
+        f": {rec['error']}" if rec.get("error") else "")
+
+# segment / classify / merge_clean run here, off the event loop
+JOBS = JobManager(workers=JOB_WORKERS, jobs_dir=JOBS_DIR, on_finish=_job_finished)
+
 # ---------------- app
 app = FastAPI(title="OBIA API")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True,
 )
-app.mount("/results", StaticFiles(directory=str(RESULTS)), name="results")
+
+# high-volume routes: their traces are only kept when slower than TRACE_SLOW_MS
+_BUSY_ROUTES = ("/tiles", "/vtiles", "/results", "/app", "/jobs", "/metrics", "/traces", "/health")
+
+class RequestObserver:
+    """
+    Traces every request (id returned in `X-Trace-Id`) and records latency,
+    status and response bytes per route template. Plain ASGI rather than
+    BaseHTTPMiddleware, so streamed bodies and disconnect checks are untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method, status, sent = scope["method"], 500, 0
+        try:
+            with start_trace(f"{method} {scope['path']}") as t:
+                async def send_observed(message):
+                    nonlocal status, sent
+                    if message["type"] == "http.response.start":
+                        status = message["status"]
+                        message["headers"] = [*message.get("headers", []), (b"x-trace-id", t.id.encode())]
+                    elif message["type"] == "http.response.body":
+                        sent += len(message.get("body", b""))
+                    await send(message)
+                await self.app(scope, receive, send_observed)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route is None:
+                # mounts (static files) by prefix; unmatched paths must not become labels
+                route = f"{scope['root_path']}/*" if scope.get("root_path") else "<unmatched>"
+            t.name = f"{method} {route}"
+            t.attrs.update(path=scope["path"], status=status, bytes=sent)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+            HTTP_SECONDS.observe(t.duration_ms / 1000.0, method=method, route=route)
+            HTTP_BYTES.inc(sent, route=route)
+            if not route.startswith(_BUSY_ROUTES) or t.duration_ms >= TRACE_SLOW_MS:
+                TRACES.add(t.to_dict())
+
+app.add_middleware(RequestObserver)
+class ResultFiles(StaticFiles):
+    """
+    Static results, plus GeoJSON export of GeoParquet layers: a request for
+    `<dir>/<stem>.geojson` with no such file is answered by converting `<stem>.parquet`.
+    """
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            if e.status_code != 404 or not path.endswith(LEGACY_EXT):
+                raise
+        rel = Path(path)
+        src = layer_path(RESULTS / rel.parent, rel.stem) if ".." not in rel.parts else None
+        if src is None or src.suffix != LAYER_EXT:
+            raise StarletteHTTPException(status_code=404)
+        st = src.stat()
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in (Request(scope).headers.get("if-none-match") or ""):
+            return Response(status_code=304, headers=headers)
+        body = await run_in_threadpool(geojson_bytes, src)
+        return Response(content=body, media_type="application/geo+json", headers=headers)
+
+app.mount("/results", ResultFiles(directory=str(RESULTS)), name="results")
 
 # Serve everything under frontend/ at /app
 # If your index.html references ./assets/main.js etc., they will be available as /app/assets/main.js
 app.mount("/app", StaticFiles(directory=str(FRONTEND_DIR), html=True), name="app")
 
+@app.on_event("startup")
+def _start_catalog_watcher():
+    if not CATALOG_WATCHER.start():
+        logger.info("watchdog not installed: results catalog refreshed by scans only")
+
+@app.on_event("shutdown")
+def _shutdown_jobs():
+    CATALOG_WATCHER.stop()
+    JOBS.shutdown()
+    RENDER_POOL.shutdown()
+    DATASETS.close_all()
+    SEG_CACHE.flush()
+
 # Optional: redirect root to /app/ so you can open http://localhost:8001/
 @app.get("/", include_in_schema=False)
 def root_redirect():
@@ -87,37 +337,23 @@ def root_redirect():
 # ---------------- small helpers
 def _ok(data): return JSONResponse(content=data)
 def _bad(msg, code=400): return JSONResponse(status_code=code, content={"error": msg})
+def _accepted(job): return JSONResponse(status_code=202, content={"job_id": job["id"], "status_url": f"/jobs/{job['id']}"})
 
-def _load_db():
-    return json.loads(METADATA.read_text(encoding="utf-8"))
-
-def _save_db(db):
-    METADATA.write_text(json.dumps(db, indent=2), encoding="utf-8")
-
-def _sha1_file(path: Path) -> str:
-    h = hashlib.sha1()
-    with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def _raster_record(rid: str) -> dict | None:
+    return RASTERS.get(rid)
 
 def _raster_path_by_id(rid: str) -> Path | None:
-    db = _load_db()
-    for it in db.get("items", []):
-        if it["id"] == rid:
-            p = Path(it["path"])
-            return p if p.exists() else None
-    return None
-
-def _unique_display_name(filename: str, existing_names: list[str]) -> str:
-    base, ext = os.path.splitext(filename)
-    candidate = filename
-    i = 1
-    existing = set(existing_names)
-    while candidate in existing:
-        candidate = f"{base} {i}{ext}"
-        i += 1
-    return candidate
+    it = _raster_record(rid)
+    if it is None:
+        return None
+    p = Path(it["path"])
+    return p if p.exists() else None
+
+def _raster_record_and_path(rid: str) -> tuple[dict | None, Path | None]:
+    """(record, path) of a raster, path None when it is unknown or its file is gone."""
+    it = _raster_record(rid)
+    p = Path(it["path"]) if it else None
+    return it, (p if p and p.exists() else None)
 
 def _tile_bounds_wgs84(x: int, y: int, z: int):
     n = 2 ** z
@@ -130,32 +366,44 @@ def _tile_bounds_wgs84(x: int, y: int, z: int):
     south = lat(y + 1)
     return west, south, east, north
 
-# Global per-raster render stats cache: rid -> (vmins[list], vmaxs[list])
+# Render stats are computed at ingest and stored in RASTERS; this is only an
+# in-process memo of the stored dict: rid -> stats
 RENDER_STATS = {}
-def _get_render_stats(rid: str, ds):
-    if rid in RENDER_STATS:
-        return RENDER_STATS[rid]
-    idxs = list(range(1, min(3, ds.count) + 1)) or [1]
-    scale = max(ds.width, ds.height) / 1024.0 if max(ds.width, ds.height) > 1024 else 1.0
-    out_h = max(1, int(ds.height / scale))
-    out_w = max(1, int(ds.width / scale))
-    arr = ds.read(
-        indexes=idxs, out_shape=(len(idxs), out_h, out_w),
-        resampling=Resampling.bilinear, boundless=True, fill_value=0
-    ).astype("float32")
-    mask = ds.read_masks(1, out_shape=(out_h, out_w)) == 0
-    vmins, vmaxs = [], []
-    for b in range(arr.shape[0]):
-        vals = arr[b][~mask]
-        if vals.size == 0:
-            vmins.append(0.0); vmaxs.append(1.0)
-        else:
-            vmin = float(np.percentile(vals, 2))
-            vmax = float(np.percentile(vals, 98))
-            if vmax <= vmin: vmax = vmin + 1.0
-            vmins.append(vmin); vmaxs.append(vmax)
-    RENDER_STATS[rid] = (vmins, vmaxs)
-    return RENDER_STATS[rid]
+def _get_render_stats(rid: str, path: Path) -> dict:
+    """Stored render stats of a raster; computed (and stored) here for rasters ingested without them."""
+    stats = RENDER_STATS.get(rid) or RASTERS.get_stats(rid)
+    if stats is None:
+        stats = compute_render_stats(path)
+        RASTERS.set_stats(rid, stats)
+    RENDER_STATS[rid] = stats
+    return stats
+
+def _parse_values(raw: str | None, n: int) -> list[float] | None:
+    """'v' or 'v1,v2,v3' -> one float per band (a single value applies to all)."""
+    if raw is None or not raw.strip():
+        return None
+    vals = [float(v) for v in raw.split(",") if v.strip()]
+    if len(vals) == 1:
+        vals = vals * n
+    if len(vals) != n:
+        raise ValueError(f"expected 1 or {n} values, got {len(vals)}")
+    return vals
+
+def _render_stretch(stats: dict, pmin=None, pmax=None, vmin: str | None = None, vmax: str | None = None):
+    """
+    (vmins, vmaxs) of the rendered bands: the stored 2-98 % stretch, or the
+    `pmin`..`pmax` percentiles, with explicit `vmin` / `vmax` values taking
+    precedence. Raises ValueError on bad overrides.
+    """
+    lo = DEFAULT_STRETCH[0] if pmin is None else pmin
+    hi = DEFAULT_STRETCH[1] if pmax is None else pmax
+    if not 0 <= lo < hi <= 100:
+        raise ValueError("need 0 <= pmin < pmax <= 100")
+    bands = list(range(1, min(3, len(stats["bands"])) + 1)) or [1]
+    vmins, vmaxs = stretch(stats, bands, lo, hi)
+    vmins = _parse_values(vmin, len(bands)) or vmins
+    vmaxs = _parse_values(vmax, len(bands)) or vmaxs
+    return vmins, vmaxs
 
 # ---- helpers (place near your other helpers) ----
 def _sanitize_base(name: str) -> str:
@@ -169,20 +417,15 @@ def _flt_token(v) -> str:
     # compact, stable float string
     return format(float(v), ".6g")
 
-def _unique_segment_filename(raster_display_name: str, scale, compactness) -> str:
+def _segment_stem(raster_display_name: str, scale, compactness) -> str:
     """
-    segment_<raster>_<scale>_<compactness>.geojson
-    If it exists already, append _1, _2, ...
+    segment_<raster>_<scale>_<compactness>
+    The job appends _1, _2, ... when a file with that stem already exists.
     """
     base = _sanitize_base(raster_display_name)
     s = _flt_token(scale)
     c = _flt_token(compactness)
-    candidate = f"segment_{base}_{s}_{c}.geojson"
-    i = 1
-    while (SEGMENTS_DIR / candidate).exists():
-        candidate = f"segment_{base}_{s}_{c}_{i}.geojson"
-        i += 1
-    return candidate
+    return f"segment_{base}_{s}_{c}"
 
 # --- size helpers ---
 def _size_mb(path: Path) -> float:
@@ -200,6 +443,14 @@ def _ds_factor_by_size(mb: float) -> int:
     if mb <= 2048:      return 8
     return 12
 
+def _working_downscale(path: Path) -> int:
+    """Default segmentation working resolution: same size tiers the upload downsample used."""
+    try:
+        with rasterio.open(path) as ds:
+            return _ds_factor_by_size(raw_size_mb(ds))
+    except Exception:
+        return 1
+
 
 
 # ---------------- health
@@ -207,305 +458,783 @@ def _ds_factor_by_size(mb: float) -> int:
 def health():
     return {"ok": True}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text exposition of the counters / histograms above and the pipeline stage timings."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/traces")
+def list_traces(min_ms: float = 0.0, limit: int = 50):
+    """Recent request / job traces (newest first), optionally only those slower than `min_ms`."""
+    return _ok({"traces": TRACES.list(min_ms, max(1, min(int(limit), 500)))})
+
+@app.get("/traces/{trace_id}")
+def get_trace(trace_id: str):
+    """One trace with its spans; request ids come from `X-Trace-Id`, job traces use the job id."""
+    t = TRACES.get(trace_id)
+    return _ok(t) if t is not None else _bad("trace not found", 404)
+
 # ---------------- rasters
+RASTER_SUFFIXES = {".tif", ".tiff", ".img"}
+
+def _forget_raster(rid: str):
+    if rid in RENDER_STATS: del RENDER_STATS[rid]
+    TILE_CACHE.invalidate(rid)
+    DATASETS.invalidate(rid)
+
+def _dedup(it: dict):
+    return _ok({"id": it["id"], "name": it["name"], "dedup": True})
+
+def _ingest_lost(rec: dict) -> dict:
+    """Mark a raster whose ingest job died with a previous server process as failed."""
+    if rec.get("state") == "processing" and rec.get("job_id") and JOBS.get(rec["job_id"], with_result=False) is None:
+        rec = RASTERS.update(rec["id"], state="error", error="ingest interrupted") or rec
+    return rec
+
+def _known_raster(sha1: str) -> dict | None:
+    """The raster with these bytes to dedup against; failed ingests don't count (re-uploads replace them)."""
+    it = RASTERS.by_sha1(sha1)
+    if it is not None and _ingest_lost(it).get("state") == "error":
+        return None
+    return it
+
+def _register_upload(tmp: Path, filename: str, sha1: str):
+    """
+    Validate the stored bytes, register the raster and queue its ingest (COG
+    rewrite / downsample) as a job. Responds as soon as the record exists; the
+    raster reports state "processing" until the job has moved it into place.
+    """
+    try:
+        meta = describe_raster(tmp)
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        return _bad(f"unreadable raster: {e}")
+
+    upload_name = Path(filename).name
+    if RASTER_INGEST == "cog" and Path(upload_name).suffix.lower() not in {".tif", ".tiff"}:
+        upload_name = Path(upload_name).stem + ".tif"
+
+    # name reservation + sha1 dedup happen in one transaction
+    rid = uuid.uuid4().hex
+    entry, created = RASTERS.add(rid, upload_name, sha1, path_for=lambda name: UPLOADS / name,
+                                 state="processing", **meta)
+    if not created:
+        tmp.unlink(missing_ok=True)
+        return _dedup(entry)
+    factor = _ds_factor_by_size(_size_mb(tmp)) if RASTER_INGEST == "downsample" else 1
+    job = JOBS.submit("ingest", ingest_task, str(tmp), entry["path"], rid, str(RASTERS.db_path),
+                      RASTER_INGEST, factor, RASTER_DS_WORKERS, on_done=lambda res: _forget_raster(rid))
+    RASTERS.update(rid, job_id=job["id"])
+    _forget_raster(rid)
+    return JSONResponse(status_code=202, content={
+        "id": rid, "name": entry["name"], "state": "processing",
+        "job_id": job["id"], "status_url": f"/rasters/{rid}/status",
+    })
+
+def _store_upload(tmp: Path, filename: str, sha1: str):
+    """Dedup a fully received upload against the store, or register it (blocking: run off the event loop)."""
+    it = _known_raster(sha1)
+    if it is not None:
+        tmp.unlink(missing_ok=True)
+        return _dedup(it)
+    return _register_upload(tmp, filename, sha1)
+
 @app.get("/rasters")
 def list_rasters():
-    db = _load_db()
     items = []
-    for it in db.get("items", []):
+    for it in RASTERS.list():
         p = Path(it["path"])
-        if p.exists():
+        state = it.get("state", "done")
+        if state != "done":
+            items.append({"id": it["id"], "name": it["name"], "size_mb": None, "state": state})
+        elif p.exists():
             size_mb = round(p.stat().st_size / (1024 * 1024), 2)
             items.append({"id": it["id"], "name": it["name"], "size_mb": size_mb})
     return _ok({"rasters": items})
 
 @app.post("/rasters")
-async def upload_raster(file: UploadFile = File(...)):
+async def upload_raster(file: UploadFile = File(...), sha1: str | None = Form(None)):
+    """
+    One-shot upload. The body is hashed while it is written (no second read), and a
+    client-supplied `sha1` already known to the store skips the copy altogether.
+    """
     suffix = Path(file.filename).suffix.lower()
-    if suffix not in {".tif", ".tiff", ".img"}:
+    if suffix not in RASTER_SUFFIXES:
         return _bad("Only .tif/.tiff/.img allowed.")
-    tmp = UPLOAD_TMP_DIR / f"tmp_{uuid.uuid4().hex}{suffix}"
+    if sha1:
+        it = await run_in_threadpool(_known_raster, sha1.lower())
+        if it is not None:
+            return _dedup(it)
 
+    tmp = UPLOAD_TMP_DIR / f"tmp_{uuid.uuid4().hex}{suffix}"
+    h = hashlib.sha1()
     with tmp.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
-    sha1 = _sha1_file(tmp)
-    db = _load_db()
+        await stream_to_file(iter_upload_file(file), f, h)
+    digest = h.hexdigest()
+    if sha1 and sha1.lower() != digest:
+        tmp.unlink(missing_ok=True)
+        return _bad(f"sha1 mismatch: expected {sha1.lower()}, received {digest}")
     # dedup exact same file content
-    for it in db["items"]:
-        if it.get("sha1") == sha1:
-            tmp.unlink(missing_ok=True)
-            return _ok({"id": it["id"], "name": it["name"], "dedup": True})
-
+    return await run_in_threadpool(_store_upload, tmp, file.filename, digest)
 
-    # --- auto-downsample in tmp based on size tiers ---
+# ---------------- resumable uploads
+@app.post("/uploads")
+def create_upload(filename: str = Form(...), size: int = Form(...), sha1: str | None = Form(None)):
+    """
+    Open a chunked upload. Send the bytes with PUT /uploads/{id}?offset=N (any chunk
+    size, in order), resume from GET /uploads/{id}, then POST /uploads/{id}/complete.
+    A known `sha1` returns the existing raster right away.
+    """
+    if Path(filename).suffix.lower() not in RASTER_SUFFIXES:
+        return _bad("Only .tif/.tiff/.img allowed.")
+    if size <= 0:
+        return _bad("size must be > 0")
+    if sha1:
+        it = _known_raster(sha1.lower())
+        if it is not None:
+            return _dedup(it)
+    rec = UPLOAD_SESSIONS.create(Path(filename).name, size, sha1)
+    return _ok({"upload_id": rec["upload_id"], "offset": 0, "size": size})
+
+@app.get("/uploads/{upload_id}")
+def upload_state(upload_id: str):
+    rec = UPLOAD_SESSIONS.get(upload_id)
+    if rec is None:
+        return _bad("upload not found", 404)
+    return _ok(rec)
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int | None = None):
     try:
-        mb = _size_mb(tmp)
-        factor = _ds_factor_by_size(mb)
-        if factor > 1:
-            # write to a sibling temp, then replace atomically
-            tmp_ds = tmp.with_name(f"{tmp.stem}_ds{int(factor)}{tmp.suffix}")
-            try:
-                downsample_raster(str(tmp), str(tmp_ds), factor)
-                tmp.unlink(missing_ok=True)
-                tmp_ds.replace(tmp)  # replace original tmp with downsampled
-                # (optional) log: logger.info("Downsampled %s (%.1f MB) by %dx", tmp.name, mb, factor)
-            except Exception as e:
-                # If downsample fails, keep original tmp and continue
-                if tmp_ds.exists():
-                    tmp_ds.unlink(missing_ok=True)
-                logger.warning("Downsample skipped (%s): %s", tmp.name, e)
-    except Exception as e:
-        logger.warning("Downsample decision failed (%s): %s", tmp.name, e)
-
-
-    # >>> CHANGED: save using the real filename (with numbering on duplicates)
-    existing_names = [it["name"] for it in db["items"]]
-    display_name = _unique_display_name(Path(file.filename).name, existing_names)
-    final = UPLOADS / display_name
-    tmp.rename(final)
+        rec = await UPLOAD_SESSIONS.append(upload_id, offset, request.stream())
+    except KeyError:
+        return _bad("upload not found", 404)
+    except UploadConflict as e:
+        return JSONResponse(status_code=409, content={"error": str(e), "offset": e.offset})
+    except ValueError as e:
+        UPLOAD_SESSIONS.discard(upload_id)
+        return _bad(str(e))
+    return _ok({"upload_id": upload_id, "offset": rec["offset"], "size": rec["size"]})
 
-    rid = uuid.uuid4().hex
-    entry = {"id": rid, "name": display_name, "path": str(final), "sha1": sha1}
-    db["items"].append(entry)
-    _save_db(db)
-    if rid in RENDER_STATS: del RENDER_STATS[rid]
-    return _ok({"id": rid, "name": entry["name"]})
+@app.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str):
+    try:
+        part, sha1, rec = UPLOAD_SESSIONS.finish(upload_id)
+    except KeyError:
+        return _bad("upload not found", 404)
+    except UploadConflict as e:
+        return JSONResponse(status_code=409, content={"error": "upload incomplete", "offset": e.offset})
+    except ValueError as e:
+        return _bad(str(e))
+    tmp = UPLOAD_TMP_DIR / f"tmp_{uuid.uuid4().hex}{Path(rec['filename']).suffix.lower()}"
+    part.replace(tmp)
+    UPLOAD_SESSIONS.discard(upload_id)
+    return _store_upload(tmp, rec["filename"], sha1)
+
+@app.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    found = UPLOAD_SESSIONS.get(upload_id) is not None
+    UPLOAD_SESSIONS.discard(upload_id)
+    return _ok({"deleted": found})
 
 @app.get("/rasters/{rid}/status")
 def raster_status(rid: str):
-    path = _raster_path_by_id(rid)
-    if not path:
+    rec = _raster_record(rid)
+    if not rec:
         return _bad("raster not found", 404)
-    bounds_wgs84 = None
-    try:
-        with rasterio.open(path) as ds:
-            b = ds.bounds
-            wgs = transform_bounds(ds.crs, "EPSG:4326", b.left, b.bottom, b.right, b.top, densify_pts=21)
-            bounds_wgs84 = [wgs[0], wgs[1], wgs[2], wgs[3]]
-    except Exception:
-        pass
+    rec = _ingest_lost(rec)
+    state = rec.get("state", "done")
+    if state != "done":
+        return _ok({
+            "status": {"state": state, "error": rec.get("error")},
+            "job_id": rec.get("job_id"),
+            "bounds": rec.get("bounds_wgs84"),
+        })
+    if not Path(rec["path"]).exists():
+        return _bad("raster not found", 404)
+    if "width" not in rec:
+        # records imported without metadata: describe once, then it's stored
+        try:
+            rec = RASTERS.update(rid, **describe_raster(rec["path"]))
+        except Exception:
+            pass
     return _ok({
         "status": {"state": "done"},
         "tile_url": f"/tiles/{rid}/{{z}}/{{x}}/{{y}}.png",
         "zooms": list(range(0, 23)),
-        "bounds": bounds_wgs84,
+        "bounds": rec.get("bounds_wgs84"),
+        "width": rec.get("width"),
+        "height": rec.get("height"),
+        "count": rec.get("count"),
+        "crs": rec.get("crs"),
     })
 
+@app.get("/rasters/{rid}/stats")
+def raster_stats(rid: str, pmin: float | None = None, pmax: float | None = None,
+                 vmin: str | None = None, vmax: str | None = None):
+    """Stored per-band stats (percentiles, histogram, nodata fraction) and the stretch tiles would use."""
+    rec = _raster_record(rid)
+    if not rec:
+        return _bad("raster not found", 404)
+    if rec.get("state", "done") != "done" or not Path(rec["path"]).exists():
+        return _bad("raster not ready", 409)
+    stats = _get_render_stats(rid, Path(rec["path"]))
+    try:
+        vmins, vmaxs = _render_stretch(stats, pmin, pmax, vmin, vmax)
+    except ValueError as e:
+        return _bad(str(e))
+    return _ok({"id": rid, "stats": stats, "stretch": {"vmin": vmins, "vmax": vmaxs}})
+
 @app.delete("/rasters/{rid}")
 def delete_raster(rid: str):
-    db = _load_db()
-    kept, deleted = [], False
-    for it in db.get("items", []):
-        if it["id"] == rid:
-            deleted = True
-            try: Path(it["path"]).unlink(missing_ok=True)
-            except Exception: pass
-        else:
-            kept.append(it)
-    db["items"] = kept
-    _save_db(db)
+    it = RASTERS.delete(rid)
+    deleted = it is not None
+    DATASETS.invalidate(rid)  # close handles before the file goes away
+    if deleted:
+        try: Path(it["path"]).unlink(missing_ok=True)
+        except Exception: pass
+        CATALOG.forget([it["path"]])
     if rid in RENDER_STATS: del RENDER_STATS[rid]
+    TILE_CACHE.invalidate(rid)
     return _ok({"deleted": deleted})
 
 # ---------------- tiny tile server (consistent colors across tiles)
-@app.get("/tiles/{rid}/{z}/{x}/{y}.png")
-def tile_png(rid: str, z: int, x: int, y: int):
-    path = _raster_path_by_id(rid)
-    if not path:
+def _tile_overview_level(rid: str, path: Path, z: int, x: int, y: int) -> int | None:
+    """Internal overview matching this tile's zoom (None = full resolution)."""
+    with DATASETS.open(rid, path) as ds:
+        if not ds.overviews(1):
+            return None
+        west, south, east, north = _tile_bounds_wgs84(x, y, z)
+        rb = transform_bounds("EPSG:4326", ds.crs, west, south, east, north, densify_pts=21)
+        win = from_bounds(*rb, transform=ds.transform)
+        return pick_overview_level(ds, max(win.width, win.height) / 256.0)
+
+def _render_tile(rid: str, path: Path, z: int, x: int, y: int, vmins: list, vmaxs: list,
+                 fmt: str = "png") -> tuple[bytes, StageTimer]:
+    """Render one XYZ tile of a raster (uncached), stretching band b over vmins[b]..vmaxs[b]."""
+    timer = StageTimer()
+    level = _tile_overview_level(rid, path, z, x, y)
+    with DATASETS.open(rid, path, level) as ds:
+        west, south, east, north = _tile_bounds_wgs84(x, y, z)  # XYZ bounds in EPSG:4326
+        rb = transform_bounds("EPSG:4326", ds.crs, west, south, east, north, densify_pts=21)
+
+        idxs = list(range(1, min(3, ds.count) + 1)) or [1]
+        win = from_bounds(*rb, transform=ds.transform)
+        timer.lap("open")
+
+        # masked read: nodata / out-of-bounds pixels are masked
+        data = ds.read(
+            indexes=idxs,
+            window=win,
+            out_shape=(len(idxs), 256, 256),
+            resampling=Resampling.bilinear,
+            boundless=True,
+            masked=True
+        )
+    timer.lap("read")
+
+    # transparent where any band is invalid (looks better at edges than "all")
+    invalid = np.ma.getmaskarray(data).any(axis=0)
+    if invalid.all():
+        timer.lap("stretch")
+        return TRANSPARENT_PNG_1x1, timer
+    planes = stretch_planes(data.data, invalid if invalid.any() else None, vmins, vmaxs)
+    timer.lap("stretch")
+    out = encode_tile(planes, fmt, png_level=TILE_PNG_LEVEL, quality=TILE_QUALITY)
+    timer.lap("encode")
+    return out, timer
+
+
+def _tile_response(content: bytes, etag: str | None = None, status_code: int = 200,
+                   media_type: str = "image/png", timing: str | None = None) -> Response:
+    headers = {"Cache-Control": f"public, max-age={TILE_MAX_AGE}"}
+    if etag:
+        headers["ETag"] = etag
+    if timing:
+        headers["Server-Timing"] = timing
+    return Response(content=content, status_code=status_code, media_type=media_type, headers=headers)
+
+def _render_and_cache(rid: str, path: Path, key: str, z: int, x: int, y: int, vmins: list, vmaxs: list,
+                      fmt: str) -> tuple[bytes, str]:
+    data, timer = _render_tile(rid, path, z, x, y, vmins, vmaxs, fmt)
+    TILE_CACHE.put(rid, key, data)
+    timer.lap("cache")
+    for stage, ms in timer.stages.items():
+        STAGE_SECONDS.observe(ms / 1000.0, stage=f"tile_{stage}")
+    return data, timer.server_timing()
+
+async def _serve_tile(rid: str, z: int, x: int, y: int, request: Request, fmt: str,
+                      pmin: float | None, pmax: float | None, vmin: str | None, vmax: str | None):
+    """
+    Memory cache hits are answered on the event loop; the raster record, the
+    disk cache tier and misses are handled off it (threadpool / RENDER_POOL).
+    Renders are shared by concurrent requests for the same tile and dropped
+    from the queue if every requester disconnects first. Rendered tiles report their
+    stage timings in a `Server-Timing` header.
+
+    The stretch defaults to the raster's stored 2-98 % percentiles; `pmin` /
+    `pmax` pick other percentiles and `vmin` / `vmax` (one value or one per
+    band) set it explicitly.
+    """
+    rec, path = await run_in_threadpool(_raster_record_and_path, rid)
+    if path is None:
         return _bad("raster not found", 404)
     try:
-        with rasterio.open(path) as ds:
-            west, south, east, north = _tile_bounds_wgs84(x, y, z)  # XYZ bounds in EPSG:4326
-            rb = transform_bounds("EPSG:4326", ds.crs, west, south, east, north, densify_pts=21)
-
-            idxs = list(range(1, min(3, ds.count) + 1)) or [1]
-            win = from_bounds(*rb, transform=ds.transform)
-            out_h = out_w = 256
-
-            # IMPORTANT: read as masked so nodata/out-of-bounds are masked True
-            data = ds.read(
-                indexes=idxs,
-                window=win,
-                out_shape=(len(idxs), out_h, out_w),
-                resampling=Resampling.bilinear,
-                boundless=True,
-                masked=True
-            ).astype("float32")
-
-            # Alpha: transparent where ALL bands are masked (or any, depending on preference)
-            # Using "any" tends to look better at edges:
-            mask_any = np.any(data.mask, axis=0)  # True where at least one band is invalid
-            alpha = np.where(mask_any, 0, 255).astype("uint8")
-
-            # Prepare for scaling but preserve mask
-            vmins, vmaxs = _get_render_stats(rid, ds)
-
-            # Fill masked with NaN before scaling so they stay out of the math
-            filled = np.where(~data.mask, data, np.nan)
-
-            for b in range(filled.shape[0]):
-                vmin = vmins[b if b < len(vmins) else -1]
-                vmax = vmaxs[b if b < len(vmaxs) else -1]
-                if vmax == vmin:
-                    # avoid divide-by-zero -> make band neutral gray (or zeros)
-                    filled[b] = 0.0
-                else:
-                    filled[b] = (filled[b] - vmin) / (vmax - vmin)
-
-            # Clip and put masked pixels back to 0 (alpha will hide them anyway)
-            filled = np.clip(filled, 0, 1)
-            filled = np.where(~data.mask, filled, 0.0)
-
-            if filled.shape[0] == 1:
-                filled = np.repeat(filled, 3, axis=0)
-
-            rgb = (filled[:3] * 255).astype("uint8")
-
-            # Optional: if everything is transparent, serve a tiny transparent tile
-            if np.all(alpha == 0):
-                return Response(content=TRANSPARENT_PNG_1x1, media_type="image/png")
-
-            from PIL import Image
-            rgba = np.dstack([rgb[0], rgb[1], rgb[2], alpha])
-            im = Image.fromarray(rgba, mode="RGBA")
-            buf = BytesIO()
-            im.save(buf, format="PNG")
-            return Response(content=buf.getvalue(), media_type="image/png")
-
+        stats = RENDER_STATS.get(rid)
+        if stats is None:
+            stats = await RENDER_POOL.run(f"stats:{rid}", _get_render_stats, rid, path,
+                                          is_disconnected=request.is_disconnected)
+        try:
+            vmins, vmaxs = _render_stretch(stats, pmin, pmax, vmin, vmax)
+        except ValueError as e:
+            return _bad(str(e))
+        encoding = (fmt, TILE_PNG_LEVEL) if fmt == "png" else (fmt, TILE_QUALITY)
+        key = tile_key(rid, rec.get("sha1"), (vmins, vmaxs), z, x, y, *encoding)
+        etag = f'"{key}"'
+        if etag in (request.headers.get("if-none-match") or ""):
+            return _tile_response(b"", etag, status_code=304, media_type=TILE_FORMATS[fmt])
+
+        data, timing = TILE_CACHE.get_memory(rid, key), "cache;desc=hit"
+        if data is None:
+            data = await run_in_threadpool(TILE_CACHE.get, rid, key)
+        if data is None:
+            data, timing = await RENDER_POOL.run(key, _render_and_cache, rid, path, key, z, x, y, vmins, vmaxs, fmt,
+                                                 is_disconnected=request.is_disconnected)
+        t = current_trace()
+        if t is not None:
+            t.attrs["server_timing"] = timing
+        # empty tiles are always the 1x1 transparent PNG
+        media_type = "image/png" if data == TRANSPARENT_PNG_1x1 else TILE_FORMATS[fmt]
+        return _tile_response(data, etag, media_type=media_type, timing=timing)
+
+    except RenderAbandoned:
+        # nobody is listening any more
+        return Response(status_code=499, headers={"Cache-Control": "no-store"})
     except Exception:
-        return Response(content=TRANSPARENT_PNG_1x1, media_type="image/png")
+        # failed renders are not cached, by us or by the browser
+        TILE_ERRORS.inc()
+        logger.exception("tile %s/%s/%s/%s.%s failed", rid, z, x, y, fmt)
+        return Response(content=TRANSPARENT_PNG_1x1, media_type="image/png", headers={"Cache-Control": "no-store"})
+
+@app.get("/tiles/{rid}/{z}/{x}/{y}.png")
+async def tile_png(rid: str, z: int, x: int, y: int, request: Request,
+                   pmin: float | None = None, pmax: float | None = None,
+                   vmin: str | None = None, vmax: str | None = None):
+    return await _serve_tile(rid, z, x, y, request, "png", pmin, pmax, vmin, vmax)
+
+@app.get("/tiles/{rid}/{z}/{x}/{y}.webp")
+async def tile_webp(rid: str, z: int, x: int, y: int, request: Request,
+                    pmin: float | None = None, pmax: float | None = None,
+                    vmin: str | None = None, vmax: str | None = None):
+    return await _serve_tile(rid, z, x, y, request, "webp", pmin, pmax, vmin, vmax)
+
+@app.get("/tiles/{rid}/{z}/{x}/{y}.jpg")
+async def tile_jpg(rid: str, z: int, x: int, y: int, request: Request,
+                   pmin: float | None = None, pmax: float | None = None,
+                   vmin: str | None = None, vmax: str | None = None):
+    """JPEG has no alpha: nodata comes out black."""
+    return await _serve_tile(rid, z, x, y, request, "jpg", pmin, pmax, vmin, vmax)
+
+@app.get("/tiles/_cache")
+def tile_cache_stats():
+    return _ok(TILE_CACHE.stats())
+
+@app.get("/tiles/_render")
+def tile_render_stats():
+    return _ok(RENDER_POOL.stats())
+
+# ---------------- vector tiles
+LAYER_DIRS = (SEGMENTS_DIR, CLASSIFY_DIR, MERGED_CLEAN_DIR, RESULTS)
+
+def _find_layer(layer_id: str) -> Path | None:
+    for d in LAYER_DIRS:
+        p = layer_path(d, layer_id)
+        if p is not None:
+            return p
+    return None
+
+def _vtiles_url(layer_id: str) -> str:
+    return f"/vtiles/{layer_id}/{{z}}/{{x}}/{{y}}.pbf"
+
+@app.get("/vtiles/{layer_id}/{z}/{x}/{y}.pbf")
+def vector_tile(layer_id: str, z: int, x: int, y: int, request: Request, props: str | None = None):
+    """Mapbox Vector Tile of a result layer (MVT layer name = layer id); `props` limits the attributes."""
+    src = _find_layer(layer_id)
+    if src is None:
+        return _bad("layer not found", 404)
+    columns = [c.strip() for c in props.split(",") if c.strip()] if props is not None else None
+    key = tile_key(layer_id, src.name, src.stat().st_mtime_ns, z, x, y, columns)
+    etag = f'"{key}"'
+    if etag in (request.headers.get("if-none-match") or ""):
+        return _tile_response(b"", etag, status_code=304, media_type="application/vnd.mapbox-vector-tile")
+
+    data = VTILE_CACHE.get(layer_id, key)
+    if data is None:
+        data = VLAYERS.get(src).tile(layer_id, z, x, y, columns)
+        VTILE_CACHE.put(layer_id, key, data)
+    return _tile_response(data, etag, media_type="application/vnd.mapbox-vector-tile")
+
+@app.get("/vtiles/_cache")
+def vector_tile_cache_stats():
+    return _ok(VTILE_CACHE.stats())
+
+# ---------------- spatial queries: which features are at a point / in a box / polygon
+def _floats(text: str, n: int, what: str) -> list[float]:
+    try:
+        vals = [float(v) for v in text.split(",")]
+    except ValueError:
+        vals = []
+    if len(vals) != n:
+        raise ValueError(f"{what} must be {n} comma-separated numbers")
+    return vals
+
+def _query_layer(layer_id: str, point=None, bbox=None, geometry=None, predicate: str = "intersects",
+                 props=None, with_geometry: bool = False, limit: int | None = None):
+    """
+    Features of a layer at `point` (lon, lat), in `bbox` (minx, miny, maxx, maxy)
+    or selected by a GeoJSON `geometry`, all in EPSG:4326. `props` limits the
+    attributes returned (list or comma-separated); `with_geometry` adds GeoJSON
+    geometries.
+    """
+    src = _find_layer(layer_id)
+    if src is None:
+        return _bad("layer not found", 404)
+    if sum(x is not None for x in (point, bbox, geometry)) != 1:
+        return _bad("give one of point, bbox or geometry")
+    try:
+        if isinstance(point, str):
+            point = _floats(point, 2, "point")
+        if isinstance(bbox, str):
+            bbox = _floats(bbox, 4, "bbox")
+        index = QUERY_INDEX.get(src)
+        if point is not None:
+            lon, lat = map(float, point)
+            idx = index.point(lon, lat)
+        elif bbox is not None:
+            idx = index.bbox(*map(float, bbox), predicate=predicate)
+        else:
+            idx = index.geometry(geometry, predicate)
+    except (ValueError, TypeError) as e:
+        return _bad(str(e))
+    if isinstance(props, str):
+        props = [c.strip() for c in props.split(",") if c.strip()]
+    limit = QUERY_MAX_FEATURES if limit is None else max(1, min(int(limit), QUERY_MAX_FEATURES))
+    feats = index.features(idx[:limit], props, with_geometry)
+    return _ok({"layer_id": layer_id, "ids": [f["id"] for f in feats], "features": feats,
+                "total": int(idx.size), "truncated": idx.size > limit})
+
+@app.get("/layers/{layer_id}/query")
+def query_layer(layer_id: str, point: str | None = None, bbox: str | None = None, predicate: str = "intersects",
+                props: str | None = None, geometry: bool = False, limit: int | None = None):
+    """`?point=lon,lat` (features under a click) or `?bbox=minx,miny,maxx,maxy`."""
+    return _query_layer(layer_id, point=point, bbox=bbox, predicate=predicate, props=props,
+                        with_geometry=geometry, limit=limit)
+
+@app.post("/layers/{layer_id}/query")
+async def query_layer_geometry(layer_id: str, req: Request):
+    """JSON body: one of `point`, `bbox`, `geometry` (GeoJSON), plus `predicate`, `props`, `with_geometry`, `limit`."""
+    try:
+        data = await req.json()
+    except ValueError:
+        return _bad("JSON body required")
+    if not isinstance(data, dict):
+        return _bad("JSON object required")
+    return _query_layer(layer_id, point=data.get("point"), bbox=data.get("bbox"), geometry=data.get("geometry"),
+                        predicate=data.get("predicate", "intersects"), props=data.get("props"),
+                        with_geometry=bool(data.get("with_geometry")), limit=data.get("limit"))
+
+@app.get("/layers/_index")
+def query_index_stats():
+    return _ok(QUERY_INDEX.stats())
+
+@app.get("/tiles/_datasets")
+def tile_dataset_stats():
+    return _ok(DATASETS.stats())
 
 # ---------------- segmentation -> save under results/segments
+# segmentation cache key -> id of the job computing it, so identical requests share one run
+_SEG_INFLIGHT: dict[str, str] = {}
+
+def _seg_inflight(key: str) -> str | None:
+    jid = _SEG_INFLIGHT.get(key)
+    if jid is not None and JOBS.finished(jid):
+        _SEG_INFLIGHT.pop(key, None)
+        return None
+    return jid
+
 # ---- /segment route (replace just this handler body) ----
 @app.post("/segment")
 async def segment(
     raster_id: str = Form(...),
     scale: float = Form(...),
     compactness: float = Form(...),
+    downscale: float | None = Form(None),
+    block_size: int | None = Form(None),
+    overlap: int = Form(SEG_OVERLAP),
+    features: str | None = Form(None),
+    wait: bool = Form(True),
 ):
-    path = _raster_path_by_id(raster_id)
-    if not path:
+    try:
+        groups = parse_groups(SEG_FEATURES if features is None else features)
+    except ValueError as e:
+        return _bad(str(e))
+    # record, file and cache lookups touch the disk: run them off the event loop
+    rec, path = await run_in_threadpool(_raster_record_and_path, raster_id)
+    if path is None:
         return _bad("raster_id not found", 404)
-
-    db = _load_db()
-    rec = next((it for it in db.get("items", []) if it["id"] == raster_id), None)
-    raster_display_name = rec["name"] if rec else Path(path).name
-
-    seg = run_slic_segmentation(str(path), scale=scale, compactness=compactness)
-    fc  = layer_to_geojson(seg)
-
-    fname = _unique_segment_filename(raster_display_name, scale, compactness)
-    (SEGMENTS_DIR / fname).write_text(json.dumps(fc), encoding="utf-8")
-
-    seg_id = Path(fname).stem
-    return _ok({
-        "id": seg_id,
-        "geojson": fc,
-        "geojson_url": f"/results/segments/{fname}"
-    })
+    raster_display_name = rec["name"]
+
+    # windowed SLIC handles rasters of any size at native resolution; the in-memory
+    # path falls back to the size tier (read from overviews, original untouched)
+    if block_size is None:
+        block_size = SEG_BLOCK_SIZE
+    if downscale is None:
+        downscale = 1 if block_size else await run_in_threadpool(_working_downscale, path)
+
+    # same raster content + same parameters -> return the layer we already have
+    params = {
+        "scale": scale, "compactness": compactness, "downscale": downscale,
+        "block_size": block_size or 0, "overlap": overlap if block_size else 0,
+    }
+    key = segment_key(rec.get("sha1") if rec and rec.get("sha1") else str(path), **params)
+    jid = _seg_inflight(key)
+    hit = await run_in_threadpool(SEG_CACHE.lookup, key) if jid is None else None
+    if hit is None and jid is None:
+        jid = _seg_inflight(key)   # started while we looked
+    if jid is not None:
+        # the same segmentation is already running: wait for it instead of starting another
+        if not wait:
+            return _accepted({"id": jid})
+        try:
+            await JOBS.wait(jid)
+        except JobCancelled as e:
+            return _bad(str(e), 409)
+        hit = await run_in_threadpool(SEG_CACHE.lookup, key)
+    if hit is not None:
+        fname = hit["file"]
+        stem = Path(fname).stem
+        out = {
+            "id": stem,
+            "geojson_url": f"/results/segments/{stem}{LEGACY_EXT}",
+            "downscale": downscale,
+            "block_size": block_size or None,
+            "cache": {"hit": True, "key": key, **SEG_CACHE.stats()},
+        }
+        # the cached layer may lack some of the feature groups asked for this time
+        fpath = features_path_for(SEGMENTS_DIR / fname)
+        have = await run_in_threadpool(lambda: list(feature_groups(fpath)) if fpath.exists() else [])
+        if groups and not set(groups) <= set(have):
+            job = JOBS.submit("features", features_task, stem, str(SEGMENTS_DIR), "/results/segments",
+                              [g for g in groups if g not in have])
+            if not wait:
+                return _accepted(job)
+            try:
+                feats = await JOBS.wait(job["id"])
+            except JobCancelled as e:
+                return _bad(str(e), 409)
+            except FileNotFoundError as e:
+                return _bad(str(e), 404)
+            out["job_id"], have = job["id"], feats["groups"]
+        out["features_url"] = f"/results/segments/{fpath.name}" if have else None
+        out["feature_groups"] = have
+        out["vtiles_url"] = _vtiles_url(stem)
+        return _ok(out)
+
+    job = JOBS.submit(
+        "segment", segment_task,
+        str(path), _segment_stem(raster_display_name, scale, compactness), scale, compactness, downscale,
+        str(SEGMENTS_DIR), "/results/segments", block_size or None, overlap, SEG_WORKERS, groups,
+        on_done=lambda res: (SEG_CACHE.put(key, res["file"], params), _SEG_INFLIGHT.pop(key, None)),
+    )
+    _SEG_INFLIGHT[key] = job["id"]
+    if not wait:
+        return _accepted(job)
+    try:
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
+    return _ok({**res, "vtiles_url": _vtiles_url(res["id"]), "job_id": job["id"],
+                "cache": {"hit": False, "key": key, **SEG_CACHE.stats()}})
+
+@app.post("/features")
+async def compute_features(
+    segment_id: str = Form(...),
+    features: str = Form("all"),
+    wait: bool = Form(True),
+):
+    """(Re)compute a segment layer's feature table from its label raster, without resegmenting."""
+    try:
+        groups = parse_groups(features)
+    except ValueError as e:
+        return _bad(str(e))
+    if not groups:
+        return _bad("no feature groups requested")
+    if layer_path(SEGMENTS_DIR, segment_id) is None:
+        return _bad("segment not found", 404)
+    job = JOBS.submit("features", features_task, segment_id, str(SEGMENTS_DIR), "/results/segments", groups)
+    if not wait:
+        return _accepted(job)
+    try:
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
+    except FileNotFoundError as e:
+        return _bad(str(e), 404)
+    return _ok({**res, "job_id": job["id"]})
 
 
 
 
 # ---------------- listings
-def _collect_geojsons():
-    items = []
-    # segments/
-    for p in sorted(SEGMENTS_DIR.glob("*.geojson")):
-        stem = p.stem
-        items.append({
-            "id": stem, "name": p.name, "url": f"/results/segments/{p.name}",
-            "has_samples": (RESULTS / f"samples_{stem}.json").exists() or (SAMPLES_DIR / f"{stem}.json").exists(),
-        })
-    # classify/
-    for p in sorted(CLASSIFY_DIR.glob("*.geojson")):
-        stem = p.stem
-        items.append({
-            "id": stem, "name": p.name, "url": f"/results/classify/{p.name}",
-            "has_samples": (RESULTS / f"samples_{stem}.json").exists() or (SAMPLES_DIR / f"{stem}.json").exists(),
-        })
-     # merged_cleaned/ 
-    for p in sorted(MERGED_CLEAN_DIR.glob("*.geojson")):
-        stem = p.stem
-        items.append({
-            "id": stem, "name": p.name, "url": f"/results/merged_cleaned/{p.name}",
-            "has_samples": False,
-        })
-    # root (back-compat)
-    for p in sorted(RESULTS.glob("*.geojson")):
-        if p.parent != RESULTS:  # skip subdirs
-            continue
-        stem = p.stem
-        items.append({
-            "id": stem, "name": p.name, "url": f"/results/{p.name}",
-            "has_samples": (RESULTS / f"samples_{stem}.json").exists() or (SAMPLES_DIR / f"{stem}.json").exists(),
-        })
-    return items
+# layers are stored as GeoParquet (or legacy GeoJSON); the listed url is always the
+# .geojson export, which ResultFiles produces on request. Listings come from CATALOG.
+_LAYER_URLS = {
+    str(SEGMENTS_DIR): "/results/segments",
+    str(CLASSIFY_DIR): "/results/classify",
+    str(MERGED_CLEAN_DIR): "/results/merged_cleaned",
+    str(RESULTS): "/results",    # back-compat
+}
+_MAX_PAGE = 1000
+
+def _layer_item(row: dict, raster_ids: dict) -> dict:
+    url_dir = _LAYER_URLS[row["dir"]]
+    return {
+        "id": row["id"], "name": f"{row['id']}{LEGACY_EXT}", "url": f"{url_dir}/{row['id']}{LEGACY_EXT}",
+        "vtiles_url": _vtiles_url(row["id"]),
+        "format": row["format"],
+        "has_samples": row["has_samples"] and url_dir != "/results/merged_cleaned",
+        "kind": row["kind"], "parent": row["parent"], "raster_id": raster_ids.get(row["source"]),
+        "features": row["features"], "bbox": row["bbox"], "crs": row["crs"], "size": row["size"],
+    }
+
+def _layer_listing(key: str, dirs, kind=None, has_samples: bool | None = None, limit: int | None = None,
+                   offset: int = 0, q: str | None = None, raster_id: str | None = None, bbox: str | None = None):
+    """
+    One page of catalogued layers. Everything is listed unless `limit` is given;
+    `kind` (comma-separated), `q` (id substring), `has_samples`, `raster_id` (the
+    raster a layer was segmented from) and `bbox` (minx,miny,maxx,maxy in the
+    layers' CRS, EPSG:4326) filter.
+    """
+    source = None
+    if raster_id:
+        rec = _raster_record(raster_id)
+        if rec is None:
+            return _bad("raster not found", 404)
+        source = rec["path"]
+    box = None
+    if bbox:
+        try:
+            box = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            box = []
+        if len(box) != 4:
+            return _bad("bbox must be minx,miny,maxx,maxy")
+    kinds = [k.strip() for k in kind.split(",") if k.strip()] if isinstance(kind, str) else kind
+    if limit is not None:
+        limit = max(1, min(int(limit), _MAX_PAGE))
+    offset = max(0, int(offset))
+    rows, total = CATALOG.layers(dirs=dirs, kind=kinds, q=q, has_samples=has_samples, source=source, bbox=box,
+                                 limit=limit, offset=offset)
+    raster_ids = {it["path"]: it["id"] for it in RASTERS.list()}
+    out = {key: [_layer_item(r, raster_ids) for r in rows], "total": total}
+    if offset + len(rows) < total:
+        out["next_offset"] = offset + len(rows)
+    return _ok(out)
 
 @app.get("/geojsons")
-def list_geojsons():
-    return _ok({"items": _collect_geojsons()})
-
-def _segment_items():
-    """All segments (segments/ plus backward-compat in results/)."""
-    out = []
-    for p in sorted(SEGMENTS_DIR.glob("*.geojson")):
-        stem = p.stem
-        out.append({"id": stem, "name": p.name, "url": f"/results/segments/{p.name}"})
-    for p in sorted(RESULTS.glob("segment_*.geojson")):
-        if p.parent != RESULTS:
-            continue
-        stem = p.stem
-        out.append({"id": stem, "name": p.name, "url": f"/results/{p.name}"})
-    return out
-
-def _segment_items_with_samples():
-    """Only segments that have a matching samples JSON in results/samples/."""
-    items = _segment_items()
-    out = []
-    for it in items:
-        seg_id = it["id"]  # this is the file stem
-        has_samples = (SAMPLES_DIR / f"{seg_id}.json").exists() or (SAMPLES_DIR / f"samples_{seg_id}.json").exists()
-        if has_samples:
-            out.append(it)
-    return out
+def list_geojsons(limit: int | None = None, offset: int = 0, kind: str | None = None, q: str | None = None,
+                  has_samples: bool | None = None, raster_id: str | None = None, bbox: str | None = None):
+    return _layer_listing("items", (SEGMENTS_DIR, CLASSIFY_DIR, MERGED_CLEAN_DIR, RESULTS), kind, has_samples,
+                          limit, offset, q, raster_id, bbox)
 
 @app.get("/segments")
-def get_segments():
-    # all segments
-    return _ok({"segments": _segment_items()})
+def get_segments(limit: int | None = None, offset: int = 0, q: str | None = None,
+                 has_samples: bool | None = None, raster_id: str | None = None, bbox: str | None = None):
+    # all segments (segments/ plus backward-compat in results/)
+    return _layer_listing("segments", (SEGMENTS_DIR, RESULTS), "segment", has_samples,
+                          limit, offset, q, raster_id, bbox)
 
 @app.get("/segments_index")
-def get_segments_index():
-    # only those with samples in results/samples/
-    return _ok({"items": _segment_items_with_samples()})
+def get_segments_index(limit: int | None = None, offset: int = 0, q: str | None = None,
+                       raster_id: str | None = None, bbox: str | None = None):
+    # only those with saved samples
+    return _layer_listing("items", (SEGMENTS_DIR, RESULTS), "segment", True, limit, offset, q, raster_id, bbox)
+
+@app.get("/catalog/_stats")
+def catalog_stats():
+    return _ok(CATALOG.stats())
 
 # ---------------- samples + classify
 @app.post("/samples")
 async def save_samples(req: Request):
+    """
+    Save {class: [segment ids]} for a segment layer. `points` ({class: [[lon, lat], ...]})
+    and `geometries` ({class: [GeoJSON, ...]}) are resolved to segment ids on the
+    server, so the client doesn't need the layer's polygons; `merge: true` adds to
+    the samples already saved instead of replacing them.
+    """
     data = await req.json()
     segment_id = data.get("segment_id")
     samples = data.get("samples", {})
-    if not segment_id or not isinstance(samples, dict):
+    points = data.get("points") or {}
+    geometries = data.get("geometries") or {}
+    if not segment_id or not all(isinstance(x, dict) for x in (samples, points, geometries)):
         return _bad("segment_id and samples required")
+    if data.get("merge"):
+        try:
+            saved = json.loads((SAMPLES_DIR / f"{segment_id}.json").read_text(encoding="utf-8"))["samples"]
+        except (OSError, ValueError, KeyError):
+            saved = {}
+        samples = {cls: list(saved.get(cls, [])) + [i for i in ids if i not in saved.get(cls, [])]
+                   for cls, ids in {**saved, **samples}.items()}
+    missed = 0
+    if points or geometries:
+        src = _find_layer(segment_id)
+        if src is None:
+            return _bad("segment layer not found", 404)
+        try:
+            found, missed = await run_in_threadpool(lambda: QUERY_INDEX.get(src).pick(points, geometries))
+        except (ValueError, TypeError) as e:
+            return _bad(f"bad points or geometries: {e}")
+        # a segment picked on the map belongs to the class it was picked for last
+        for cls, ids in found.items():
+            for other in samples:
+                if other != cls:
+                    samples[other] = [i for i in samples[other] if i not in ids]
+            have = samples.setdefault(cls, [])
+            have.extend(i for i in dict.fromkeys(ids) if i not in have)
     out = {"segment_id": segment_id, "samples": samples}
-    (RESULTS / f"samples_{segment_id}.json").write_text(json.dumps(out, indent=2), encoding="utf-8")
-    (SAMPLES_DIR / f"{segment_id}.json").write_text(json.dumps(out, indent=2), encoding="utf-8")
-    return _ok({"saved": True})
+    for p in (RESULTS / f"samples_{segment_id}.json", SAMPLES_DIR / f"{segment_id}.json"):
+        p.write_text(json.dumps(out, indent=2), encoding="utf-8")
+        CATALOG.refresh(p)
+    if not (points or geometries):
+        return _ok({"saved": True})
+    return _ok({"saved": True, "counts": {cls: len(ids) for cls, ids in samples.items()}, "unmatched": missed})
 
 @app.post("/classify")
 async def classify(
     segment_id: str = Form(...),
     method: str = Form("rf"),
+    features: str | None = Form(None),
+    retrain: bool = Form(False),
+    wait: bool = Form(True),
 ):
-    # run the external classifier
+    # features: restrict training to these groups of the segment's feature table (default: all columns)
     try:
-        res = run_classification(
-            segment_id=segment_id,
-            method=method,
-            results_dir=str(RESULTS),        # expects results/segments and results/samples
-            classified_dir=str(CLASSIFY_DIR) # writes temporary result here
-        )
+        groups = list(parse_groups(features)) if features else None
+    except ValueError as e:
+        return _bad(str(e))
+    # run the external classifier in a worker process
+    job = JOBS.submit(
+        "classify", classify_task,
+        segment_id, method, str(RESULTS), str(CLASSIFY_DIR), "/results/classify", groups, str(MODELS_DIR), retrain,
+    )
+    if not wait:
+        return _accepted(job)
+    try:
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
     except FileNotFoundError as e:
         return _bad(str(e), 404)
     except ValueError as e:
@@ -513,38 +1242,176 @@ async def classify(
     except Exception as e:
         return _bad(f"classification failed: {e}", 500)
 
-    # read the produced file
+    return _ok({**res, "vtiles_url": _vtiles_url(res["id"]), "job_id": job["id"]})
+
+
+
+@app.post("/predict")
+async def predict(
+    model_id: str = Form(...),
+    segment_id: str = Form(...),
+    wait: bool = Form(True),
+):
+    """Classify a segment layer with a stored model (no samples, no retraining)."""
+    if MODELS.get(model_id) is None:
+        return _bad("model not found", 404)
+    job = JOBS.submit(
+        "predict", predict_task,
+        model_id, segment_id, str(RESULTS), str(CLASSIFY_DIR), "/results/classify", str(MODELS_DIR),
+    )
+    if not wait:
+        return _accepted(job)
     try:
-        with open(res["output_geojson"], "r", encoding="utf-8") as f:
-            fc = json.load(f)
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
+    except FileNotFoundError as e:
+        return _bad(str(e), 404)
+    except ValueError as e:
+        return _bad(str(e), 400)
     except Exception as e:
-        return _bad(f"failed reading result: {e}", 500)
+        return _bad(f"prediction failed: {e}", 500)
+    return _ok({**res, "vtiles_url": _vtiles_url(res["id"]), "job_id": job["id"]})
 
-    # final name: replace leading 'segment_' with 'classify_'
-    base = segment_id
-    if base.startswith("segment_"):
-        base = base[len("segment_"):]
-    out_name = f"classify_{base}.geojson"
-    out_path = CLASSIFY_DIR / out_name
-
-    # save final file (simple overwrite)
+@app.post("/classmap")
+async def classmap(
+    segment_id: str | None = Form(None),
+    raster_id: str | None = Form(None),
+    method: str = Form("rf"),
+    model_id: str | None = Form(None),
+    features: str | None = Form(None),
+    retrain: bool = Form(False),
+    scale: float | None = Form(None),
+    compactness: float | None = Form(None),
+    downscale: float | None = Form(None),
+    wait: bool = Form(True),
+):
+    """
+    Classified and dissolved polygons in one pass over the label raster
+    (results/merged_cleaned/classmap_<base>.parquet), instead of /classify + /merge_clean.
+    segment_id: classify that layer's feature table (its samples, or `model_id`).
+    raster_id + scale + compactness + model_id: segment, extract and predict without any segment polygons.
+    """
+    if model_id and MODELS.get(model_id) is None:
+        return _bad("model not found", 404)
+    if segment_id:
+        if layer_path(SEGMENTS_DIR, segment_id) is None:
+            return _bad("segment not found", 404)
+        try:
+            groups = list(parse_groups(features)) if features else None
+        except ValueError as e:
+            return _bad(str(e))
+        job = JOBS.submit(
+            "classmap", classmap_task,
+            Path(layer_path(SEGMENTS_DIR, segment_id)).stem, method, str(RESULTS), str(MERGED_CLEAN_DIR),
+            "/results/merged_cleaned", str(MODELS_DIR), groups, retrain, model_id,
+        )
+    elif raster_id:
+        if not model_id or scale is None or compactness is None:
+            return _bad("raster_id needs model_id, scale and compactness")
+        rec = _raster_record(raster_id)
+        path = Path(rec["path"]) if rec else None
+        if not path or not path.exists():
+            return _bad("raster_id not found", 404)
+        if downscale is None:
+            downscale = _working_downscale(path)
+        job = JOBS.submit(
+            "classmap", raster_classmap_task,
+            str(path), _segment_stem(rec["name"], scale, compactness), scale, compactness, downscale,
+            model_id, str(MODELS_DIR), str(MERGED_CLEAN_DIR), "/results/merged_cleaned",
+        )
+    else:
+        return _bad("give segment_id or raster_id")
+    if not wait:
+        return _accepted(job)
     try:
-        out_path.write_text(json.dumps(fc), encoding="utf-8")
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
+    except FileNotFoundError as e:
+        return _bad(str(e), 404)
+    except ValueError as e:
+        return _bad(str(e), 400)
     except Exception as e:
-        return _bad(f"failed saving result: {e}", 500)
+        return _bad(f"classmap failed: {e}", 500)
+    return _ok({**res, "vtiles_url": _vtiles_url(res["id"]), "job_id": job["id"]})
 
-    # (optional) clean the temp file written by classification.py
+@app.post("/models/select")
+async def select_model(
+    segment_id: str = Form(...),
+    methods: str = Form(",".join(SELECT_METHODS)),
+    grid: str | None = Form(None),
+    folds: int = Form(5),
+    scoring: str = Form("f1_macro"),
+    time_budget: float | None = Form(None),
+    features: str | None = Form(None),
+    apply: bool = Form(False),
+    wait: bool = Form(True),
+):
+    """
+    Cross-validate rf / svm / knn over a parameter grid on the segment's samples
+    and keep the best model. `grid` is JSON, {method: {param: [values]}}, replacing
+    the default grid of the methods it names; `time_budget` is in seconds (default
+    OBIA_SELECT_BUDGET). Returns the ranked leaderboard and the stored `model_id`;
+    with `apply=true` the layer is also classified with the winner, like /classify.
+    """
+    chosen = [m.strip().lower() for m in methods.split(",") if m.strip()]
+    if not chosen or any(m not in SELECT_METHODS for m in chosen):
+        return _bad(f"methods must be any of: {', '.join(SELECT_METHODS)}")
+    if scoring not in SELECT_SCORES:
+        return _bad(f"scoring must be one of: {', '.join(SELECT_SCORES)}")
     try:
-        if os.path.exists(res["output_geojson"]) and os.path.abspath(res["output_geojson"]) != os.path.abspath(out_path):
-            os.remove(res["output_geojson"])
-    except Exception:
-        pass
+        grid_spec = json.loads(grid) if grid else None
+    except ValueError:
+        return _bad("grid must be JSON")
+    if grid_spec is not None and not isinstance(grid_spec, dict):
+        return _bad("grid must be a JSON object")
+    try:
+        groups = list(parse_groups(features)) if features else None
+    except ValueError as e:
+        return _bad(str(e))
+    budget = SELECT_BUDGET if time_budget is None else time_budget
+    job = JOBS.submit(
+        "select_model", select_model_task,
+        segment_id, str(RESULTS), str(MODELS_DIR), chosen, grid_spec, folds, scoring, budget if budget > 0 else None,
+        groups, SELECT_WORKERS, apply, str(CLASSIFY_DIR), "/results/classify",
+    )
+    if not wait:
+        return _accepted(job)
+    try:
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
+    except FileNotFoundError as e:
+        return _bad(str(e), 404)
+    except ValueError as e:
+        return _bad(str(e), 400)
+    except Exception as e:
+        return _bad(f"model selection failed: {e}", 500)
+    if res.get("classified"):
+        res["classified"]["vtiles_url"] = _vtiles_url(res["classified"]["id"])
+    return _ok({**res, "job_id": job["id"]})
+
+@app.get("/models")
+def list_models():
+    return _ok({"models": MODELS.list()})
+
+@app.get("/models/{model_id}")
+def get_model(model_id: str):
+    rec = MODELS.get(model_id)
+    if rec is None:
+        return _bad("model not found", 404)
+    return _ok(rec)
 
-    return _ok({"geojson": fc, "geojson_url": f"/results/classify/{out_name}"})
+@app.delete("/models/{model_id}")
+def delete_model(model_id: str):
+    if not MODELS.delete(model_id):
+        return _bad("model not found", 404)
+    return _ok({"deleted": model_id})
 
 
 
-ALLOWED_DELETE_EXTS = (".geojson", ".json", ".tif", ".tiff", ".png", ".jpg", ".jpeg")
+ALLOWED_DELETE_EXTS = (".geojson", ".parquet", ".json", ".tif", ".tiff", ".png", ".jpg", ".jpeg")
 RASTER_EXTS = (".tif", ".tiff", ".png", ".jpg", ".jpeg")
 
 @app.post("/delete")
@@ -563,48 +1430,43 @@ async def delete_file(request: Request, name: str = Form(None)):
     root, ext = os.path.splitext(base)
     ext_ok = ext and ext.lower() in ALLOWED_DELETE_EXTS
     candidates = [base] if ext_ok else [base + e for e in ALLOWED_DELETE_EXTS]
+    if ext.lower() == LEGACY_EXT:
+        candidates.append(root + LAYER_EXT)   # "<layer>.geojson" names the stored GeoParquet layer
 
-    # scan: results/* (one level), uploads/ and uploads/* (one level)
-    scan_dirs: list[Path] = []
-    if RESULTS.exists() and RESULTS.is_dir():
-        for sub in RESULTS.iterdir():
-            if sub.is_dir():
-                scan_dirs.append(sub)
-    if UPLOADS.exists() and UPLOADS.is_dir():
-        scan_dirs.append(UPLOADS)
-        for sub in UPLOADS.iterdir():
-            if sub.is_dir():
-                scan_dirs.append(sub)
+    # close pooled handles of any raster we may be about to delete
+    for it in RASTERS.list():
+        if it["name"] in candidates or os.path.basename(it["path"]) in candidates:
+            DATASETS.invalidate(it["id"])
 
     removed = []
     deleted_upload_raster_names = set()
 
-    for d in scan_dirs:
-        for cand in candidates:
-            p = d / cand  # exact, case-sensitive
-            if p.is_file():
-                logger.info("scan dir %s", p)
-                p.unlink()
-                removed.append(str(p))
-                if str(p).startswith(str(UPLOADS)) and p.suffix.lower() in RASTER_EXTS:
-                    deleted_upload_raster_names.add(p.name)
-
-    # prune uploads/_raster.json if we deleted any rasters from uploads
+    # catalogued files of that name: results/, uploads/ and their sub-directories (exact, case-sensitive)
+    for p in CATALOG.find(candidates):
+        if not p.is_file():
+            CATALOG.forget([p])
+            continue
+        logger.info("delete %s", p)
+        p.unlink()
+        removed.append(str(p))
+        if p.suffix in (LAYER_EXT, LEGACY_EXT):
+            VLAYERS.invalidate(p)
+            QUERY_INDEX.invalidate(p)
+            VTILE_CACHE.invalidate(p.stem)
+        if p.parent == SEGMENTS_DIR and p.suffix in (LAYER_EXT, LEGACY_EXT):
+            for side in segment_sidecars(p):
+                if side.exists():
+                    side.unlink()
+                    removed.append(str(side))
+        if str(p).startswith(str(UPLOADS)) and p.suffix.lower() in RASTER_EXTS:
+            deleted_upload_raster_names.add(p.name)
+    CATALOG.forget(removed)
+
+    # prune the raster store if we deleted any rasters from uploads
     if deleted_upload_raster_names:
-        db_path = UPLOADS / "_rasters.json"
-        if db_path.exists():
-            db = json.loads(db_path.read_text(encoding="utf-8"))
-            items = db.get("items", [])
-            keep = []
-            for it in items:
-                it_name = str(it.get("name", ""))
-                it_base = os.path.basename(str(it.get("path", "")))
-                if (it_name in deleted_upload_raster_names) or (it_base in deleted_upload_raster_names):
-                    continue
-                keep.append(it)
-            if len(keep) != len(items):
-                db["items"] = keep
-                db_path.write_text(json.dumps(db, indent=2), encoding="utf-8")
+        for it in RASTERS.delete_by_file_names(deleted_upload_raster_names):
+            RENDER_STATS.pop(it["id"], None)
+            TILE_CACHE.invalidate(it["id"])
 
     if not removed:
         return _bad("file not found", 404)
@@ -619,39 +1481,97 @@ async def merge_clean(
     class_column: str = Form("classification"),
     target_class: str = Form("all"),
     area_attr: str = Form("area_pixels"),
+    wait: bool = Form(True),
 ):
     """
-    Merge & clean polygons for a classified GeoJSON in results/classify/.
-    Saves output to results/merged_cleaned/merged_<filename>.geojson
+    Merge & clean polygons for a classified layer in results/classify/.
+    Saves output to results/merged_cleaned/merged_<stem>.parquet
     """
-    if not filename.lower().endswith(".geojson"):
-        filename = filename + ".geojson"
-
-    src_path = CLASSIFY_DIR / filename
-    if not src_path.exists():
+    src_path = layer_path(CLASSIFY_DIR, filename)
+    if src_path is None:
         return _bad(f"File not found: {filename}", 404)
 
+    job = JOBS.submit(
+        "merge_clean", merge_clean_task,
+        str(src_path), str(MERGED_CLEAN_DIR), class_column, target_class, area_attr, "/results/merged_cleaned",
+        MERGE_WORKERS,
+    )
+    if not wait:
+        return _accepted(job)
     try:
-        gdf = gpd.read_file(src_path)
-        lyr = Layer(name=src_path.stem, type="vector")
-        lyr.objects = gdf
-        lyr.crs = gdf.crs
-
-        cleaned = merge_clean_polygons(
-            lyr,
-            class_column=class_column,
-            target_class=target_class,
-            area_attr=area_attr,
-        )
-
-        out_name = f"merged_{src_path.stem}.geojson"
-        out_path = MERGED_CLEAN_DIR / out_name
-        cleaned.objects.to_file(out_path, driver="GeoJSON")
-
-        return _ok({
-            "geojson_url": f"/results/merged_cleaned/{out_name}",
-            "output": out_name
-        })
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
     except Exception as e:
         logger.exception("merge_clean failed")
         return _bad(f"merge_clean failed: {e}", 500)
+    return _ok({**res, "vtiles_url": _vtiles_url(Path(res["output"]).stem), "job_id": job["id"]})
+
+
+@app.post("/merge_regions")
+async def merge_regions(
+    segment_id: str = Form(...),
+    classified: str | None = Form(None),
+    class_column: str = Form("classification"),
+    threshold: float | None = Form(None),
+    wait: bool = Form(True),
+):
+    """
+    Merge adjacent segments on the segment layer's adjacency graph, by class
+    (`classified`: a layer in results/classify/) and/or band-mean distance
+    (`threshold`), and polygonize once into results/merged_cleaned/regions_<stem>.parquet.
+    """
+    seg_path = layer_path(SEGMENTS_DIR, segment_id)
+    if seg_path is None:
+        return _bad("segment not found", 404)
+    classified_path = None
+    if classified:
+        classified_path = layer_path(CLASSIFY_DIR, classified)
+        if classified_path is None:
+            return _bad(f"File not found: {classified}", 404)
+    if classified_path is None and threshold is None:
+        return _bad("give a classified layer and/or a threshold")
+
+    job = JOBS.submit(
+        "merge_regions", merge_regions_task,
+        seg_path.stem, str(SEGMENTS_DIR), str(MERGED_CLEAN_DIR), "/results/merged_cleaned",
+        str(classified_path) if classified_path else None, class_column, threshold,
+    )
+    if not wait:
+        return _accepted(job)
+    try:
+        res = await JOBS.wait(job["id"])
+    except JobCancelled as e:
+        return _bad(str(e), 409)
+    except FileNotFoundError as e:
+        return _bad(str(e), 404)
+    except ValueError as e:
+        return _bad(str(e))
+    except Exception as e:
+        logger.exception("merge_regions failed")
+        return _bad(f"merge_regions failed: {e}", 500)
+    return _ok({**res, "vtiles_url": _vtiles_url(res["id"]), "job_id": job["id"]})
+
+
+# ---------------- jobs
+@app.get("/jobs")
+def list_jobs():
+    return _ok({"jobs": JOBS.list()})
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return _bad("job not found", 404)
+    return _ok(job)
+
+@app.get("/segments/_cache")
+def segment_cache_stats():
+    return _ok(SEG_CACHE.stats())
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = JOBS.cancel(job_id)
+    if job is None:
+        return _bad("job not found", 404)
+    return _ok(job)
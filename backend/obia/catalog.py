@@ -0,0 +1,450 @@
+# backend/obia/catalog.py
+"""
+Results catalog: an indexed SQLite view of the files under results/ and uploads/.
+
+The listings (/geojsons, /segments, /segments_index) used to glob the result
+directories and stat candidate files on every call, and /delete walked every
+sub-directory. The catalog keeps one row per file (indexed by name, so /delete
+resolves a name with one lookup) and one row per vector layer, with metadata
+read once when the file changes: kind, feature count, bbox, CRS, size, parent
+layer, source raster. Samples linkage is a join on the samples files' rows.
+
+Tracked: the files directly inside each root and its immediate sub-directories.
+Names starting with "_" (databases, caches, job state), temp files and the
+`skip` directories (e.g. uploads/tmp) are left out. The catalog is reconciled
+by `scan()` (stat only; metadata is re-read for changed files) and kept current
+between scans by CatalogWatcher, a filesystem watcher (watchdog).
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from .features import labels_path_for, labels_source
+from .rasterdb import _Tx
+from .storage import LAYER_EXT, LEGACY_EXT, layer_path
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:       # no watcher: the catalog is only as fresh as the last scan()
+    FileSystemEventHandler, Observer = object, None
+
+_SIDECAR_SUFFIXES = (".labels.tif", ".features.parquet", ".rag.npz")
+_RASTER_SUFFIXES = (".tif", ".tiff", ".img", ".png", ".jpg", ".jpeg")
+_TEMP_SUFFIXES = (".tmp", ".part")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    name     TEXT NOT NULL,
+    dir      TEXT NOT NULL,
+    role     TEXT NOT NULL,      -- layer | sidecar | samples | raster | other
+    ref      TEXT,               -- layer id a sidecar / samples file belongs to
+    size     INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_ref ON files (role, ref);
+CREATE TABLE IF NOT EXISTS layers (
+    dir      TEXT NOT NULL,
+    id       TEXT NOT NULL,
+    path     TEXT NOT NULL,
+    format   TEXT NOT NULL,
+    kind     TEXT NOT NULL,      -- segment | classify | merged | regions | classmap | other
+    parent   TEXT,               -- id of the layer this one was derived from
+    segment  TEXT,               -- id of the segment layer at the root of that chain
+    source   TEXT,               -- segment layers: path of the raster they were segmented from
+    features INTEGER,
+    crs      TEXT,
+    minx REAL, miny REAL, maxx REAL, maxy REAL,
+    size     INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (dir, id)
+);
+CREATE INDEX IF NOT EXISTS layers_id ON layers (id);
+CREATE INDEX IF NOT EXISTS layers_kind ON layers (kind, id);
+CREATE INDEX IF NOT EXISTS layers_segment ON layers (segment);
+"""
+
+_LAYER_COLUMNS = ("dir", "id", "path", "format", "kind", "parent", "segment", "source", "features", "crs",
+                  "minx", "miny", "maxx", "maxy", "size", "mtime_ns")
+# listed columns; `source` is replaced by _SOURCE
+_LAYER_COLS = ", ".join(f"layers.{c}" for c in _LAYER_COLUMNS if c not in ("source", "mtime_ns"))
+# source raster of any layer: its own (segments) or its root segment layer's
+_SOURCE = ("COALESCE(layers.source, (SELECT s.source FROM layers s "
+           "WHERE s.id = layers.segment AND s.kind = 'segment' LIMIT 1))")
+_SAMPLES = "EXISTS (SELECT 1 FROM files f WHERE f.role = 'samples' AND f.ref = layers.id)"
+
+
+def _crs_name(crs) -> str | None:
+    """PROJJSON (GeoParquet metadata) -> "AUTHORITY:CODE", or its name."""
+    if crs is None:
+        return None
+    if isinstance(crs, str):
+        return crs
+    ident = crs.get("id") or {}
+    if ident.get("authority") and ident.get("code") is not None:
+        return f"{ident['authority']}:{ident['code']}"
+    return crs.get("name")
+
+
+def layer_info(path: Path) -> dict:
+    """Feature count, CRS and bbox of a layer file, from the GeoParquet footer (no geometry is read)."""
+    if path.suffix == LAYER_EXT:
+        md = pq.read_metadata(path)
+        geo = json.loads((md.metadata or {}).get(b"geo", b"{}"))
+        col = geo.get("columns", {}).get(geo.get("primary_column", "geometry"), {})
+        # GeoParquet: a missing crs means OGC:CRS84
+        crs = _crs_name(col["crs"]) if "crs" in col else "OGC:CRS84"
+        return {"features": md.num_rows, "crs": crs, "bbox": col.get("bbox")}
+    import pyogrio
+    info = pyogrio.read_info(path, force_total_bounds=True)
+    bbox = info.get("total_bounds")
+    return {"features": info.get("features"), "crs": info.get("crs"),
+            "bbox": list(bbox) if bbox is not None and all(map(_finite, bbox)) else None}
+
+
+def _abs(p) -> Path:
+    return Path(os.path.abspath(p))
+
+
+def _finite(v) -> bool:
+    try:
+        return abs(float(v)) != float("inf") and float(v) == float(v)
+    except (TypeError, ValueError):
+        return False
+
+
+def layer_kind(directory: str, stem: str) -> tuple[str, str | None, str | None]:
+    """
+    (kind, parent layer id, root segment layer id) of a layer, from where it
+    lives and the pipeline's naming: segment_<b> -> classify_<b> -> merged_classify_<b>,
+    and regions_<b> / classmap_<b> from segment_<b>.
+    """
+    d = os.path.basename(directory)
+    base = stem.split("_", 1)[1] if "_" in stem else stem
+    if d == "segments" or stem.startswith("segment_"):
+        return "segment", None, stem
+    if d == "classify" or stem.startswith("classify_"):
+        return "classify", f"segment_{base}", f"segment_{base}"
+    if stem.startswith("merged_"):
+        return "merged", base, layer_kind("", base)[2]
+    if stem.startswith(("regions_", "classmap_")):
+        return stem.split("_", 1)[0], f"segment_{base}", f"segment_{base}"
+    return ("merged" if d == "merged_cleaned" else "other"), None, None
+
+
+class ResultsCatalog:
+    """
+    Parameters:
+        db_path (str | Path): SQLite file (created on first use).
+        roots (list[str | Path]): directories whose files (and their sub-directories' files) are tracked.
+        samples_dir (str | Path | None): where `<segment>.json` / `samples_<segment>.json` samples live;
+            `samples_<segment>.json` directly in a root also counts.
+        skip (list[str | Path]): sub-directories not to track.
+    """
+
+    def __init__(self, db_path, roots, samples_dir=None, skip=()):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.roots = [_abs(r) for r in roots]
+        self.samples_dir = _abs(samples_dir) if samples_dir is not None else None
+        self.skip = {_abs(s) for s in skip}
+        self._local = threading.local()
+        self._con().executescript(_SCHEMA)
+
+    # ---- connection per thread (same setup as rasterdb.RasterStore)
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def _tx(self):
+        return _Tx(self._con())
+
+    # ---- what is tracked
+    def directories(self) -> list[Path]:
+        out = []
+        for root in self.roots:
+            if not root.is_dir():
+                continue
+            out.append(root)
+            with os.scandir(root) as it:
+                out += sorted(Path(e.path) for e in it
+                              if e.is_dir() and self._tracked_dir(Path(e.path)))
+        return out
+
+    def _tracked_dir(self, d: Path) -> bool:
+        if d in self.roots:
+            return True
+        return d.parent in self.roots and not d.name.startswith("_") and d not in self.skip
+
+    def tracks(self, path) -> bool:
+        p = Path(path)
+        name = p.name
+        if name.startswith(("_", ".")) or name.endswith(_TEMP_SUFFIXES):
+            return False
+        return self._tracked_dir(p.parent)
+
+    def _role(self, p: Path) -> tuple[str, str | None]:
+        name = p.name
+        for s in _SIDECAR_SUFFIXES:
+            if name.endswith(s):
+                return "sidecar", name[: -len(s)]
+        if p.suffix == ".json":
+            if self.samples_dir is not None and p.parent == self.samples_dir:
+                stem = p.stem
+                return "samples", stem[len("samples_"):] if stem.startswith("samples_") else stem
+            if p.parent in self.roots and p.stem.startswith("samples_"):
+                return "samples", p.stem[len("samples_"):]
+        if p.suffix in (LAYER_EXT, LEGACY_EXT):
+            return "layer", p.stem
+        if p.suffix.lower() in _RASTER_SUFFIXES:
+            return "raster", None
+        return "other", None
+
+    # ---- keeping it current
+    def scan(self) -> dict:
+        """Reconcile with the disk: stat every tracked file; changed ones are (re)indexed, missing ones dropped."""
+        added = removed = 0
+        dirs = self.directories()
+        seen_dirs = {str(d) for d in dirs}
+        for d in dirs:
+            on_disk = {}
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_file() and self.tracks(e.path):
+                        st = e.stat()
+                        on_disk[str(Path(e.path))] = (st.st_size, st.st_mtime_ns)
+            known = {r["path"]: (r["size"], r["mtime_ns"])
+                     for r in self._con().execute("SELECT path, size, mtime_ns FROM files WHERE dir = ?", (str(d),))}
+            gone = [p for p in known if p not in on_disk]
+            changed = [p for p, sig in on_disk.items() if known.get(p) != sig]
+            for p in gone:
+                self._remove(Path(p))
+            for p in changed:
+                self._index(Path(p))
+            added += len(changed)
+            removed += len(gone)
+        for row in self._con().execute("SELECT DISTINCT dir FROM files").fetchall():
+            if row["dir"] not in seen_dirs:
+                for r in self._con().execute("SELECT path FROM files WHERE dir = ?", (row["dir"],)).fetchall():
+                    self._remove(Path(r["path"]))
+                    removed += 1
+        return {"indexed": added, "removed": removed}
+
+    def refresh(self, path):
+        """Bring one path up to date (created, changed or deleted)."""
+        p = _abs(path)
+        if not self.tracks(p):
+            return
+        if p.is_file():
+            st = p.stat()
+            row = self._con().execute("SELECT size, mtime_ns FROM files WHERE path = ?", (str(p),)).fetchone()
+            if row is None or (row["size"], row["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+                self._index(p)
+        else:
+            self._remove(p)
+
+    def forget(self, paths):
+        """Drop files the API itself just deleted."""
+        for p in paths:
+            self._remove(_abs(p))
+
+    def _index(self, p: Path):
+        try:
+            st = p.stat()
+        except OSError:
+            return self._remove(p)
+        role, ref = self._role(p)
+        with self._tx() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO files (path, name, dir, role, ref, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(p), p.name, str(p.parent), role, ref, st.st_size, st.st_mtime_ns))
+        if role == "layer":
+            self._index_layer(p.parent, p.stem)
+
+    def _remove(self, p: Path):
+        with self._tx() as con:
+            row = con.execute("SELECT role FROM files WHERE path = ?", (str(p),)).fetchone()
+            con.execute("DELETE FROM files WHERE path = ?", (str(p),))
+        if row is not None and row["role"] == "layer":
+            self._index_layer(p.parent, p.stem)
+
+    def _index_layer(self, d: Path, stem: str):
+        """(Re)build the layer row of `stem` in `d` from whichever of its files is current (GeoParquet first)."""
+        p = layer_path(d, stem)
+        if p is None:
+            with self._tx() as con:
+                con.execute("DELETE FROM layers WHERE dir = ? AND id = ?", (str(d), stem))
+            return
+        st = p.stat()
+        kind, parent, segment = layer_kind(str(d), stem)
+        try:
+            info = layer_info(p)
+        except Exception:
+            info = {"features": None, "crs": None, "bbox": None}
+        source = None
+        if kind == "segment":
+            labels = labels_path_for(p)
+            try:
+                source = labels_source(labels) if labels.exists() else None
+            except Exception:
+                source = None
+        bbox = info["bbox"] if info["bbox"] and len(info["bbox"]) >= 4 else [None] * 4
+        vals = (str(d), stem, str(p), "geoparquet" if p.suffix == LAYER_EXT else "geojson", kind, parent, segment,
+                source,
+                info["features"], info["crs"], *bbox[:4], st.st_size, st.st_mtime_ns)
+        with self._tx() as con:
+            con.execute(f"INSERT OR REPLACE INTO layers ({', '.join(_LAYER_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(_LAYER_COLUMNS))})", vals)
+
+    # ---- reads
+    def find(self, names) -> list[Path]:
+        """Tracked files with one of these exact basenames."""
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+        rows = self._con().execute(
+            f"SELECT path FROM files WHERE name IN ({', '.join('?' * len(names))}) ORDER BY path", names).fetchall()
+        return [Path(r["path"]) for r in rows]
+
+    def layer(self, layer_id: str, dirs=None) -> dict | None:
+        rows, _ = self.layers(dirs=dirs, ids=[layer_id], limit=1)
+        return rows[0] if rows else None
+
+    def layers(self, dirs=None, kind=None, ids=None, prefix: str | None = None, q: str | None = None,
+               has_samples: bool | None = None, source: str | None = None, bbox=None,
+               limit: int | None = None, offset: int = 0) -> tuple[list[dict], int]:
+        """
+        Layer rows, ordered by `dirs` (in the given order) then id, and the total
+        count before paging. Filters: `kind` (one or several), `prefix` of / `q`
+        substring of the id, samples linkage, `source` raster path, and `bbox`
+        (minx, miny, maxx, maxy) intersecting the layer's bbox, in its CRS.
+        """
+        where, args = [], []
+        if dirs is not None:
+            dirs = [str(_abs(d)) for d in dirs]
+            where.append(f"dir IN ({', '.join('?' * len(dirs))})")
+            args += dirs
+        if kind:
+            kinds = [kind] if isinstance(kind, str) else list(kind)
+            where.append(f"kind IN ({', '.join('?' * len(kinds))})")
+            args += kinds
+        if ids:
+            where.append(f"id IN ({', '.join('?' * len(ids))})")
+            args += list(ids)
+        if prefix:
+            where.append("id >= ? AND id < ?")
+            args += [prefix, prefix + "\U0010ffff"]
+        if q:
+            where.append("instr(lower(id), lower(?)) > 0")
+            args.append(q)
+        if has_samples is not None:
+            where.append(_SAMPLES if has_samples else f"NOT {_SAMPLES}")
+        if source:
+            where.append(f"{_SOURCE} = ?")
+            args.append(str(source))
+        if bbox is not None:
+            where.append("maxx >= ? AND minx <= ? AND maxy >= ? AND miny <= ?")
+            args += [bbox[0], bbox[2], bbox[1], bbox[3]]
+        cond = f"WHERE {' AND '.join(where)}" if where else ""
+        order = "id"
+        order_args = []
+        if dirs:
+            order = f"CASE dir {' '.join('WHEN ? THEN %d' % i for i in range(len(dirs)))} END, id"
+            order_args = dirs
+        con = self._con()
+        total = con.execute(f"SELECT COUNT(*) FROM layers {cond}", args).fetchone()[0]
+        page = ""
+        if limit is not None:
+            page = "LIMIT ? OFFSET ?"
+            order_args = order_args + [int(limit), max(0, int(offset))]
+        elif offset:
+            page = "LIMIT -1 OFFSET ?"
+            order_args = order_args + [max(0, int(offset))]
+        rows = con.execute(f"SELECT {_LAYER_COLS}, {_SOURCE} AS source, {_SAMPLES} AS has_samples FROM layers {cond} "
+                           f"ORDER BY {order} {page}", args + order_args).fetchall()
+        return [self._layer_row(r) for r in rows], total
+
+    @staticmethod
+    def _layer_row(r) -> dict:
+        d = dict(r)
+        box = [d.pop(k) for k in ("minx", "miny", "maxx", "maxy")]
+        d["bbox"] = box if None not in box else None
+        d["has_samples"] = bool(d["has_samples"])
+        return d
+
+    def stats(self) -> dict:
+        con = self._con()
+        return {
+            "files": con.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+            "layers": {r["kind"]: r["n"] for r in con.execute("SELECT kind, COUNT(*) AS n FROM layers GROUP BY kind")},
+        }
+
+
+class CatalogWatcher(FileSystemEventHandler):
+    """
+    Keeps a ResultsCatalog current from filesystem events (watchdog; one
+    non-recursive watch per tracked directory, so tile caches and job state
+    are not watched). `start()` returns False when watchdog is not installed.
+    """
+
+    def __init__(self, catalog: ResultsCatalog):
+        super().__init__()
+        self.catalog = catalog
+        self._observer = None
+        self._watched: set[str] = set()
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        if Observer is None:
+            return False
+        self._observer = Observer()
+        self._observer.daemon = True
+        for d in self.catalog.directories():
+            self._watch(d)
+        self._observer.start()
+        return True
+
+    def _watch(self, d: Path):
+        with self._lock:
+            if str(d) in self._watched or self._observer is None:
+                return
+            self._observer.schedule(self, str(d), recursive=False)
+            self._watched.add(str(d))
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        try:
+            if event.is_directory:
+                d = Path(event.src_path)
+                if event.event_type == "created" and self.catalog._tracked_dir(d):
+                    self._watch(d)
+                    for p in d.iterdir():
+                        self.catalog.refresh(p)
+                return
+            self.catalog.refresh(event.src_path)
+            if getattr(event, "dest_path", None):
+                self.catalog.refresh(event.dest_path)
+        except Exception:
+            pass      # the next scan() reconciles whatever an event missed
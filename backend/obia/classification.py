@@ -2,11 +2,18 @@
 import os
 import json
 import geopandas as gpd
+import pandas as pd
 from typing import Optional, Dict, Any, Tuple
 
 from nickyspatial.core.layer import Layer, LayerManager
 from nickyspatial.core.classifier import SupervisedClassifier
 
+from .features import features_path_for, read_features
+from .models import ModelRegistry, model_key, samples_hash
+from .modelselect import cross_validate, expand_grid, make_estimator
+from .storage import LAYER_EXT, layer_path, read_layer, write_layer
+from .tracing import span
+
 
 def _paths_from_segment_id(results_dir: str, segment_id: str) -> Tuple[str, str]:
     seg_path = os.path.join(results_dir, "segments", f"{segment_id}.geojson")
@@ -14,6 +21,23 @@ def _paths_from_segment_id(results_dir: str, segment_id: str) -> Tuple[str, str]
     return seg_path, samples_path
 
 
+def _attach_features(gdf: gpd.GeoDataFrame, features_path: str, groups) -> Tuple[gpd.GeoDataFrame, Optional[list]]:
+    """
+    Join the segment's feature table (if any) onto its polygons. Table columns
+    replace same-named GeoJSON attributes. With `groups` given, only those
+    groups' columns are returned as classifier features.
+    """
+    if not os.path.isfile(features_path):
+        if groups:
+            raise FileNotFoundError(f"Features not found: {features_path}")
+        return gdf, None
+    table, cols = read_features(features_path, groups)
+    gdf = gdf.drop(columns=[c for c in cols if c in gdf.columns])
+    gdf = gdf.merge(table, on="segment_id", how="left")
+    gdf[cols] = gdf[cols].fillna(0.0)
+    return gdf, (cols if groups else None)
+
+
 def _load_samples(samples_json_path: str) -> Dict[str, Any]:
     with open(samples_json_path, "r", encoding="utf-8") as f:
         payload = json.load(f)
@@ -42,6 +66,36 @@ def _classifier_config(method: str, user_params: Optional[Dict[str, Any]]) -> Tu
     return classifier_type, params
 
 
+def _load_segment_layer(results_dir: str, segment_id: str, features) -> Tuple[gpd.GeoDataFrame, Optional[list]]:
+    segment_path = layer_path(os.path.join(results_dir, "segments"), segment_id)
+    if segment_path is None:
+        raise FileNotFoundError(f"Segment not found: {segment_id}")
+    with span("read") as sp:
+        gdf = read_layer(segment_path)
+        sp.set(polygons=int(len(gdf)))
+    features_path = os.path.join(results_dir, "segments", f"{segment_id}.features.parquet")
+    return _attach_features(gdf, features_path, features)
+
+
+def _candidate_columns(gdf: gpd.GeoDataFrame, feature_columns: Optional[list]) -> list:
+    """
+    The columns to train on. "id" is the GeoJSON feature index, not an attribute,
+    so it is left out (otherwise a model would not transfer to other layers).
+    """
+    cols = feature_columns if feature_columns else list(gdf.columns)
+    return [c for c in cols if c not in ("id", "segment_id", "classification", "geometry")]
+
+
+def _write_result(gdf: gpd.GeoDataFrame, classified_dir: str, segment_id: str) -> str:
+    os.makedirs(classified_dir, exist_ok=True)
+    output = os.path.join(classified_dir, f"{segment_id}_classified{LAYER_EXT}")
+    if gdf is None:
+        raise RuntimeError("Classification returned an empty result layer.")
+    with span("serialize", polygons=int(len(gdf))):
+        write_layer(gdf, output)
+    return output
+
+
 def classify(
     segment_id: str,
     method: str,
@@ -51,37 +105,58 @@ def classify(
     source_layer_name: str = "SegmentLayer",
     result_layer_name: str = "Classification",
     class_field: str = "classification",
+    features: Optional[Tuple[str, ...]] = None,
+    registry: Optional[ModelRegistry] = None,
+    retrain: bool = False,
 ):
     """
     Combined RF / SVM / KNN classification exactly like your originals, routed by `method`.
     Uses:
-      - segments:  results/segments/{segment_id}.geojson
+      - segments:  results/segments/{segment_id}.parquet (or legacy .geojson)
       - samples :  results/samples/{segment_id}.json  (uses ['samples'] key)
+      - features:  results/segments/{segment_id}.features.parquet, if present;
+                   `features` restricts training to those groups (see features.py)
+      - registry:  with a ModelRegistry, a model already fitted on the same samples,
+                   method, params and columns is reused instead of retrained
+                   (unless `retrain`); newly fitted models are stored there
     Writes:
-      - output  :  {classified_dir}/{segment_id}.geojson
+      - output  :  {classified_dir}/{segment_id}_classified.parquet
     Returns:
-      (result_layer, accuracy, feature_importances, output_geojson)
+      {segment_id, method, accuracy, output, features, model_id, reused_model}
     """
-    segment_geojson_path, samples_json_path = _paths_from_segment_id(results_dir, segment_id)
-
-    if not os.path.isfile(segment_geojson_path):
-        raise FileNotFoundError(f"Segment not found: {segment_geojson_path}")
+    _, samples_json_path = _paths_from_segment_id(results_dir, segment_id)
+    gdf, feature_columns = _load_segment_layer(results_dir, segment_id, features)
     if not os.path.isfile(samples_json_path):
         raise FileNotFoundError(f"Samples not found: {samples_json_path}")
-
-    # Load inputs
-    gdf = gpd.read_file(segment_geojson_path)
     samples = _load_samples(samples_json_path)
 
+    # Pick classifier type + params (your defaults)
+    classifier_type, params = _classifier_config(method, classifier_params)
+
+    columns = _candidate_columns(gdf, feature_columns)
+    model_id = None
+    if registry is not None:
+        model_id = model_key(samples_hash(samples), classifier_type, params, segment_id, columns)
+        stored = None if retrain else registry.load(model_id)
+        if stored is not None:
+            estimator, meta = stored
+            objects = _predict_objects(gdf, estimator, meta["features"])
+            return {
+                "segment_id": segment_id,
+                "method": method,
+                "accuracy": meta.get("accuracy"),
+                "output": _write_result(objects, classified_dir, segment_id),
+                "features": meta["features"],
+                "model_id": model_id,
+                "reused_model": True,
+            }
+
     # Prepare NickySpatial layer & manager
     layer = Layer(name=source_layer_name, type="segmentation")
     layer.objects = gdf
     manager = LayerManager()
     manager.add_layer(layer)
 
-    # Pick classifier type + params (your defaults)
-    classifier_type, params = _classifier_config(method, classifier_params)
-
     # Create and run classifier
     clf = SupervisedClassifier(
         name=f"{classifier_type}_Classifier",
@@ -89,24 +164,220 @@ def classify(
         classifier_params=params,
     )
 
-    result_layer, accuracy, feature_importances = clf.execute(
-        source_layer=layer,
-        samples=samples,
-        layer_manager=manager,
-        layer_name=result_layer_name,
-    )
+    # training on the samples and predicting every segment
+    with span("classify", polygons=int(len(gdf))):
+        result_layer, accuracy, feature_importances = clf.execute(
+            source_layer=layer,
+            samples=samples,
+            layer_manager=manager,
+            layer_name=result_layer_name,
+            features=columns,
+        )
+    accuracy = float(accuracy) if accuracy is not None else None
 
     # Save output GeoJSON
-    os.makedirs(classified_dir, exist_ok=True)
-    output_geojson = os.path.join(classified_dir, f"{segment_id}_classified.geojson")
-    if hasattr(result_layer, "objects") and result_layer.objects is not None:
-        result_layer.objects.to_file(output_geojson, driver="GeoJSON")
-    else:
-        raise RuntimeError("Classification returned an empty result layer.")
+    output = _write_result(getattr(result_layer, "objects", None), classified_dir, segment_id)
+
+    if registry is not None:
+        registry.save(
+            model_id, clf.classifier,
+            method=method, classifier_type=classifier_type, params=params,
+            features=list(clf.features), classes=[str(c) for c in clf.classifier.classes_],
+            accuracy=accuracy, trained_on=segment_id, samples_sha1=samples_hash(samples),
+            n_samples=int(len(clf.training_layer)),
+        )
 
     return {
         "segment_id": segment_id,
         "method": method,
-        "accuracy": float(accuracy) if accuracy is not None else None,
-        "output_geojson": output_geojson,
+        "accuracy": accuracy,
+        "output": output,
+        "features": list(clf.features) if clf.features is not None else None,
+        "model_id": model_id,
+        "reused_model": False,
+    }
+
+
+def _predict_objects(gdf: gpd.GeoDataFrame, estimator, columns: list) -> gpd.GeoDataFrame:
+    """Same as SupervisedClassifier's prediction step, for an already fitted estimator."""
+    missing = [c for c in columns if c not in gdf.columns]
+    if missing:
+        raise ValueError(f"Segment layer lacks the model's feature columns: {', '.join(missing[:10])}")
+    out = gdf.copy()
+    with span("predict", polygons=int(len(out))):
+        out["classification"] = estimator.predict(out[columns])
+    return out
+
+
+def predict(model_id: str, segment_id: str, results_dir: str, classified_dir: str, registry: ModelRegistry):
+    """
+    Apply a stored model to any segment layer, without samples or retraining.
+    The layer (plus its feature table, if any) must have the model's feature columns.
+    """
+    stored = registry.load(model_id)
+    if stored is None:
+        raise FileNotFoundError(f"Model not found: {model_id}")
+    estimator, meta = stored
+    gdf, _ = _load_segment_layer(results_dir, segment_id, None)
+    objects = _predict_objects(gdf, estimator, meta["features"])
+    return {
+        "segment_id": segment_id,
+        "method": meta.get("method"),
+        "accuracy": meta.get("accuracy"),
+        "output": _write_result(objects, classified_dir, segment_id),
+        "features": meta["features"],
+        "model_id": model_id,
+        "reused_model": True,
+    }
+
+
+def classify_table(
+    segment_id: str,
+    method: str,
+    results_dir: str,
+    classifier_params: Optional[Dict[str, Any]] = None,
+    features: Optional[Tuple[str, ...]] = None,
+    registry: Optional[ModelRegistry] = None,
+    retrain: bool = False,
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Like classify(), but on the segment's feature table alone: no polygons are
+    read or written. Trains on results/samples/{segment_id}.json (or reuses the
+    registry's model for the same inputs).
+    Returns:
+      ({segment_id, classification} table, {method, accuracy, features, model_id, reused_model})
+    """
+    table_path = features_path_for(os.path.join(results_dir, "segments", f"{segment_id}{LAYER_EXT}"))
+    if not table_path.is_file():
+        raise FileNotFoundError(f"Features not found: {table_path}")
+    table, cols = read_features(table_path, features)
+    _, samples_json_path = _paths_from_segment_id(results_dir, segment_id)
+    if not os.path.isfile(samples_json_path):
+        raise FileNotFoundError(f"Samples not found: {samples_json_path}")
+    samples = _load_samples(samples_json_path)
+    classifier_type, params = _classifier_config(method, classifier_params)
+
+    model_id = None
+    if registry is not None:
+        model_id = model_key(samples_hash(samples), classifier_type, params, segment_id, cols)
+        stored = None if retrain else registry.load(model_id)
+        if stored is not None:
+            estimator, meta = stored
+            out = _predict_objects(table, estimator, meta["features"])
+            return out[["segment_id", "classification"]], {
+                "method": method, "accuracy": meta.get("accuracy"), "features": meta["features"],
+                "model_id": model_id, "reused_model": True,
+            }
+
+    layer = Layer(name="SegmentFeatures", type="segmentation")
+    layer.objects = table
+    clf = SupervisedClassifier(
+        name=f"{classifier_type}_Classifier",
+        classifier_type=classifier_type,
+        classifier_params=params,
+    )
+    with span("classify", polygons=int(len(table))):
+        result_layer, accuracy, _ = clf.execute(source_layer=layer, samples=samples, features=cols)
+    accuracy = float(accuracy) if accuracy is not None else None
+
+    if registry is not None:
+        registry.save(
+            model_id, clf.classifier,
+            method=method, classifier_type=classifier_type, params=params,
+            features=list(clf.features), classes=[str(c) for c in clf.classifier.classes_],
+            accuracy=accuracy, trained_on=segment_id, samples_sha1=samples_hash(samples),
+            n_samples=int(len(clf.training_layer)),
+        )
+    return result_layer.objects[["segment_id", "classification"]], {
+        "method": method, "accuracy": accuracy, "features": list(clf.features),
+        "model_id": model_id, "reused_model": False,
     }
+
+
+def predict_table(model_id: str, table: pd.DataFrame, registry: ModelRegistry) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Apply a stored model to a feature table; same return value as classify_table."""
+    stored = registry.load(model_id)
+    if stored is None:
+        raise FileNotFoundError(f"Model not found: {model_id}")
+    estimator, meta = stored
+    out = _predict_objects(table, estimator, meta["features"])
+    return out[["segment_id", "classification"]], {
+        "method": meta.get("method"), "accuracy": meta.get("accuracy"), "features": meta["features"],
+        "model_id": model_id, "reused_model": True,
+    }
+
+
+def _training_rows(segment_id: str, results_dir: str, features) -> Tuple[pd.DataFrame, Any, list, Dict[str, Any]]:
+    """
+    (X, y, feature columns, samples) of the sampled segments, labelled the way
+    SupervisedClassifier does (a segment listed under two classes gets the
+    last). Reads the feature table when there is one, else the layer attributes.
+    """
+    table_path = features_path_for(os.path.join(results_dir, "segments", f"{segment_id}{LAYER_EXT}"))
+    if table_path.is_file():
+        table, cols = read_features(table_path, features)
+    else:
+        if features:
+            raise FileNotFoundError(f"Features not found: {table_path}")
+        table, _ = _load_segment_layer(results_dir, segment_id, None)
+        cols = _candidate_columns(table, None)
+    _, samples_json_path = _paths_from_segment_id(results_dir, segment_id)
+    if not os.path.isfile(samples_json_path):
+        raise FileNotFoundError(f"Samples not found: {samples_json_path}")
+    samples = _load_samples(samples_json_path)
+    labels = pd.Series(None, index=table.index, dtype=object)
+    for class_name, ids in samples.items():
+        labels[table["segment_id"].isin(ids)] = class_name
+    keep = labels.notna().to_numpy()
+    return table.loc[keep, cols], labels[keep].to_numpy(dtype=str), cols, samples
+
+
+def select_model(
+    segment_id: str,
+    results_dir: str,
+    registry: ModelRegistry,
+    methods=("rf", "svm", "knn"),
+    grid: Optional[Dict[str, Any]] = None,
+    folds: int = 5,
+    scoring: str = "f1_macro",
+    time_budget: Optional[float] = None,
+    features: Optional[Tuple[str, ...]] = None,
+    workers: Optional[int] = None,
+    on_fold=None,
+) -> Dict[str, Any]:
+    """
+    Cross-validate RF / SVM / KNN over a parameter grid on the segment's samples
+    (see modelselect.py), refit the best candidate on all of them and store it in
+    the registry; `accuracy` in its record is the cross-validated one.
+    Returns:
+      {segment_id, model_id, best, leaderboard, folds, scoring, evaluated, incomplete,
+       budget_exhausted, seconds, features, n_samples}
+    """
+    with span("read"):
+        X, y, cols, samples = _training_rows(segment_id, results_dir, features)
+    if not cols:
+        raise ValueError("No feature columns to train on.")
+    candidates = expand_grid(methods, grid, _classifier_config)
+    with span("model_select", samples=int(len(y)), candidates=len(candidates)):
+        cv = cross_validate(candidates, X.to_numpy(dtype=float), y, folds=folds, scoring=scoring,
+                            time_budget=time_budget, workers=workers, on_fold=on_fold)
+    if not cv["evaluated"]:
+        if cv["failed"]:
+            raise ValueError(f"Every candidate failed cross-validation, e.g. {cv['leaderboard'][0]['error']}")
+        raise RuntimeError("No candidate finished cross-validation within the time budget.")
+
+    best = cv["leaderboard"][0]
+    with span("train", samples=int(len(y))):
+        estimator = make_estimator(best["classifier_type"], best["params"]).fit(X, y)
+    sha1 = samples_hash(samples)
+    model_id = model_key(sha1, best["classifier_type"], best["params"], segment_id, cols)
+    registry.save(
+        model_id, estimator,
+        method=best["method"], classifier_type=best["classifier_type"], params=best["params"],
+        features=list(cols), classes=[str(c) for c in estimator.classes_],
+        accuracy=best["accuracy_mean"], trained_on=segment_id, samples_sha1=sha1, n_samples=int(len(y)),
+        cv={k: cv[k] for k in ("folds", "scoring")} | {"score": best[f"{scoring}_mean"],
+                                                        "std": best[f"{scoring}_std"]},
+    )
+    return {"segment_id": segment_id, "model_id": model_id, "best": best, **cv,
+            "features": list(cols), "n_samples": int(len(y))}
@@ -0,0 +1,47 @@
+# backend/obia/classmap.py
+"""
+Raster-domain classify -> dissolve.
+
+The segment -> classify -> merge chain otherwise builds segment polygons,
+classifies them as polygons and unions them again per class. Here a class is
+assigned to each segment's feature vector, the label raster is mapped to
+class codes with a lookup table, and the class raster is polygonized once:
+every connected area of one class becomes one polygon (holes included, since
+they belong to other classes), i.e. the dissolved result directly.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+
+from .rag import polygonize_lut
+
+
+def class_lut(segment_ids, classes) -> tuple[np.ndarray, pd.Index]:
+    """(label -> class code lookup table, class names): code k + 1 is names[k], 0 is unclassified."""
+    codes, names = pd.factorize(pd.Series(classes), use_na_sentinel=True)
+    segment_ids = np.asarray(segment_ids, dtype="int64")
+    lut = np.zeros(int(segment_ids.max(initial=0)) + 1, dtype="int32")
+    lut[segment_ids] = codes + 1
+    return lut, names
+
+
+def polygonize_classes(labels_path, segment_ids, classes, class_column: str = "classification") -> gpd.GeoDataFrame:
+    """
+    Dissolved class polygons from a label raster and one class per segment_id,
+    in the label raster's CRS, with `class_column` and `area_pixels`. The label
+    raster is mapped and polygonized strip-wise (rag.polygonize_lut).
+    """
+    with rasterio.open(labels_path) as ds:
+        transform, crs = ds.transform, ds.crs
+    lut, names = class_lut(segment_ids, classes)
+    geoms, values = polygonize_lut(labels_path, lut)
+    px = abs(transform.a * transform.e)
+    return gpd.GeoDataFrame(
+        {class_column: np.asarray(names, dtype=object)[values - 1],
+         "area_pixels": np.rint(shapely.area(geoms) / px).astype("int64") if len(geoms) else []},
+        geometry=list(geoms), crs=crs,
+    )
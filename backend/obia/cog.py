@@ -0,0 +1,98 @@
+# backend/obia/cog.py
+"""
+Cloud-Optimized GeoTIFF ingest and overview helpers.
+
+Uploads are rewritten as tiled, losslessly compressed GeoTIFFs carrying a
+pyramid of internal overviews, so the original resolution is kept while
+tile rendering and coarse reads only touch the level they need.
+"""
+from __future__ import annotations
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+
+def overview_factors(width: int, height: int, min_size: int = 256) -> list[int]:
+    """Power-of-two decimation factors until the coarsest level fits in `min_size` pixels."""
+    factors = []
+    f = 2
+    while max(width, height) / f >= min_size / 2 and max(width, height) > min_size:
+        factors.append(f)
+        f *= 2
+    return factors
+
+
+def write_cog(input_path, output_path, blocksize: int = 512, compress: str = "DEFLATE",
+              resampling: str = "average", min_overview_size: int = 256):
+    """
+    Write `input_path` as a Cloud-Optimized GeoTIFF at `output_path`.
+
+    Parameters:
+        input_path (str): Any GDAL-readable raster.
+        output_path (str): Destination .tif path.
+        blocksize (int): Internal tile size in pixels.
+        compress (str): Lossless GDAL codec (DEFLATE, LZW, ZSTD).
+        resampling (str): Overview resampling method.
+        min_overview_size (int): Stop building overviews below this size.
+    """
+    input_path, output_path = str(input_path), str(output_path)
+    with rasterio.open(input_path) as src:
+        predictor = 2 if src.dtypes[0].startswith(("int", "uint")) else 3
+        if compress.upper() not in {"DEFLATE", "LZW", "ZSTD"}:
+            predictor = 1
+
+    try:
+        rasterio.shutil.copy(
+            input_path, output_path, driver="COG",
+            BLOCKSIZE=blocksize, COMPRESS=compress, PREDICTOR=predictor,
+            OVERVIEWS="AUTO", OVERVIEW_RESAMPLING=resampling.upper(),
+            BIGTIFF="IF_SAFER", NUM_THREADS="ALL_CPUS",
+        )
+        return output_path
+    except Exception:
+        # GDAL < 3.1 has no COG driver: tiled GTiff + overviews, then copy with
+        # COPY_SRC_OVERVIEWS so the overviews end up laid out ahead of the data
+        pass
+
+    tiled = f"{output_path}.tiled.tif"
+    try:
+        rasterio.shutil.copy(
+            input_path, tiled, driver="GTiff",
+            TILED="YES", BLOCKXSIZE=blocksize, BLOCKYSIZE=blocksize,
+            COMPRESS=compress, PREDICTOR=predictor, BIGTIFF="IF_SAFER",
+        )
+        with rasterio.open(tiled, "r+") as ds:
+            factors = overview_factors(ds.width, ds.height, min_overview_size)
+            if factors:
+                ds.build_overviews(factors, Resampling[resampling.lower()])
+        rasterio.shutil.copy(
+            tiled, output_path, driver="GTiff",
+            TILED="YES", BLOCKXSIZE=blocksize, BLOCKYSIZE=blocksize,
+            COMPRESS=compress, PREDICTOR=predictor, BIGTIFF="IF_SAFER",
+            COPY_SRC_OVERVIEWS="YES",
+        )
+    finally:
+        if rasterio.shutil.exists(tiled):
+            rasterio.shutil.delete(tiled)
+    return output_path
+
+
+def pick_overview_level(ds, decimation: float) -> int | None:
+    """
+    Index of the coarsest internal overview whose factor does not exceed
+    `decimation` (source pixels per output pixel), or None for full resolution.
+    The index can be passed to `rasterio.open(..., overview_level=...)`.
+    """
+    level = None
+    for i, f in enumerate(ds.overviews(1)):
+        if f <= decimation:
+            level = i
+    return level
+
+
+def raw_size_mb(ds) -> float:
+    """Uncompressed size of a dataset's pixels in MB (independent of file compression)."""
+    itemsize = np.dtype(ds.dtypes[0]).itemsize
+    return ds.width * ds.height * ds.count * itemsize / (1024 * 1024)
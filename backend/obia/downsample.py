@@ -1,44 +1,114 @@
+# backend/obia/downsample.py
+"""
+Block-streamed raster downsampling.
+
+The output is produced one tile-aligned block at a time: each block reads its
+source window with a resampled (out_shape) read, so memory stays flat in the
+size of the raster (plus a bounded GDAL block cache). When the source has internal overviews, blocks are read
+from the coarsest one that is still at least as fine as the output. Reads run
+on a thread pool (one dataset handle per thread, since GDAL handles aren't
+thread-safe); the single output handle is only written from the calling
+thread, in completion order, with a bounded number of blocks in flight.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import rasterio
 from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from .cog import pick_overview_level
+
+
+def _output_profile(src, width, height, transform, block_size, compress):
+    profile = src.profile.copy()
+    for k in ("blockxsize", "blockysize", "tiled", "compress", "predictor", "interleave", "photometric"):
+        profile.pop(k, None)
+    predictor = 2 if src.dtypes[0].startswith(("int", "uint")) else 3
+    profile.update({
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "transform": transform,
+        "tiled": True,
+        "blockxsize": block_size,
+        "blockysize": block_size,
+        "compress": compress,
+        "predictor": predictor if compress.upper() in {"DEFLATE", "LZW", "ZSTD"} else 1,
+        "BIGTIFF": "IF_SAFER",
+        "NUM_THREADS": "ALL_CPUS",   # block compression
+    })
+    return profile
+
 
-def downsample_raster(input_path, output_path, factor):
+def downsample_raster(input_path, output_path, factor, block_size: int = 512, workers: int | None = None,
+                      compress: str = "DEFLATE", resampling: str = "bilinear", cache_mb: int = 64):
     """
     Downsample a raster by a given factor and save to a new file.
-    
+
     Parameters:
         input_path (str): Path to the input orthophoto.
         output_path (str): Path where the downsampled raster will be saved.
         factor (int or float): Downsampling factor. E.g., 4 means image becomes 1/4 the size.
+        block_size (int): Output tile size in pixels (multiple of 16); also the unit of work.
+        workers (int | None): Reader threads (default: all cores).
+        compress (str): GDAL codec of the tiled output.
+        resampling (str): rasterio Resampling name used for the resampled reads.
+        cache_mb (int): GDAL block cache while downsampling; bounds the memory of decoded blocks.
     """
+    input_path, output_path = str(input_path), str(output_path)
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    method = Resampling[resampling.lower()]
+
     with rasterio.open(input_path) as src:
         # Calculate new dimensions
-        new_width = int(src.width / factor)
-        new_height = int(src.height / factor)
-
-        # Read data with new shape
-        data = src.read(
-            out_shape=(
-                src.count,
-                new_height,
-                new_width
-            ),
-            resampling=Resampling.bilinear
-        )
+        new_width = max(1, int(src.width / factor))
+        new_height = max(1, int(src.height / factor))
+        sx, sy = src.width / new_width, src.height / new_height
 
         # Scale the transform accordingly
-        transform = src.transform * src.transform.scale(
-            src.width / new_width,
-            src.height / new_height
-        )
-
-        # Write to output
-        profile = src.profile
-        profile.update({
-            'height': new_height,
-            'width': new_width,
-            'transform': transform
-        })
-
-        with rasterio.open(output_path, 'w', **profile) as dst:
-            dst.write(data)
-            print("saved file")
+        transform = src.transform * src.transform.scale(sx, sy)
+        profile = _output_profile(src, new_width, new_height, transform, block_size, compress)
+        level = pick_overview_level(src, min(sx, sy))
+        count = src.count
+
+    # read from the chosen overview: its pixel grid is a (rounded) scale of the full-resolution one
+    open_kw = {"overview_level": level} if level is not None else {}
+    with rasterio.open(input_path, **open_kw) as lvl:
+        lx, ly = lvl.width / new_width, lvl.height / new_height
+
+    local = threading.local()
+    handles = []
+
+    def read_block(win: Window):
+        ds = getattr(local, "ds", None)
+        if ds is None:
+            ds = local.ds = rasterio.open(input_path, **open_kw)
+            handles.append(ds)
+        src_win = Window(win.col_off * lx, win.row_off * ly, win.width * lx, win.height * ly)
+        return win, ds.read(window=src_win, out_shape=(count, win.height, win.width), resampling=method)
+
+    windows = (
+        Window(c, r, min(block_size, new_width - c), min(block_size, new_height - r))
+        for r in range(0, new_height, block_size)
+        for c in range(0, new_width, block_size)
+    )
+    try:
+        with rasterio.Env(GDAL_CACHEMAX=int(cache_mb) * 1024 * 1024), \
+                rasterio.open(output_path, "w", **profile) as dst, ThreadPoolExecutor(max_workers=workers) as ex:
+            pending = set()
+            for win in windows:
+                pending.add(ex.submit(read_block, win))
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        win, data = fut.result()
+                        dst.write(data, window=win)
+            for fut in pending:
+                win, data = fut.result()
+                dst.write(data, window=win)
+    finally:
+        for ds in handles:
+            ds.close()
+    return output_path
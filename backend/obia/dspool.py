@@ -0,0 +1,110 @@
+# backend/obia/dspool.py
+"""
+Pool of open rasterio dataset handles for the tile server.
+
+Opening a GeoTIFF parses its header and IFDs every time; for tiles that is
+most of the cost of a request. Handles are kept open per (raster id, path,
+overview level, thread), since a GDAL dataset must not be used from two
+threads at once. The pool is bounded (least recently used idle handles are
+closed first) and can be invalidated per raster on delete/replace.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import rasterio
+
+
+class DatasetPool:
+    """
+    Parameters:
+        max_open (int): upper bound on idle + leased handles kept open.
+    """
+
+    def __init__(self, max_open: int = 64):
+        self.max_open = max(1, int(max_open))
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.opens = 0
+        self.reuses = 0
+
+    @contextmanager
+    def open(self, rid: str, path, overview_level: int | None = None):
+        """Lease a handle for the calling thread; use as `with pool.open(rid, path) as ds:`."""
+        key = (rid, str(path), overview_level, threading.get_ident())
+        with self._lock:
+            ent = self._entries.get(key)
+            if ent is not None and not ent["stale"]:
+                ent["leases"] += 1
+                self._entries.move_to_end(key)
+                self.reuses += 1
+            else:
+                ent = None
+        if ent is None:
+            kw = {"overview_level": overview_level} if overview_level is not None else {}
+            ds = rasterio.open(path, **kw)
+            ent = {"ds": ds, "rid": rid, "leases": 1, "stale": False}
+            with self._lock:
+                old = self._entries.pop(key, None)
+                self._entries[key] = ent
+                self.opens += 1
+            if old is not None and old["leases"] == 0:
+                old["ds"].close()
+        try:
+            yield ent["ds"]
+        finally:
+            to_close = []
+            with self._lock:
+                ent["leases"] -= 1
+                if ent["stale"] and ent["leases"] == 0:
+                    to_close.append(ent["ds"])
+                to_close += self._evict()
+            for ds in to_close:
+                ds.close()
+
+    def _evict(self) -> list:
+        """Pop least recently used idle handles beyond max_open (caller holds the lock)."""
+        closing = []
+        if len(self._entries) <= self.max_open:
+            return closing
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_open:
+                break
+            ent = self._entries[key]
+            if ent["leases"] == 0:
+                del self._entries[key]
+                closing.append(ent["ds"])
+        return closing
+
+    def invalidate(self, rid: str):
+        """Close every handle of a raster; leased ones close when released."""
+        closing = []
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e["rid"] == rid]:
+                ent = self._entries.pop(key)
+                ent["stale"] = True
+                if ent["leases"] == 0:
+                    closing.append(ent["ds"])
+        for ds in closing:
+            ds.close()
+
+    def close_all(self):
+        with self._lock:
+            ents = list(self._entries.values())
+            self._entries.clear()
+        for ent in ents:
+            ent["stale"] = True
+            if ent["leases"] == 0:
+                ent["ds"].close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": len(self._entries),
+                "leased": sum(1 for e in self._entries.values() if e["leases"]),
+                "max_open": self.max_open,
+                "opens": self.opens,
+                "reuses": self.reuses,
+            }
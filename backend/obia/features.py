@@ -0,0 +1,420 @@
+# backend/obia/features.py
+"""
+Per-segment feature extraction from the raster and the segment label raster.
+
+Every segment layer keeps its label raster next to the GeoJSON
+(`<stem>.labels.tif`), so features can be (re)computed at any time without
+rerunning segmentation. All statistics are computed for every segment at once
+with array operations (np.bincount / ufunc.at over the label raster, read in
+row strips), never per polygon, and written as a Parquet table `<stem>.features.parquet` keyed by
+segment_id.
+
+Feature groups (selectable per run):
+    spectral     band_{b}_mean / _std / _min / _max
+    percentiles  band_{b}_p{q} for q in `percentiles`
+    shape        area, perimeter, compactness, extent, elongation, eccentricity, orientation, bbox size
+    texture      band_{b}_grad_mean (Sobel), band_{b}_glcm_contrast / _glcm_homogeneity
+                 (grey-level co-occurrence at distance 1, horizontal + vertical pairs inside the segment)
+"""
+from __future__ import annotations
+
+import json
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from scipy import ndimage
+
+FEATURE_GROUPS = ("spectral", "percentiles", "shape", "texture")
+DEFAULT_GROUPS = ("spectral", "shape")
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+GLCM_LEVELS = 32
+
+_META_KEY = b"obia_features"
+_SOURCE_TAG = "OBIA_SOURCE"
+
+
+# ---- file layout
+def labels_path_for(geojson_path) -> Path:
+    p = Path(geojson_path)
+    return p.with_name(f"{p.stem}.labels.tif")
+
+
+def features_path_for(geojson_path) -> Path:
+    p = Path(geojson_path)
+    return p.with_name(f"{p.stem}.features.parquet")
+
+
+def rag_path_for(geojson_path) -> Path:
+    p = Path(geojson_path)
+    return p.with_name(f"{p.stem}.rag.npz")
+
+
+def segment_sidecars(geojson_path) -> list[Path]:
+    """Files that belong to a segment layer besides its GeoJSON."""
+    return [labels_path_for(geojson_path), features_path_for(geojson_path), rag_path_for(geojson_path)]
+
+
+def tag_labels_source(labels_path, raster_path):
+    """Remember which raster a label raster was computed from."""
+    with rasterio.open(labels_path, "r+") as dst:
+        dst.update_tags(**{_SOURCE_TAG: str(raster_path)})
+
+
+def labels_source(labels_path) -> str | None:
+    with rasterio.open(labels_path) as src:
+        return src.tags().get(_SOURCE_TAG)
+
+
+def parse_groups(spec) -> tuple[str, ...]:
+    """'spectral,shape' / ['texture'] / 'all' -> validated tuple of groups ('' or 'none' -> ())."""
+    if spec is None:
+        return DEFAULT_GROUPS
+    if isinstance(spec, str):
+        spec = [s.strip().lower() for s in spec.split(",")]
+    groups = [g for g in spec if g and g != "none"]
+    if groups == ["all"]:
+        return FEATURE_GROUPS
+    unknown = sorted(set(groups) - set(FEATURE_GROUPS))
+    if unknown:
+        raise ValueError(f"Unknown feature group(s): {', '.join(unknown)}. Use any of: {', '.join(FEATURE_GROUPS)}")
+    return tuple(g for g in FEATURE_GROUPS if g in groups)
+
+
+def groups_for_columns(columns) -> tuple[str, ...]:
+    """Feature groups that produce the given columns (e.g. a stored model's features)."""
+    found = set()
+    for c in columns:
+        if c.startswith("shape_"):
+            found.add("shape")
+        elif c.endswith(("_grad_mean", "_glcm_contrast", "_glcm_homogeneity")):
+            found.add("texture")
+        elif c.endswith(("_mean", "_std", "_min", "_max")):
+            found.add("spectral")
+        elif c.startswith("band_") and "_p" in c:
+            found.add("percentiles")
+    return tuple(g for g in FEATURE_GROUPS if g in found)
+
+
+# ---- per-group computations (labels are 1..n, 0 = no segment), accumulated over row strips
+class _Spectral:
+    def __init__(self, n):
+        self.s = np.zeros(n); self.ss = np.zeros(n)
+        self.vmin = np.full(n, np.inf); self.vmax = np.full(n, -np.inf)
+
+    def add(self, v, l):
+        self.s += np.bincount(l, weights=v, minlength=self.s.size)
+        self.ss += np.bincount(l, weights=v * v, minlength=self.s.size)
+        np.minimum.at(self.vmin, l, v)
+        np.maximum.at(self.vmax, l, v)
+
+    def result(self, ids, cnt, prefix) -> dict:
+        c = cnt[ids]
+        mean = self.s[ids] / c
+        return {
+            f"{prefix}_mean": mean,
+            f"{prefix}_std": np.sqrt(np.maximum(self.ss[ids] / c - mean * mean, 0.0)),
+            f"{prefix}_min": self.vmin[ids],
+            f"{prefix}_max": self.vmax[ids],
+        }
+
+
+class _Texture:
+    """Sobel gradient and GLCM pairs; strips come with one halo row above and below for the gradient."""
+
+    def __init__(self, n, lo, hi):
+        self.g = np.zeros(n); self.pairs = np.zeros(n); self.contrast = np.zeros(n); self.homog = np.zeros(n)
+        self.lo, self.span = lo, (hi - lo if hi > lo else 1.0)
+        self._last = None   # (quantized row, label row) at the bottom of the previous strip
+
+    def add(self, halo_band, top, lab2d):
+        n = self.g.size
+        rows = lab2d.shape[0]
+        grad = np.hypot(ndimage.sobel(halo_band, axis=0), ndimage.sobel(halo_band, axis=1))[top:top + rows]
+        self.g += np.bincount(lab2d.ravel(), weights=grad.ravel(), minlength=n)
+        del grad
+        band = halo_band[top:top + rows]
+        q = np.minimum(((band - self.lo) / self.span * GLCM_LEVELS).astype("int32"), GLCM_LEVELS - 1)
+        pairs = [(q[:, :-1], q[:, 1:], lab2d[:, :-1], lab2d[:, 1:]), (q[:-1, :], q[1:, :], lab2d[:-1, :], lab2d[1:, :])]
+        if self._last is not None:
+            pairs.append((self._last[0], q[0], self._last[1], lab2d[0]))
+        for a, b, la, lb in pairs:
+            same = la == lb
+            l = la[same]
+            d2 = (a[same] - b[same]).astype("float64") ** 2
+            self.pairs += np.bincount(l, minlength=n)
+            self.contrast += np.bincount(l, weights=d2, minlength=n)
+            self.homog += np.bincount(l, weights=1.0 / (1.0 + d2), minlength=n)
+        self._last = (q[-1].copy(), lab2d[-1].copy())
+
+    def result(self, ids, cnt, prefix) -> dict:
+        p = np.maximum(self.pairs[ids], 1.0)
+        return {
+            f"{prefix}_grad_mean": self.g[ids] / cnt[ids],
+            f"{prefix}_glcm_contrast": self.contrast[ids] / p,
+            f"{prefix}_glcm_homogeneity": np.where(self.pairs[ids] > 0, self.homog[ids] / p, 1.0),
+        }
+
+
+class _Shape:
+    def __init__(self, n, h, w):
+        self.h, self.w = h, w
+        self.vert = np.zeros(n)    # edges between horizontal neighbours (length px_h)
+        self.horiz = np.zeros(n)   # edges between vertical neighbours (length px_w)
+        self.sr = np.zeros(n); self.sc = np.zeros(n)
+        self.srr = np.zeros(n); self.scc = np.zeros(n); self.src = np.zeros(n)
+        self.rmin = np.full(n, h); self.rmax = np.full(n, -1)
+        self.cmin = np.full(n, w); self.cmax = np.full(n, -1)
+        self._cols = np.arange(w)
+        self._last = None
+
+    def add(self, r0, lab2d):
+        n, w = self.vert.size, self.w
+        r1 = r0 + lab2d.shape[0]
+        # perimeter: label changes between 4-neighbours, plus the raster border
+        d = lab2d[:, 1:] != lab2d[:, :-1]
+        self.vert += np.bincount(lab2d[:, 1:][d], minlength=n) + np.bincount(lab2d[:, :-1][d], minlength=n)
+        above = lab2d[:-1] if self._last is None else np.vstack([self._last[None], lab2d[:-1]])
+        below = lab2d[1:] if self._last is None else lab2d
+        d = below != above
+        self.horiz += np.bincount(below[d], minlength=n) + np.bincount(above[d], minlength=n)
+        del d, above, below
+        self.vert += np.bincount(lab2d[:, 0], minlength=n) + np.bincount(lab2d[:, -1], minlength=n)
+        if r0 == 0:
+            self.horiz += np.bincount(lab2d[0], minlength=n)
+        if r1 == self.h:
+            self.horiz += np.bincount(lab2d[-1], minlength=n)
+        self._last = lab2d[-1].copy()
+
+        # first and second moments of pixel coordinates, and bounding boxes
+        l = lab2d.ravel()
+        rr = np.repeat(np.arange(r0, r1), w)
+        cc = np.tile(self._cols, r1 - r0)
+        rf, cf = rr.astype("float64"), cc.astype("float64")
+        self.sr += np.bincount(l, weights=rf, minlength=n)
+        self.sc += np.bincount(l, weights=cf, minlength=n)
+        self.srr += np.bincount(l, weights=rf * rf, minlength=n)
+        self.scc += np.bincount(l, weights=cf * cf, minlength=n)
+        self.src += np.bincount(l, weights=rf * cf, minlength=n)
+        np.minimum.at(self.rmin, l, rr)
+        np.maximum.at(self.rmax, l, rr)
+        np.minimum.at(self.cmin, l, cc)
+        np.maximum.at(self.cmax, l, cc)
+
+    def result(self, ids, cnt, transform) -> dict:
+        px_w, px_h = abs(transform.a), abs(transform.e)
+        perimeter = (self.vert * px_h + self.horiz * px_w)[ids]
+        c = cnt[ids]
+        mr, mc = self.sr[ids] / c, self.sc[ids] / c
+        mu_rr = self.srr[ids] / c - mr * mr
+        mu_cc = self.scc[ids] / c - mc * mc
+        mu_rc = self.src[ids] / c - mr * mc
+        half = (mu_cc + mu_rr) / 2.0
+        root = np.sqrt(((mu_cc - mu_rr) / 2.0) ** 2 + mu_rc ** 2)
+        l1, l2 = half + root, np.maximum(half - root, 0.0)
+        bbox_h = (self.rmax[ids] - self.rmin[ids] + 1).astype("float64")
+        bbox_w = (self.cmax[ids] - self.cmin[ids] + 1).astype("float64")
+
+        area = c * px_w * px_h
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {
+                "shape_area": area,
+                "shape_perimeter": perimeter,
+                "shape_compactness": 4.0 * np.pi * area / np.maximum(perimeter, 1e-12) ** 2,
+                "shape_extent": c / (bbox_h * bbox_w),
+                "shape_bbox_width": bbox_w * px_w,
+                "shape_bbox_height": bbox_h * px_h,
+                "shape_elongation": np.where(l2 > 0, np.sqrt(l1 / np.where(l2 > 0, l2, 1.0)), 1.0),
+                "shape_eccentricity": np.where(l1 > 0, np.sqrt(1.0 - l2 / np.where(l1 > 0, l1, 1.0)), 0.0),
+                # degrees counter-clockwise from the x axis (rows grow downwards)
+                "shape_orientation": np.degrees(0.5 * np.arctan2(-2.0 * mu_rc, mu_cc - mu_rr)),
+            }
+
+
+def _percentiles(v, lab, ids, cnt, prefix, qs) -> dict:
+    """
+    Exact percentiles of the segments `ids`; `v`/`lab` must hold all their pixels
+    (and may hold label-0 pixels, which are dropped). Values are sorted within
+    each label; a percentile interpolates linearly between ranks.
+    """
+    keep = lab > 0
+    v, lab = v[keep], lab[keep]
+    order = np.lexsort((v, lab))
+    sv = v[order]
+    c = cnt[ids]
+    starts = np.concatenate([[0], np.cumsum(c)[:-1]]).astype("int64")
+    out = {}
+    for q in qs:
+        pos = starts + (q / 100.0) * (c - 1)
+        lo = np.floor(pos).astype("int64")
+        hi = np.ceil(pos).astype("int64")
+        out[f"{prefix}_p{q:g}"] = sv[lo] + (sv[hi] - sv[lo]) * (pos - lo)
+    return out
+
+
+def _label_batches(cnt, max_pixels: int) -> list[tuple[int, int]]:
+    """Label ranges [a, b) holding at most ~max_pixels pixels each (at least one label)."""
+    cum = np.cumsum(cnt)
+    out, a = [], 1
+    while a < cnt.size:
+        b = int(np.searchsorted(cum, cum[a - 1] + max_pixels, side="right"))
+        b = min(cnt.size, max(b, a + 1))
+        out.append((a, b))
+        a = b
+    return out
+
+
+# ---- strip readers
+def _label_strips(lab_ds, strip_rows):
+    h, w = lab_ds.height, lab_ds.width
+    for r0 in range(0, h, strip_rows):
+        r1 = min(h, r0 + strip_rows)
+        yield r0, lab_ds.read(1, window=Window(0, r0, w, r1 - r0)).astype("int64", copy=False)
+
+
+def _band_rows(src, b, r0, r1, h, w):
+    """Rows r0:r1 of band b resampled onto the h x w label grid (average), as float32."""
+    sy = src.height / h
+    win = Window(0, r0 * sy, src.width, (r1 - r0) * sy)
+    return src.read(b, window=win, out_shape=(r1 - r0, w), resampling=Resampling.average).astype("float32", copy=False)
+
+
+# ---- main entry
+def extract_features(raster_path, labels_path, groups=DEFAULT_GROUPS, percentiles=DEFAULT_PERCENTILES,
+                     strip_rows: int = 1024, percentile_pixels: int = 1 << 23) -> tuple[pd.DataFrame, dict]:
+    """
+    Compute per-segment features from the label raster and the raster, read in
+    row strips of `strip_rows`, so memory stays bounded for rasters that were
+    segmented in windows. Spectral, shape and texture statistics are accumulated
+    strip by strip (texture needs one extra pass for each band's range);
+    percentiles need every pixel of a segment at once and are computed over
+    label ranges of at most ~`percentile_pixels` pixels, one pass each.
+
+    The raster is read band by band on the label raster's grid (average
+    resampling, i.e. the segmentation's working resolution).
+
+    Returns:
+        (table, columns_by_group): one row per segment_id, and the columns each
+        requested group contributed.
+    """
+    groups = parse_groups(groups)
+    band_groups = {"spectral", "texture"} & set(groups)
+    with rasterio.open(labels_path) as lab_ds, \
+            (rasterio.open(raster_path) if {"spectral", "percentiles", "texture"} & set(groups) else nullcontext()) as src:
+        h, w, transform = lab_ds.height, lab_ds.width, lab_ds.transform
+        bands = range(1, src.count + 1) if src is not None else ()
+
+        # pass 1: pixels per label (and each band's range for the GLCM quantization)
+        cnt = np.zeros(1, dtype="int64")
+        lo = {b: np.inf for b in bands}
+        hi = {b: -np.inf for b in bands}
+        for r0, lab2d in _label_strips(lab_ds, strip_rows):
+            c = np.bincount(lab2d.ravel())
+            if c.size > cnt.size:
+                cnt = np.pad(cnt, (0, c.size - cnt.size))
+            cnt[:c.size] += c
+            if "texture" in groups:
+                for b in bands:
+                    band = _band_rows(src, b, r0, r0 + lab2d.shape[0], h, w)
+                    lo[b], hi[b] = min(lo[b], float(band.min())), max(hi[b], float(band.max()))
+        cnt[0] = 0
+        ids = np.flatnonzero(cnt)
+        n = cnt.size
+
+        # pass 2: spectral / shape / texture accumulators
+        shape = _Shape(n, h, w) if "shape" in groups else None
+        spectral = {b: _Spectral(n) for b in bands} if "spectral" in groups else {}
+        texture = {b: _Texture(n, lo[b], hi[b]) for b in bands} if "texture" in groups else {}
+        if shape is not None or band_groups:
+            for r0, lab2d in _label_strips(lab_ds, strip_rows):
+                r1 = r0 + lab2d.shape[0]
+                if shape is not None:
+                    shape.add(r0, lab2d)
+                for b in bands if band_groups else ():
+                    if b in texture:
+                        h0, h1 = max(0, r0 - 1), min(h, r1 + 1)
+                        halo = _band_rows(src, b, h0, h1, h, w)
+                        band = halo[r0 - h0:r0 - h0 + (r1 - r0)]
+                        texture[b].add(halo, r0 - h0, lab2d)
+                    else:
+                        band = _band_rows(src, b, r0, r1, h, w)
+                    if b in spectral:
+                        spectral[b].add(band.ravel().astype("float64"), lab2d.ravel())
+
+        # percentiles: one pass per band over each batch of labels
+        pct = {b: {} for b in bands} if "percentiles" in groups else {}
+        for a, z in _label_batches(cnt, percentile_pixels) if pct else ():
+            batch_ids = ids[(ids >= a) & (ids < z)]
+            for b in bands:
+                vs, ls = [], []
+                for r0, lab2d in _label_strips(lab_ds, strip_rows):
+                    l = lab2d.ravel()
+                    m = (l >= a) & (l < z)
+                    if m.any():
+                        ls.append(l[m])
+                        vs.append(_band_rows(src, b, r0, r0 + lab2d.shape[0], h, w).ravel()[m])
+                if ls:
+                    part = _percentiles(np.concatenate(vs), np.concatenate(ls), batch_ids, cnt, f"band_{b}", percentiles)
+                    for k, v in part.items():
+                        pct[b].setdefault(k, []).append(v)
+
+    columns: dict[str, np.ndarray] = {"segment_id": ids.astype("int64")}
+    by_group: dict[str, list[str]] = {}
+
+    def _add(group, cols):
+        columns.update(cols)
+        by_group.setdefault(group, []).extend(cols)
+
+    if shape is not None:
+        _add("shape", shape.result(ids, cnt, transform))
+    for b in bands:
+        prefix = f"band_{b}"
+        if b in spectral:
+            _add("spectral", spectral[b].result(ids, cnt, prefix))
+        if b in pct:
+            _add("percentiles", {k: np.concatenate(v) for k, v in pct[b].items()})
+        if b in texture:
+            _add("texture", texture[b].result(ids, cnt, prefix))
+
+    table = pd.DataFrame(columns)
+    return table, {g: by_group[g] for g in groups if g in by_group}
+
+
+def write_features(table: pd.DataFrame, columns_by_group: dict, out_path, **meta) -> Path:
+    """Write the feature table as Parquet; the group -> columns map goes into the schema metadata."""
+    out_path = Path(out_path)
+    t = pa.Table.from_pandas(table, preserve_index=False)
+    md = dict(t.schema.metadata or {})
+    md[_META_KEY] = json.dumps({"groups": columns_by_group, **meta}).encode("utf-8")
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    pq.write_table(t.replace_schema_metadata(md), tmp, compression="zstd")
+    tmp.replace(out_path)
+    return out_path
+
+
+def feature_groups(path) -> dict:
+    """group -> columns map of a feature table ({} if it has none)."""
+    md = pq.read_schema(path).metadata or {}
+    try:
+        return json.loads(md[_META_KEY]).get("groups", {})
+    except (KeyError, ValueError):
+        return {}
+
+
+def read_features(path, groups=None) -> tuple[pd.DataFrame, list[str]]:
+    """Load a feature table, optionally restricted to `groups`; returns (table, feature columns)."""
+    available = feature_groups(path)
+    if groups is None:
+        cols = [c for g in available.values() for c in g]
+    else:
+        missing = [g for g in groups if g not in available]
+        if missing:
+            raise ValueError(f"Feature group(s) not computed for this segment: {', '.join(missing)}")
+        cols = [c for g in groups for c in available[g]]
+    return pd.read_parquet(path, columns=["segment_id", *cols]), cols
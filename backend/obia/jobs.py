@@ -0,0 +1,270 @@
+# backend/obia/jobs.py
+"""
+Background job queue for the CPU-bound pipeline steps (segment, classify, merge).
+
+Jobs run in a process pool so the FastAPI event loop stays free for tiles and
+listings. Workers report progress through a small JSON file per job
+(`<jobs_dir>/<job_id>.json`); cancellation of a running job is cooperative and
+signalled with a `<job_id>.cancel` marker that `progress()` checks.
+
+Each job runs under a trace (tracing.py): the worker's spans come back with the
+result, are kept on the job record and merged into the waiting request's trace.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from .tracing import trace, span, current_trace, current_span
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled while running."""
+
+
+# ---- worker side
+_CURRENT: dict = {}
+
+def progress(fraction: float, stage: str | None = None):
+    """
+    Report progress from inside a running job; no-op outside of one.
+    Also the cancellation point: raises JobCancelled if the job was cancelled.
+    """
+    job_id, jobs_dir = _CURRENT.get("id"), _CURRENT.get("dir")
+    if not job_id:
+        return
+    if (Path(jobs_dir) / f"{job_id}.cancel").exists():
+        raise JobCancelled(f"job {job_id} cancelled")
+    _write_state(jobs_dir, job_id, {
+        "state": "running",
+        "progress": round(max(0.0, min(1.0, float(fraction))), 4),
+        "stage": stage,
+        "started_at": _CURRENT.get("started_at"),
+    })
+
+def _write_state(jobs_dir, job_id, state: dict):
+    p = Path(jobs_dir) / f"{job_id}.json"
+    tmp = p.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state), encoding="utf-8")
+    tmp.replace(p)
+
+def _run_job(job_id: str, jobs_dir: str, kind: str, fn, args, kwargs):
+    _CURRENT.update(id=job_id, dir=jobs_dir, started_at=time.time())
+    try:
+        progress(0.0, "started")
+        with trace(f"job {kind}", trace_id=job_id) as t, span(f"job_{kind}"):
+            result = fn(*args, **kwargs)
+        return result, t.to_dict()
+    finally:
+        _CURRENT.clear()
+
+
+# ---- server side
+class JobManager:
+    """
+    Process-pool job queue.
+
+    Parameters:
+        workers (int): number of worker processes.
+        jobs_dir (str | Path): where per-job progress/cancel files live.
+        keep (int): how many finished jobs to remember for /jobs.
+        on_finish (callable | None): called with a copy of every finished job record
+            (state, timings and the worker "trace"), e.g. to feed metrics.
+    """
+
+    def __init__(self, workers: int, jobs_dir, keep: int = 200, start_method: str = "spawn", on_finish=None):
+        self.workers = max(1, int(workers))
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+        self.start_method = start_method
+        self.on_finish = on_finish
+        self._pool: ProcessPoolExecutor | None = None
+        self._jobs: dict[str, dict] = {}
+        self._futures: dict = {}
+        self._callbacks: dict = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=mp.get_context(self.start_method))
+            return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor):
+        """Drop a broken pool (a worker died) so the next job starts a fresh one."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, kind: str, fn, *args, on_done=None, **kwargs) -> dict:
+        """Queue `fn(*args, **kwargs)`; `on_done(result)` runs in this process when it succeeds."""
+        job_id = uuid.uuid4().hex
+        rec = {
+            "id": job_id, "kind": kind, "state": "queued", "progress": 0.0, "stage": None,
+            "submitted_at": time.time(), "started_at": None, "finished_at": None,
+            "result": None, "error": None, "trace": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = rec
+        for attempt in range(2):
+            pool = self._executor()
+            try:
+                fut = pool.submit(_run_job, job_id, str(self.jobs_dir), kind, fn, args, kwargs)
+                break
+            except BrokenProcessPool as e:
+                # the pool broke since the last job finished; retry once on a fresh one
+                self._discard(pool)
+                if attempt:
+                    with self._lock:
+                        rec.update(state="error", finished_at=time.time(),
+                                   error=f"BrokenProcessPool: {e}")
+                    return self.get(job_id)
+        with self._lock:
+            self._futures[job_id] = fut
+            if on_done is not None:
+                self._callbacks[job_id] = on_done
+        fut.add_done_callback(lambda f, jid=job_id, pool=pool: self._finish(jid, f, pool))
+        return self.get(job_id)
+
+    def _finish(self, job_id: str, fut, pool: ProcessPoolExecutor | None = None):
+        now = time.time()
+        if pool is not None and not fut.cancelled() and isinstance(fut.exception(), BrokenProcessPool):
+            # every job queued on a broken pool fails with it; later jobs get a new pool
+            self._discard(pool)
+        with self._lock:
+            cb = self._callbacks.pop(job_id, None)
+        ok = not fut.cancelled() and fut.exception() is None
+        result, job_trace = fut.result() if ok else (None, None)
+        if cb is not None and ok:
+            try:
+                cb(result)
+            except Exception:
+                pass
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is None:
+                return
+            self._merge_worker_state(rec)
+            rec["finished_at"] = now
+            if fut.cancelled():
+                rec["state"] = "cancelled"
+            else:
+                err = fut.exception()
+                if err is None:
+                    rec["state"], rec["progress"], rec["result"], rec["trace"] = "done", 1.0, result, job_trace
+                elif isinstance(err, JobCancelled):
+                    rec["state"] = "cancelled"
+                elif isinstance(err, BrokenProcessPool):
+                    rec["state"] = "error"
+                    rec["error"] = f"BrokenProcessPool: a worker process died ({err})"
+                else:
+                    rec["state"] = "error"
+                    rec["error"] = f"{type(err).__name__}: {err}"
+                    rec["traceback"] = "".join(traceback.format_exception(err))[-4000:]
+            self._prune()
+            done = dict(rec)
+        if self.on_finish is not None:
+            try:
+                self.on_finish(done)
+            except Exception:
+                pass
+        for suffix in (".json", ".cancel"):
+            (self.jobs_dir / f"{job_id}{suffix}").unlink(missing_ok=True)
+
+    def _merge_worker_state(self, rec: dict):
+        p = self.jobs_dir / f"{rec['id']}.json"
+        try:
+            st = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if rec["state"] == "queued":
+            rec["state"] = st.get("state", rec["state"])
+        rec["progress"] = st.get("progress", rec["progress"])
+        rec["stage"] = st.get("stage", rec["stage"])
+        rec["started_at"] = st.get("started_at") or rec["started_at"]
+
+    def _prune(self):
+        finished = [r for r in self._jobs.values() if r["finished_at"] is not None]
+        if len(finished) <= self.keep:
+            return
+        finished.sort(key=lambda r: r["finished_at"])
+        for r in finished[: len(finished) - self.keep]:
+            self._jobs.pop(r["id"], None)
+            self._futures.pop(r["id"], None)
+
+    def get(self, job_id: str, with_result: bool = True) -> dict | None:
+        """Job record; `with_result=False` drops the result and trace (listings)."""
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is None:
+                return None
+            if rec["finished_at"] is None:
+                self._merge_worker_state(rec)
+            out = dict(rec)
+        if not with_result:
+            out.pop("result", None)
+            out.pop("trace", None)
+        now = time.time()
+        start = out["started_at"] or (None if out["finished_at"] else now)
+        out["queue_seconds"] = round((start or out["finished_at"]) - out["submitted_at"], 3)
+        if out["started_at"]:
+            out["run_seconds"] = round((out["finished_at"] or now) - out["started_at"], 3)
+        return out
+
+    def finished(self, job_id: str) -> bool:
+        """True once a job is over (or unknown); in memory only, unlike get()."""
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            return rec is None or rec["finished_at"] is not None
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            ids = list(self._jobs)
+        return [self.get(j, with_result=False) for j in reversed(ids)]
+
+    def cancel(self, job_id: str) -> dict | None:
+        with self._lock:
+            fut = self._futures.get(job_id)
+            rec = self._jobs.get(job_id)
+        if rec is None:
+            return None
+        if fut is not None and not fut.done() and not fut.cancel():
+            # already running: ask the worker to stop at its next progress() call
+            (self.jobs_dir / f"{job_id}.cancel").touch()
+            with self._lock:
+                rec["cancel_requested"] = True
+        return self.get(job_id, with_result=False)
+
+    async def wait(self, job_id: str):
+        """
+        Await a job's result without blocking the event loop (re-raises worker errors).
+        The job's spans are merged into the caller's trace, if any.
+        """
+        with self._lock:
+            fut = self._futures[job_id]
+        try:
+            result, job_trace = await asyncio.wrap_future(fut)
+        except CancelledError:
+            raise JobCancelled(f"job {job_id} cancelled")
+        t = current_trace()
+        if t is not None and job_trace is not None:
+            t.merge(job_trace, parent=current_span())
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,15 +1,131 @@
-from shapely.geometry import Polygon, MultiPolygon
-from shapely.ops import unary_union
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from shapely.errors import GEOSException
 from shapely.validation import make_valid
 import geopandas as gpd
 import pandas as pd
 from nickyspatial.core.layer import Layer
-from nickyspatial import plot_classification
 
-def merge_clean_polygons(layer_obj, class_column="classification", target_class="all", area_attr="area_pixels"):
+from .tracing import span
+
+PARTITION_SIZE = 5000    # polygons dissolved together in one grid cell
+PARALLEL_MIN = 20000     # smaller classes are dissolved in-process
+_POLYGON, _MULTIPOLYGON = 3, 6
+
+
+def _union_parts(geoms):
+    """Union of `geoms`, exploded into its polygon parts."""
+    parts = shapely.get_parts(shapely.union_all(geoms))
+    return parts[shapely.get_type_id(parts) == _POLYGON]
+
+
+def _grid_partitions(geoms, size):
+    """Indices of `geoms` grouped by a square grid over their bbox centers, ~`size` per cell."""
+    n = len(geoms)
+    k = int(math.ceil(math.sqrt(n / size)))
+    if k <= 1:
+        return [np.arange(n)]
+    b = shapely.bounds(geoms)
+    cx = (b[:, 0] + b[:, 2]) / 2
+    cy = (b[:, 1] + b[:, 3]) / 2
+    x0, x1, y0, y1 = np.nanmin(cx), np.nanmax(cx), np.nanmin(cy), np.nanmax(cy)
+    ix = np.clip(((cx - x0) / max(x1 - x0, 1e-12) * k).astype(np.int64), 0, k - 1)
+    iy = np.clip(((cy - y0) / max(y1 - y0, 1e-12) * k).astype(np.int64), 0, k - 1)
+    cell = iy * k + ix
+    order = np.argsort(cell, kind="stable")
+    _, starts = np.unique(cell[order], return_index=True)
+    return np.split(order, starts[1:])
+
+
+def _dissolve(geoms, executor=None, size=PARTITION_SIZE):
+    """
+    Polygon parts of the union of `geoms`.
+
+    The polygons are split into grid partitions that are dissolved independently
+    (in parallel on `executor`). A dissolved part that doesn't intersect a part of
+    another partition is already final; the others are grouped into connected
+    components (STRtree query + csgraph) and each component is unioned once more.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    cells = _grid_partitions(geoms, size)
+    if len(cells) == 1:
+        return _union_parts(geoms)
+    run = executor.map if executor is not None else map
+    dissolved = list(run(_union_parts, [geoms[c] for c in cells]))
+    parts = np.concatenate(dissolved)
+    owner = np.repeat(np.arange(len(dissolved)), [len(d) for d in dissolved])
+
+    a, b = shapely.STRtree(parts).query(parts, predicate="intersects")
+    cross = owner[a] != owner[b]
+    a, b = a[cross], b[cross]
+    if a.size == 0:
+        return parts
+    n = len(parts)
+    linked = np.zeros(n, dtype=bool)
+    linked[a] = True
+    _, comp = connected_components(coo_matrix((np.ones(a.size), (a, b)), shape=(n, n)), directed=False)
+    idx = np.flatnonzero(linked)
+    idx = idx[np.argsort(comp[idx], kind="stable")]
+    _, starts = np.unique(comp[idx], return_index=True)
+    groups = [parts[g] for g in np.split(idx, starts[1:])]
+    merged = list(run(_union_parts, groups))
+    return np.concatenate([parts[~linked], *merged])
+
+
+def _outer_shells(parts):
+    """Polygons from the exterior rings only (holes filled)."""
+    return shapely.polygons(shapely.get_exterior_ring(parts))
+
+
+def _clean_geometries(geoms):
+    """make_valid + buffer(0) over the whole array; non-polygonal results become None."""
+    geoms = np.asarray(geoms, dtype=object)
+    try:
+        out = geoms.copy()
+        bad = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+        out[bad] = shapely.make_valid(geoms[bad])
+        out = shapely.buffer(out, 0)
+    except GEOSException:
+        out = np.array([_clean_one(g) for g in geoms], dtype=object)
+    keep = np.isin(shapely.get_type_id(out), (_POLYGON, _MULTIPOLYGON))
+    out[~keep] = None
+    return out
+
+
+def _clean_one(geom):
+    try:
+        if not geom.is_valid:
+            geom = make_valid(geom)
+        return geom.buffer(0)
+    except Exception:
+        return None
+
+
+def _plot_merged(layer, class_column):
+    """Notebook preview of the merged layer (pyplot is only imported here)."""
+    from nickyspatial import plot_classification
+
+    if class_column in layer.objects.columns:
+        return plot_classification(layer, class_field=class_column)
+    layer.objects["__dummy__"] = "merged"
+    return plot_classification(layer, class_field="__dummy__")
+
+
+def merge_clean_polygons(layer_obj, class_column="classification", target_class="all", area_attr="area_pixels",
+                         workers=None, plot=False):
     """
     Merge polygons of the same class while avoiding artifacts and invalid geometries.
     Cleans geometries before creating the final Layer.
+
+    Large classes are dissolved in spatial partitions across `workers` processes
+    (default: all cores); see _dissolve. `plot=True` draws the result with
+    matplotlib, for notebooks; the server leaves it off.
     """
     gdf = layer_obj.objects.copy()
 
@@ -17,65 +133,59 @@ def merge_clean_polygons(layer_obj, class_column="classification", target_class=
         print(f"Invalid input: empty GeoDataFrame or missing '{class_column}' column.")
         return layer_obj.copy()
 
-    result_rows = []
-
-    if target_class == "all":
-        class_values = gdf[class_column].dropna().unique()
-
-        for cls in class_values:
-            class_subset = gdf[gdf[class_column] == cls].copy()
-            if class_subset.empty:
-                continue
-
-            unioned = unary_union(class_subset.geometry)
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    executor = None
 
-            if isinstance(unioned, Polygon):
-                result_rows.append({"classification": cls, "geometry": Polygon(unioned.exterior)})
-            elif isinstance(unioned, MultiPolygon):
-                for poly in unioned.geoms:
-                    result_rows.append({"classification": cls, "geometry": Polygon(poly.exterior)})
+    def dissolve(geoms):
+        nonlocal executor
+        if executor is None and workers > 1 and len(geoms) >= PARALLEL_MIN:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        with span("union", polygons=int(len(geoms))):
+            return _outer_shells(_dissolve(geoms.values, executor))
 
-        final_gdf = gpd.GeoDataFrame(result_rows, crs=gdf.crs)
-
-    else:
-        target_gdf = gdf[gdf[class_column] == target_class].copy()
-        non_target_gdf = gdf[gdf[class_column] != target_class].copy()
+    try:
+        if target_class == "all":
+            class_values = gdf[class_column].dropna().unique()
+
+            classes, merged = [], []
+            for cls in class_values:
+                class_subset = gdf.geometry[gdf[class_column] == cls]
+                if class_subset.empty:
+                    continue
+                shells = dissolve(class_subset)
+                classes += [cls] * len(shells)
+                merged.append(shells)
+
+            final_gdf = gpd.GeoDataFrame(
+                {"classification": classes,
+                 "geometry": np.concatenate(merged) if merged else np.empty(0, dtype=object)},
+                geometry="geometry", crs=gdf.crs)
 
-        if target_gdf.empty:
-            print(f"No features found for class '{target_class}'.")
-            return layer_obj.copy()
+        else:
+            target_gdf = gdf[gdf[class_column] == target_class].copy()
+            non_target_gdf = gdf[gdf[class_column] != target_class].copy()
 
-        unioned = unary_union(target_gdf.geometry)
+            if target_gdf.empty:
+                print(f"No features found for class '{target_class}'.")
+                return layer_obj.copy()
 
-        cleaned_geoms = []
-        if isinstance(unioned, Polygon):
-            cleaned_geoms = [Polygon(unioned.exterior)]
-        elif isinstance(unioned, MultiPolygon):
-            cleaned_geoms = [Polygon(p.exterior) for p in unioned.geoms]
+            cleaned_geoms = dissolve(target_gdf.geometry)
 
-        cleaned_target = gpd.GeoDataFrame({
-            class_column: [target_class] * len(cleaned_geoms),
-            "geometry": cleaned_geoms
-        }, crs=gdf.crs)
+            cleaned_target = gpd.GeoDataFrame({
+                class_column: [target_class] * len(cleaned_geoms),
+                "geometry": cleaned_geoms
+            }, crs=gdf.crs)
 
-        final_gdf = pd.concat([cleaned_target, non_target_gdf], ignore_index=True)
+            final_gdf = pd.concat([cleaned_target, non_target_gdf], ignore_index=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Clean geometries and remove invalid ones
-    cleaned_geoms = []
-    for geom in final_gdf.geometry:
-        try:
-            if not geom.is_valid:
-                geom = make_valid(geom)
-            geom = geom.buffer(0)
-            if isinstance(geom, (Polygon, MultiPolygon)):
-                cleaned_geoms.append(geom)
-            else:
-                cleaned_geoms.append(None)
-        except Exception:
-            cleaned_geoms.append(None)
-
-    final_gdf["geometry"] = cleaned_geoms
-    final_gdf = final_gdf.dropna(subset=["geometry"])
+    with span("clean") as sp:
+        final_gdf["geometry"] = _clean_geometries(final_gdf.geometry.values)
+        final_gdf = final_gdf.dropna(subset=["geometry"])
+        sp.set(polygons=int(len(final_gdf)))
 
     if area_attr in gdf.columns:
         final_gdf[area_attr] = final_gdf.geometry.area
@@ -86,13 +196,10 @@ def merge_clean_polygons(layer_obj, class_column="classification", target_class=
     new_layer.transform = layer_obj.transform
     new_layer.metadata = layer_obj.metadata.copy()
 
-    try:
-        if class_column in final_gdf.columns:
-            plot_classification(new_layer, class_field=class_column)
-        else:
-            new_layer.objects["__dummy__"] = "merged"
-            plot_classification(new_layer, class_field="__dummy__")
-    except Exception as e:
-        print(f"[WARNING] Plotting failed: {e}")
+    if plot:
+        try:
+            _plot_merged(new_layer, class_column)
+        except Exception as e:
+            print(f"[WARNING] Plotting failed: {e}")
 
     return new_layer
@@ -0,0 +1,197 @@
+# backend/obia/metrics.py
+"""
+Minimal in-process metrics with Prometheus text exposition (format 0.0.4).
+
+Counters and histograms carry optional labels; callback metrics read their
+value at scrape time (cache hit counts, pool queue depth, ...). Everything is
+guarded by a lock, so metrics can be updated from the event loop, the render
+and reader thread pools and the job-manager callbacks alike. This covers what
+the app needs without a prometheus_client dependency; the output is scraped by
+Prometheus (or read by hand) at GET /metrics.
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Callable, Iterable
+
+# latency buckets (seconds): sub-ms tile hits up to multi-minute segmentation jobs
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count; `inc(amount, **labels)`."""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; `observe(value, **labels)`."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {}   # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = self._header()
+        for key, row in items:
+            acc = 0
+            for le, n in zip(self.buckets + (math.inf,), row):
+                acc += n
+                le_label = 'le="%s"' % _fmt(le)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(row[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {row[-1]}")
+        return out
+
+
+class Callback(_Metric):
+    """
+    Value(s) read at scrape time.
+
+    Parameters:
+        fn: returns a number, or a dict {label values tuple: number} when `labels` are given.
+        kind (str): "gauge" or "counter".
+    """
+
+    def __init__(self, name, help, fn: Callable, labels=(), kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        try:
+            v = self.fn()
+        except Exception:
+            return []
+        items = sorted(v.items()) if self.labelnames else [((), v)]
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(x)}" for k, x in items]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, m: _Metric) -> _Metric:
+        with self._lock:
+            if m.name in self._metrics:
+                raise ValueError(f"metric {m.name} already registered")
+            self._metrics[m.name] = m
+        return m
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable, labels: tuple[str, ...] = (),
+                 kind: str = "gauge") -> Callback:
+        return self._register(Callback(name, help, fn, labels, kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# pipeline stages, fed from job and request traces (see observe_trace)
+STAGE_SECONDS = REGISTRY.histogram(
+    "obia_stage_seconds", "Wall time of pipeline stages (raster read, slic, vectorize, to_crs, train, ...).",
+    ("stage",))
+POLYGONS = REGISTRY.counter("obia_polygons_total", "Polygons produced, by stage.", ("stage",))
+PIXELS = REGISTRY.counter("obia_pixels_total", "Raster pixels processed, by stage.", ("stage",))
+
+
+def observe_trace(t: dict):
+    """Feed the spans of a finished trace (Trace.to_dict()) into the stage metrics."""
+    for sp in t["spans"]:
+        if sp["duration_ms"] is None:
+            continue
+        STAGE_SECONDS.observe(sp["duration_ms"] / 1000.0, stage=sp["name"])
+        attrs = sp["attrs"]
+        if "polygons" in attrs:
+            POLYGONS.inc(attrs["polygons"], stage=sp["name"])
+        if "pixels" in attrs:
+            PIXELS.inc(attrs["pixels"], stage=sp["name"])
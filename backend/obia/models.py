@@ -0,0 +1,104 @@
+# backend/obia/models.py
+"""
+Registry of fitted classifiers.
+
+A trained RF / SVC / KNN estimator is stored with joblib as
+`<models_dir>/<model_id>.joblib`, next to a small JSON record
+(`<model_id>.json`) with the method, parameters, feature columns, classes and
+accuracy. The id is content-derived: the samples, the classifier type and
+parameters, the segment layer and the candidate feature columns. Retraining
+with unchanged inputs therefore finds the existing model, and any stored model
+can be applied to another segment layer that has the same feature columns.
+Files are written atomically, so workers in different processes can share the
+registry.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+
+import joblib
+
+from .tilecache import tile_key
+
+
+def samples_hash(samples: dict) -> str:
+    """Order-independent hash of {class: [segment_ids]}."""
+    norm = {str(k): sorted(int(i) for i in v) for k, v in samples.items()}
+    return tile_key("samples", json.dumps(norm, sort_keys=True))
+
+
+def model_key(samples_sha1: str, classifier_type: str, params: dict, segment_id: str, columns) -> str:
+    return tile_key("model", samples_sha1, classifier_type, sorted(params.items()), segment_id, sorted(columns))
+
+
+class ModelRegistry:
+    """
+    Parameters:
+        models_dir (str | Path): where the .joblib models and their .json records live.
+    """
+
+    def __init__(self, models_dir):
+        self.models_dir = Path(models_dir)
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, model_id: str) -> tuple[Path, Path]:
+        name = os.path.basename(model_id)
+        return self.models_dir / f"{name}.joblib", self.models_dir / f"{name}.json"
+
+    def get(self, model_id: str) -> dict | None:
+        model_p, meta_p = self._paths(model_id)
+        if not model_p.exists():
+            return None
+        try:
+            return json.loads(meta_p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def load(self, model_id: str):
+        """(estimator, record) for a stored model, or None."""
+        meta = self.get(model_id)
+        if meta is None:
+            return None
+        model_p, meta_p = self._paths(model_id)
+        try:
+            est = joblib.load(model_p)
+        except (OSError, EOFError, ValueError):
+            return None
+        meta["last_used"] = time.time()
+        self._write_json(meta_p, meta)
+        return est, meta
+
+    def save(self, model_id: str, estimator, **meta) -> dict:
+        model_p, meta_p = self._paths(model_id)
+        tmp = model_p.with_name(f"{model_p.name}.{os.getpid()}.tmp")
+        joblib.dump(estimator, tmp, compress=3)
+        tmp.replace(model_p)
+        now = time.time()
+        rec = {"id": model_id, **meta, "created": now, "last_used": now, "bytes": model_p.stat().st_size}
+        self._write_json(meta_p, rec)
+        return rec
+
+    @staticmethod
+    def _write_json(p: Path, rec: dict):
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(rec, indent=2), encoding="utf-8")
+        tmp.replace(p)
+
+    def list(self) -> list[dict]:
+        out = []
+        for p in self.models_dir.glob("*.json"):
+            rec = self.get(p.stem)
+            if rec is not None:
+                out.append(rec)
+        return sorted(out, key=lambda r: r.get("created", 0), reverse=True)
+
+    def delete(self, model_id: str) -> bool:
+        found = False
+        for p in self._paths(model_id):
+            if p.exists():
+                p.unlink()
+                found = True
+        return found
@@ -0,0 +1,192 @@
+# backend/obia/modelselect.py
+"""
+Cross-validated model selection for the classification stage.
+
+Candidates are RF / SVC / KNN parameter sets from a grid (DEFAULT_GRID, or
+one given per request). Every (candidate, fold) fit is one task on a joblib
+process pool, so folds and candidates spread over all cores; candidates are
+queued round-robin across methods, so a time budget that runs out still leaves
+each method evaluated. When the budget is spent, no further fits start, the
+running ones are abandoned, and candidates with unfinished folds are left out
+of the ranking. A fit that raises marks its candidate as failed on the
+leaderboard (like sklearn's error_score) instead of failing the selection.
+The winner is refitted on all samples by the caller
+(classification.select_model) and stored in the ModelRegistry like any
+/classify model.
+"""
+from __future__ import annotations
+
+import itertools
+import multiprocessing
+import time
+from typing import Callable
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, balanced_accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+METHODS = ("rf", "svm", "knn")
+SCORES = ("f1_macro", "accuracy", "balanced_accuracy")
+
+# values tried per parameter, on top of the /classify defaults (classification._classifier_config).
+# `scale` standardizes the features first (SVC and KNN are distance-based).
+DEFAULT_GRID = {
+    "rf": {"n_estimators": [100, 300], "max_depth": [None, 20], "max_features": ["sqrt", 0.5]},
+    "svm": {"C": [0.1, 1.0, 10.0, 100.0], "gamma": ["scale", 0.01, 0.1], "scale": [True, False]},
+    "knn": {"n_neighbors": [3, 5, 9, 15], "weights": ["uniform", "distance"], "scale": [True, False]},
+}
+
+
+def make_estimator(classifier_type: str, params: dict):
+    """The sklearn estimator SupervisedClassifier would fit, wrapped with a StandardScaler when `scale`."""
+    params = dict(params)
+    scale = bool(params.pop("scale", False))
+    if classifier_type == "Random Forest":
+        est = RandomForestClassifier(**params)
+    elif classifier_type == "SVC":
+        est = SVC(**params)
+    elif classifier_type == "KNN":
+        est = KNeighborsClassifier(**params)
+    else:
+        raise ValueError(f"Unsupported classifier type: {classifier_type}")
+    return make_pipeline(StandardScaler(), est) if scale else est
+
+
+def expand_grid(methods, grid: dict | None, config: Callable) -> list[tuple[str, str, dict]]:
+    """
+    (method, classifier_type, params) candidates, interleaved across methods.
+    `grid` maps a method to {param: [values]} and replaces DEFAULT_GRID for that
+    method; `config(method, params)` adds the method's defaults (see
+    classification._classifier_config).
+    """
+    grid = grid or {}
+    per_method = []
+    for m in methods:
+        if m not in METHODS:
+            raise ValueError(f"Unsupported method {m!r}. Use any of: {' | '.join(METHODS)}")
+        space = grid.get(m, DEFAULT_GRID[m])
+        if not isinstance(space, dict) or not all(isinstance(v, list) and v for v in space.values()):
+            raise ValueError(f"grid for {m} must map parameter names to non-empty lists")
+        names = sorted(space)
+        combos = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+        cands = [(m, *config(m, combo)) for combo in combos]
+        try:
+            for _, ct, params in cands:
+                make_estimator(ct, params)
+        except TypeError as e:
+            raise ValueError(f"bad {m} grid: {e}") from None
+        per_method.append(cands)
+    return [c for group in itertools.zip_longest(*per_method) for c in group if c is not None]
+
+
+def _fits_folds(classifier_type: str, params: dict, min_train: int) -> bool:
+    """False for KNN candidates that ask for more neighbours than the smallest training fold has."""
+    return classifier_type != "KNN" or int(params.get("n_neighbors", 5)) <= min_train
+
+
+def _fit_fold(i: int, k: int, classifier_type: str, params: dict, X, y, train, test) -> tuple[int, int, dict]:
+    t0 = time.perf_counter()
+    try:
+        est = make_estimator(classifier_type, params)
+        est.fit(X[train], y[train])
+        fit_s = time.perf_counter() - t0
+        pred = est.predict(X[test])
+    except Exception as e:
+        return i, k, {"error": f"{type(e).__name__}: {e}", "fit_seconds": time.perf_counter() - t0}
+    return i, k, {
+        "accuracy": accuracy_score(y[test], pred),
+        "balanced_accuracy": balanced_accuracy_score(y[test], pred),
+        "f1_macro": f1_score(y[test], pred, average="macro", zero_division=0),
+        "fit_seconds": fit_s,
+    }
+
+
+def cross_validate(candidates, X: np.ndarray, y: np.ndarray, folds: int = 5, scoring: str = "f1_macro",
+                   time_budget: float | None = None, workers: int | None = None,
+                   on_fold: Callable[[int, int], None] | None = None) -> dict:
+    """
+    Stratified k-fold scores of every candidate, ranked by mean `scoring`.
+
+    `folds` is lowered to the smallest class size; every class needs at least
+    two samples. `on_fold(done, total)` is called as fits complete (jobs use it
+    for progress and cancellation).
+
+    KNN candidates with more neighbours than the smallest training fold are
+    skipped; candidates whose fits raise are listed after the ranked ones with
+    `error` set and no rank.
+
+    Returns:
+      {folds, scoring, leaderboard: [{rank, method, classifier_type, params, <score>_mean/_std...}],
+       evaluated, failed, skipped, incomplete, budget_exhausted, seconds}
+    """
+    if scoring not in SCORES:
+        raise ValueError(f"scoring must be one of: {', '.join(SCORES)}")
+    classes, counts = np.unique(y, return_counts=True)
+    if len(classes) < 2:
+        raise ValueError("Model selection needs samples of at least two classes.")
+    if counts.min() < 2:
+        raise ValueError(f"Every class needs at least 2 samples for cross-validation "
+                         f"({classes[counts.argmin()]!s} has {counts.min()}).")
+    folds = int(max(2, min(int(folds), counts.min())))
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=42).split(X, y))
+    min_train = min(len(train) for train, _ in splits)
+    n_candidates = len(candidates)
+    candidates = [c for c in candidates if _fits_folds(c[1], c[2], min_train)]
+    skipped = n_candidates - len(candidates)
+
+    t0 = time.monotonic()
+    deadline = t0 + time_budget if time_budget else None
+    total = len(candidates) * folds
+    results: dict[int, list[dict]] = {}
+    exhausted = False
+    tasks = (delayed(_fit_fold)(i, k, ct, params, X, y, train, test)
+             for i, (_, ct, params) in enumerate(candidates) for k, (train, test) in enumerate(splits))
+    # no single fit may outlast the budget either
+    gen = Parallel(n_jobs=workers or -1, return_as="generator_unordered",
+                   timeout=time_budget or None)(tasks)
+    done = 0
+    try:
+        for i, _, scores in gen:
+            results.setdefault(i, []).append(scores)
+            done += 1
+            if on_fold is not None:
+                on_fold(done, total)
+            if deadline is not None and time.monotonic() > deadline and done < total:
+                exhausted = True
+                break
+    except (TimeoutError, multiprocessing.TimeoutError):
+        # joblib's per-fit timeout raises multiprocessing.TimeoutError, not the builtin
+        exhausted = True
+    finally:
+        gen.close()
+
+    board, failed = [], []
+    for i, fold_scores in results.items():
+        if len(fold_scores) < folds:
+            continue
+        method, ct, params = candidates[i]
+        row = {"method": method, "classifier_type": ct, "params": params}
+        errors = [f["error"] for f in fold_scores if "error" in f]
+        if errors:
+            failed.append({**row, "rank": None, "error": errors[0]})
+            continue
+        for s in SCORES:
+            vals = np.array([f[s] for f in fold_scores])
+            row[f"{s}_mean"] = round(float(vals.mean()), 4)
+            row[f"{s}_std"] = round(float(vals.std()), 4)
+        row["fit_seconds"] = round(float(np.mean([f["fit_seconds"] for f in fold_scores])), 4)
+        board.append(row)
+    # best mean first; ties go to the lower spread, then the faster fit
+    board.sort(key=lambda r: (-r[f"{scoring}_mean"], r[f"{scoring}_std"], r["fit_seconds"]))
+    for rank, row in enumerate(board, 1):
+        row["rank"] = rank
+    return {"folds": folds, "scoring": scoring, "leaderboard": board + failed,
+            "evaluated": len(board), "failed": len(failed), "skipped": skipped,
+            "incomplete": len(candidates) - len(board) - len(failed),
+            "budget_exhausted": exhausted, "seconds": round(time.monotonic() - t0, 3)}
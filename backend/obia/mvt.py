@@ -0,0 +1,159 @@
+# backend/obia/mvt.py
+"""
+Minimal Mapbox Vector Tile (v2) encoder.
+
+Only what the vector tile endpoint needs: polygon features with scalar
+properties. Geometries must already be in tile pixel coordinates (0..extent,
+y pointing down) and rounded to integers. The protobuf wire format is written
+directly.
+"""
+from __future__ import annotations
+
+import math
+import struct
+
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
+
+_POLYGON = 3
+_MOVE_TO = 9       # command 1, count 1
+_CLOSE_PATH = 15   # command 7, count 1
+_DOUBLE = struct.Struct("<d")
+
+
+# ---- protobuf primitives
+def _varint(n: int) -> bytes:
+    if n < 0x80:
+        return bytes((n,))
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _varints(values) -> bytes:
+    """Packed varint encoding of non-negative ints."""
+    out = bytearray()
+    for n in values:
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _field(num: int, payload: bytes) -> bytes:
+    """Length-delimited field (wire type 2)."""
+    return _varint((num << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _uint_field(num: int, value: int) -> bytes:
+    return _varint(num << 3) + _varint(int(value))
+
+
+def _value(v) -> bytes | None:
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        return _uint_field(7, v)
+    if isinstance(v, int):
+        return _uint_field(6, _zigzag(v))
+    if isinstance(v, float):
+        if not math.isfinite(v):
+            return None
+        return b"\x19" + _DOUBLE.pack(v)   # field 3, wire type 1 (64-bit)
+    return _field(1, str(v).encode("utf-8"))
+
+
+# ---- geometry (plain Python: rings in a tile are short, numpy call overhead would dominate)
+def _ring_commands(pts: list, cursor: tuple, exterior: bool, out: list) -> tuple:
+    """Append the command stream of one closed ring to `out`; returns the new cursor."""
+    ring = [pts[0]]
+    for p in pts[1:-1]:
+        if p != ring[-1]:
+            ring.append(p)
+    if len(ring) > 1 and ring[-1] == ring[0]:
+        ring.pop()
+    if len(ring) < 3:
+        return cursor
+    area2 = 0
+    px, py = ring[-1]
+    for x, y in ring:
+        area2 += px * y - x * py
+        px, py = x, y
+    if area2 == 0:
+        return cursor
+    # exterior rings: positive area in tile coordinates (y down), interiors negative
+    if (area2 > 0) != exterior:
+        ring.reverse()
+    cx, cy = cursor
+    x, y = ring[0]
+    out += (_MOVE_TO, _zigzag(x - cx), _zigzag(y - cy), 2 | ((len(ring) - 1) << 3))
+    cx, cy = x, y
+    for x, y in ring[1:]:
+        out += (_zigzag(x - cx), _zigzag(y - cy))
+        cx, cy = x, y
+    out.append(_CLOSE_PATH)
+    return cx, cy
+
+
+def _polygon_commands(geom) -> list:
+    polys = geom.geoms if isinstance(geom, MultiPolygon) else [geom] if isinstance(geom, Polygon) else []
+    out: list[int] = []
+    cursor = (0, 0)
+    for poly in polys:
+        n = len(out)
+        cursor = _ring_commands(_int_coords(poly.exterior), cursor, True, out)
+        if len(out) == n:
+            continue    # exterior degenerated at this zoom: drop the whole part
+        for ring in poly.interiors:
+            cursor = _ring_commands(_int_coords(ring), cursor, False, out)
+    return out
+
+
+def _int_coords(ring) -> list:
+    return [tuple(p) for p in shapely.get_coordinates(ring).astype(np.int64).tolist()]
+
+
+# ---- layers / tile
+def encode_layer(name: str, geoms, properties: list[dict] | None = None, ids=None, extent: int = 4096) -> bytes:
+    """One MVT layer from polygons in tile coordinates and their property dicts."""
+    keys: dict[str, int] = {}
+    values: dict[bytes, int] = {}
+    features = []
+    for i, geom in enumerate(geoms):
+        cmd = _polygon_commands(geom)
+        if not cmd:
+            continue
+        tags = []
+        for k, v in (properties[i] if properties else {}).items():
+            enc = _value(v.item() if isinstance(v, np.generic) else v)
+            if enc is None:
+                continue
+            tags += [keys.setdefault(k, len(keys)), values.setdefault(enc, len(values))]
+        feat = b""
+        if ids is not None:
+            feat += _uint_field(1, max(0, int(ids[i])))
+        if tags:
+            feat += _field(2, _varints(tags))
+        feat += _uint_field(3, _POLYGON) + _field(4, _varints(cmd))
+        features.append(_field(2, feat))
+    if not features:
+        return b""
+    body = _uint_field(15, 2) + _field(1, name.encode("utf-8")) + b"".join(features)
+    body += b"".join(_field(3, k.encode("utf-8")) for k in keys)
+    body += b"".join(_field(4, v) for v in values)
+    body += _uint_field(5, extent)
+    return body
+
+
+def encode_tile(layers: list[bytes]) -> bytes:
+    """Concatenate encoded layers into a Tile message (empty layers are skipped)."""
+    return b"".join(_field(3, layer) for layer in layers if layer)
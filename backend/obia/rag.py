@@ -0,0 +1,201 @@
+# backend/obia/rag.py
+"""
+Region adjacency graph (RAG) of a segmentation, built from its label raster.
+
+Two segments are adjacent when their labels meet between 4-neighbouring
+pixels; the edge weight is the length of the shared boundary in pixels. The
+graph is computed in row strips right after segmentation and stored next to
+the layer as `<stem>.rag.npz`: a symmetric CSR matrix (indptr / indices /
+boundary) plus the segment_id and pixel count of each node.
+
+Merging happens on the graph, not on polygons. Edges between segments of the
+same class (and/or whose band means are within a threshold) are kept, their
+connected components become regions, and the label raster is relabeled
+through a lookup table and polygonized once.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from rasterio.features import shapes
+from rasterio.windows import Window
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class RegionGraph:
+    """
+    Parameters:
+        segment_ids (np.ndarray): label value of each node, ascending.
+        pixels (np.ndarray): pixel count of each node.
+        indptr, indices, boundary (np.ndarray): symmetric CSR adjacency; `boundary`
+            is the shared boundary length in pixels.
+    """
+
+    def __init__(self, segment_ids, pixels, indptr, indices, boundary):
+        self.segment_ids = np.asarray(segment_ids, dtype="int64")
+        self.pixels = np.asarray(pixels, dtype="int64")
+        self.indptr = np.asarray(indptr, dtype="int64")
+        self.indices = np.asarray(indices, dtype="int64")
+        self.boundary = np.asarray(boundary, dtype="int64")
+
+    @property
+    def n(self) -> int:
+        return int(self.segment_ids.size)
+
+    def matrix(self) -> csr_matrix:
+        return csr_matrix((self.boundary, self.indices, self.indptr), shape=(self.n, self.n))
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(i, j, boundary) of every edge once, i < j (node indices)."""
+        i = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        upper = i < self.indices
+        return i[upper], self.indices[upper], self.boundary[upper]
+
+    def node_index(self, segment_ids) -> np.ndarray:
+        """Node index of each segment_id (-1 for ids not in the graph)."""
+        ids = np.asarray(segment_ids, dtype="int64")
+        if self.n == 0:
+            return np.full(ids.shape, -1, dtype="int64")
+        pos = np.minimum(np.searchsorted(self.segment_ids, ids), self.n - 1)
+        return np.where(self.segment_ids[pos] == ids, pos, -1)
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp.npz")
+        np.savez_compressed(tmp, segment_ids=self.segment_ids, pixels=self.pixels,
+                            indptr=self.indptr, indices=self.indices, boundary=self.boundary)
+        tmp.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path) -> "RegionGraph":
+        with np.load(path) as z:
+            return cls(z["segment_ids"], z["pixels"], z["indptr"], z["indices"], z["boundary"])
+
+
+def _pair_keys(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Unordered label pairs of neighbouring pixels with different, non-zero labels, as lo << 32 | hi."""
+    d = (a != b) & (a > 0) & (b > 0)
+    a, b = a[d], b[d]
+    return (np.minimum(a, b) << 32) | np.maximum(a, b)
+
+
+def build_rag(labels_path, strip_rows: int = 1024) -> RegionGraph:
+    """Adjacency graph of a label raster (0 = no segment), read in row strips."""
+    keys, counts = [], []
+    pixels = np.zeros(1, dtype="int64")
+    with rasterio.open(labels_path) as ds:
+        h, w = ds.height, ds.width
+        last = None
+        for r0 in range(0, h, strip_rows):
+            lab = ds.read(1, window=Window(0, r0, w, min(strip_rows, h - r0))).astype("int64", copy=False)
+            c = np.bincount(lab.ravel())
+            if c.size > pixels.size:
+                pixels = np.pad(pixels, (0, c.size - pixels.size))
+            pixels[:c.size] += c
+            k = [_pair_keys(lab[:, :-1], lab[:, 1:]), _pair_keys(lab[:-1], lab[1:])]
+            if last is not None:
+                k.append(_pair_keys(last, lab[0]))
+            u, n = np.unique(np.concatenate(k), return_counts=True)
+            keys.append(u)
+            counts.append(n)
+            last = lab[-1].copy()
+
+    pixels[0] = 0
+    ids = np.flatnonzero(pixels)
+    u, inv = np.unique(np.concatenate(keys), return_inverse=True)
+    boundary = np.bincount(inv, weights=np.concatenate(counts)).astype("int64")
+    i = np.searchsorted(ids, u >> 32)
+    j = np.searchsorted(ids, u & 0xFFFFFFFF)
+    n = ids.size
+    m = coo_matrix((np.concatenate([boundary, boundary]), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                   shape=(n, n)).tocsr()
+    m.sort_indices()
+    return RegionGraph(ids, pixels[ids], m.indptr, m.indices, m.data)
+
+
+def merge_regions(graph: RegionGraph, classes=None, means=None, threshold: float | None = None) -> np.ndarray:
+    """
+    Region number (0..k-1) of every node.
+
+    Adjacent segments end up in one region when they have the same class (if
+    `classes`, one value per node; missing values never merge) and when the
+    Euclidean distance of their band means is at most `threshold` (if `means`,
+    shape (n, bands), and `threshold` are given).
+    """
+    i, j, _ = graph.edges()
+    keep = np.ones(i.size, dtype=bool)
+    if classes is not None:
+        codes, _ = pd.factorize(pd.Series(classes), use_na_sentinel=True)
+        keep &= (codes[i] >= 0) & (codes[i] == codes[j])
+    if means is not None and threshold is not None:
+        means = np.asarray(means, dtype="float64")
+        keep &= np.linalg.norm(means[i] - means[j], axis=1) <= float(threshold)
+    i, j = i[keep], j[keep]
+    adj = coo_matrix((np.ones(i.size, dtype="int8"), (i, j)), shape=(graph.n, graph.n))
+    _, region = connected_components(adj, directed=False)
+    return region
+
+
+def polygonize_lut(labels_path, lut: np.ndarray, strip_rows: int = 1024):
+    """
+    Polygons of the label raster mapped through `lut` (labels past its end map
+    to 0): (geometries, values) for every connected 4-neighbour area with a
+    non-zero value, in the label raster's CRS. The mapped raster is written in
+    row strips to a temporary GeoTIFF, which GDAL polygonizes block-wise, so the
+    label raster is never held in memory whole.
+    """
+    lut = np.asarray(lut, dtype="int32")
+    geoms, values = [], []
+    with rasterio.open(labels_path) as ds, tempfile.TemporaryDirectory(prefix="obia_lut_") as tmp:
+        h, w, transform = ds.height, ds.width, ds.transform
+        out_path = Path(tmp) / "lut.tif"
+        with rasterio.open(out_path, "w", driver="GTiff", width=w, height=h, count=1, dtype="int32",
+                           crs=ds.crs, transform=transform, compress="deflate") as out:
+            for r0 in range(0, h, strip_rows):
+                win = Window(0, r0, w, min(strip_rows, h - r0))
+                lab = ds.read(1, window=win)
+                inside = lab < lut.size
+                out.write(np.where(inside, lut[np.where(inside, lab, 0)], 0).astype("int32"), 1, window=win)
+        with rasterio.open(out_path) as mapped:
+            for geom, v in shapes(rasterio.band(mapped, 1), transform=transform, connectivity=4):
+                if v:
+                    geoms.append(shapely.geometry.shape(geom))
+                    values.append(int(v))
+    return np.asarray(geoms, dtype=object), np.asarray(values, dtype="int64")
+
+
+def polygonize_regions(labels_path, graph: RegionGraph, region: np.ndarray) -> gpd.GeoDataFrame:
+    """
+    Relabel the label raster by region (lookup table) and polygonize it once.
+    One row per region (MultiPolygon when a region has disjoint parts), in the
+    label raster's CRS, with `region_id`, `n_segments` and `area_pixels`.
+    """
+    with rasterio.open(labels_path) as ds:
+        crs = ds.crs
+    lut = np.zeros(int(graph.segment_ids.max(initial=0)) + 1, dtype="int32")
+    lut[graph.segment_ids] = region + 1
+    geoms, values = polygonize_lut(labels_path, lut)
+    values = values - 1
+
+    order = np.argsort(values, kind="stable")
+    geoms, values = geoms[order], values[order]
+    rid, start, nparts = np.unique(values, return_index=True, return_counts=True)
+    multi = shapely.multipolygons(geoms, indices=np.repeat(np.arange(rid.size), nparts))
+    out = np.where(nparts == 1, geoms[start], multi) if rid.size else multi
+
+    k = int(region.max()) + 1 if region.size else 0
+    n_segments = np.bincount(region, minlength=k)
+    area = np.bincount(region, weights=graph.pixels, minlength=k).astype("int64")
+    return gpd.GeoDataFrame(
+        {"region_id": rid, "n_segments": n_segments[rid], "area_pixels": area[rid]},
+        geometry=list(out), crs=crs,
+    )
@@ -0,0 +1,249 @@
+# backend/obia/rasterdb.py
+"""
+Indexed raster metadata store (SQLite, WAL mode).
+
+Replaces the whole-file uploads/_rasters.json: lookups by id and sha1 hit an
+index, writes are transactional (safe across threads and uvicorn workers),
+and each row carries the raster's size, band count, CRS and bounds so status
+calls don't have to reopen the file. Display statistics (see renderstats.py)
+live in their own table, so the per-tile record lookup stays small.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import rasterio
+from rasterio.warp import transform_bounds
+
+_COLUMNS = ("id", "name", "path", "sha1", "created", "width", "height", "count", "dtype",
+            "crs", "bounds", "bounds_wgs84", "extra")
+_JSON_COLUMNS = ("bounds", "bounds_wgs84", "extra")
+# rows a re-upload of the same bytes can dedup against (failed ingests are replaced instead)
+_USABLE = "COALESCE(json_extract(extra, '$.state'), 'done') != 'error'"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rasters (
+    id           TEXT PRIMARY KEY,
+    name         TEXT NOT NULL UNIQUE,
+    path         TEXT NOT NULL,
+    sha1         TEXT,
+    created      REAL,
+    width        INTEGER,
+    height       INTEGER,
+    count        INTEGER,
+    dtype        TEXT,
+    crs          TEXT,
+    bounds       TEXT,
+    bounds_wgs84 TEXT,
+    extra        TEXT
+);
+CREATE INDEX IF NOT EXISTS rasters_sha1 ON rasters (sha1);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS render_stats (id TEXT PRIMARY KEY, stats TEXT NOT NULL);
+"""
+
+
+def describe_raster(path) -> dict:
+    """Size, bands, CRS and bounds (native + EPSG:4326) of a raster file."""
+    with rasterio.open(path) as ds:
+        b = ds.bounds
+        wgs = None
+        if ds.crs:
+            try:
+                wgs = list(transform_bounds(ds.crs, "EPSG:4326", b.left, b.bottom, b.right, b.top, densify_pts=21))
+            except Exception:
+                wgs = None
+        return {
+            "width": ds.width,
+            "height": ds.height,
+            "count": ds.count,
+            "dtype": ds.dtypes[0],
+            "crs": ds.crs.to_string() if ds.crs else None,
+            "bounds": [b.left, b.bottom, b.right, b.top],
+            "bounds_wgs84": wgs,
+        }
+
+
+class RasterStore:
+    """
+    Parameters:
+        db_path (str | Path): SQLite file (created on first use).
+        legacy_json (str | Path | None): old _rasters.json to import once.
+    """
+
+    def __init__(self, db_path, legacy_json=None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        con = self._con()
+        con.executescript(_SCHEMA)
+        if legacy_json is not None:
+            self._import_legacy(Path(legacy_json))
+
+    # ---- connection per thread
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def _tx(self):
+        return _Tx(self._con())
+
+    @staticmethod
+    def _row(row) -> dict | None:
+        if row is None:
+            return None
+        d = dict(row)
+        for k in _JSON_COLUMNS:
+            if d.get(k) is not None:
+                d[k] = json.loads(d[k])
+        extra = d.pop("extra", None) or {}
+        return {**extra, **{k: v for k, v in d.items() if v is not None}}
+
+    @staticmethod
+    def _values(rec: dict) -> dict:
+        vals = {k: rec.get(k) for k in _COLUMNS if k != "extra"}
+        extra = {k: v for k, v in rec.items() if k not in _COLUMNS}
+        vals["extra"] = extra or None
+        for k in _JSON_COLUMNS:
+            if vals.get(k) is not None:
+                vals[k] = json.dumps(vals[k])
+        return vals
+
+    # ---- reads
+    def get(self, rid: str) -> dict | None:
+        return self._row(self._con().execute("SELECT * FROM rasters WHERE id = ?", (rid,)).fetchone())
+
+    def by_sha1(self, sha1: str) -> dict | None:
+        """A raster with these bytes that did not fail to ingest."""
+        return self._row(self._con().execute(
+            f"SELECT * FROM rasters WHERE sha1 = ? AND {_USABLE} LIMIT 1", (sha1,)).fetchone())
+
+    def list(self) -> list[dict]:
+        rows = self._con().execute("SELECT * FROM rasters ORDER BY created, rowid").fetchall()
+        return [self._row(r) for r in rows]
+
+    def get_stats(self, rid: str) -> dict | None:
+        row = self._con().execute("SELECT stats FROM render_stats WHERE id = ?", (rid,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    # ---- writes
+    def set_stats(self, rid: str, stats: dict) -> bool:
+        """Store the render stats of an existing raster; False if it is gone."""
+        with self._tx() as con:
+            cur = con.execute(
+                "INSERT OR REPLACE INTO render_stats (id, stats) SELECT id, ? FROM rasters WHERE id = ?",
+                (json.dumps(stats), rid),
+            )
+            return cur.rowcount > 0
+
+    def add(self, rid: str, filename: str, sha1: str, path_for, **fields) -> tuple[dict, bool]:
+        """
+        Atomically register an upload. Returns (record, created); if a raster with
+        the same sha1 already exists, that record is returned with created=False.
+        Records of the same sha1 whose ingest failed are deleted and replaced.
+        The display name gets " 1", " 2", ... appended on clashes, and `path_for(name)`
+        gives the file path to store for it.
+        """
+        with self._tx() as con:
+            if sha1:
+                row = con.execute(f"SELECT * FROM rasters WHERE sha1 = ? AND {_USABLE} LIMIT 1", (sha1,)).fetchone()
+                if row is not None:
+                    return self._row(row), False
+                failed = [r[0] for r in con.execute("SELECT id FROM rasters WHERE sha1 = ?", (sha1,))]
+                for fid in failed:
+                    con.execute("DELETE FROM rasters WHERE id = ?", (fid,))
+                    con.execute("DELETE FROM render_stats WHERE id = ?", (fid,))
+            base, ext = os.path.splitext(filename)
+            name, i = filename, 1
+            while con.execute("SELECT 1 FROM rasters WHERE name = ?", (name,)).fetchone():
+                name = f"{base} {i}{ext}"
+                i += 1
+            rec = {"id": rid, "name": name, "path": str(path_for(name)), "sha1": sha1,
+                   "created": time.time(), **fields}
+            vals = self._values(rec)
+            con.execute(f"INSERT INTO rasters ({', '.join(vals)}) VALUES ({', '.join('?' * len(vals))})",
+                        tuple(vals.values()))
+        return self.get(rid), True
+
+    def update(self, rid: str, **fields) -> dict | None:
+        with self._tx() as con:
+            row = con.execute("SELECT * FROM rasters WHERE id = ?", (rid,)).fetchone()
+            if row is None:
+                return None
+            vals = self._values({**self._row(row), **fields})
+            vals.pop("id")
+            con.execute(f"UPDATE rasters SET {', '.join(f'{k} = ?' for k in vals)} WHERE id = ?",
+                        (*vals.values(), rid))
+        return self.get(rid)
+
+    def delete(self, rid: str) -> dict | None:
+        with self._tx() as con:
+            row = con.execute("SELECT * FROM rasters WHERE id = ?", (rid,)).fetchone()
+            if row is not None:
+                con.execute("DELETE FROM rasters WHERE id = ?", (rid,))
+                con.execute("DELETE FROM render_stats WHERE id = ?", (rid,))
+        return self._row(row)
+
+    def delete_by_file_names(self, names) -> list[dict]:
+        """Drop records whose display name or file basename is in `names`."""
+        names = set(names)
+        removed = []
+        with self._tx() as con:
+            for row in con.execute("SELECT * FROM rasters").fetchall():
+                if row["name"] in names or os.path.basename(row["path"]) in names:
+                    con.execute("DELETE FROM rasters WHERE id = ?", (row["id"],))
+                    con.execute("DELETE FROM render_stats WHERE id = ?", (row["id"],))
+                    removed.append(self._row(row))
+        return removed
+
+    # ---- one-time import of uploads/_rasters.json
+    def _import_legacy(self, legacy: Path):
+        with self._tx() as con:
+            if con.execute("SELECT value FROM meta WHERE key = 'legacy_json_imported'").fetchone():
+                return
+            try:
+                items = json.loads(legacy.read_text(encoding="utf-8")).get("items", [])
+            except (OSError, ValueError):
+                items = []
+            for it in items:
+                if not it.get("id") or not it.get("path"):
+                    continue
+                meta = {}
+                if Path(it["path"]).exists():
+                    try:
+                        meta = describe_raster(it["path"])
+                    except Exception:
+                        meta = {}
+                vals = self._values({**it, "created": time.time(), **meta})
+                con.execute(
+                    f"INSERT OR IGNORE INTO rasters ({', '.join(vals)}) VALUES ({', '.join('?' * len(vals))})",
+                    tuple(vals.values()),
+                )
+            con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_imported', ?)",
+                        (str(time.time()),))
+
+
+class _Tx:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK: one writer at a time, across processes too."""
+
+    def __init__(self, con):
+        self.con = con
+
+    def __enter__(self):
+        self.con.execute("BEGIN IMMEDIATE")
+        return self.con
+
+    def __exit__(self, exc_type, exc, tb):
+        self.con.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
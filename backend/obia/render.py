@@ -0,0 +1,111 @@
+# backend/obia/render.py
+"""
+Tile render kernel: raw band data -> stretched RGBA -> encoded image.
+
+Integer bands of up to 16 bits are stretched through a per-band lookup table
+(cached per dtype / vmin / vmax), i.e. one gather per band straight into its
+output plane. Other dtypes are stretched in place on a single float32 buffer.
+No masked arrays and no per-step temporaries: the R, G, B, A planes are
+allocated once, contiguous, and handed to Pillow as separate bands.
+
+Tiles can be encoded as PNG (tunable zlib level), WebP or JPEG (no alpha).
+"""
+from __future__ import annotations
+
+import time
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+FORMATS = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg"}
+_LUT_DTYPES = {np.dtype(t) for t in ("uint8", "int8", "uint16", "int16")}
+
+
+class StageTimer:
+    """Wall time per named stage, in milliseconds."""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self._t = time.perf_counter()
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + (now - self._t) * 1000.0
+        self._t = now
+
+    def server_timing(self) -> str:
+        """Value for a `Server-Timing` response header."""
+        return ", ".join(f"{k};dur={v:.2f}" for k, v in self.stages.items())
+
+
+@lru_cache(maxsize=64)
+def band_lut(dtype: str, vmin: float, vmax: float) -> np.ndarray:
+    """uint8 lookup table over every value of an 8/16-bit integer dtype, indexed by value - dtype min."""
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1, dtype="float32")
+    if vmax == vmin:
+        return np.zeros(values.size, dtype="uint8")
+    values -= vmin
+    values *= 255.0 / (vmax - vmin)
+    np.clip(values, 0, 255, out=values)
+    return np.rint(values).astype("uint8")
+
+
+def _stretch_band(band: np.ndarray, vmin: float, vmax: float, out: np.ndarray, buf: np.ndarray | None):
+    if band.dtype in _LUT_DTYPES:
+        lut = band_lut(band.dtype.str, float(vmin), float(vmax))
+        idx = band if band.dtype.kind == "u" else band.astype("int32") - np.iinfo(band.dtype).min
+        np.take(lut, idx, out=out)
+        return
+    if vmax == vmin:
+        out[...] = 0
+        return
+    np.subtract(band, vmin, out=buf, dtype="float32", casting="unsafe")
+    buf *= 255.0 / (vmax - vmin)
+    np.nan_to_num(buf, copy=False, nan=0.0)
+    np.clip(buf, 0, 255, out=buf)
+    np.rint(buf, out=buf)
+    out[...] = buf
+
+
+def stretch_planes(data: np.ndarray, invalid: np.ndarray | None, vmins, vmaxs) -> np.ndarray:
+    """
+    (4, h, w) uint8 R, G, B, A planes of `data` (bands, h, w): band b stretched
+    over vmins[b]..vmaxs[b] (one band -> gray); invalid pixels are all zero.
+    """
+    n, h, w = data.shape
+    planes = np.empty((4, h, w), dtype="uint8")
+    buf = None if data.dtype in _LUT_DTYPES else np.empty((h, w), dtype="float32")
+    for b in range(min(n, 3)):
+        vmin = vmins[b if b < len(vmins) else -1]
+        vmax = vmaxs[b if b < len(vmaxs) else -1]
+        _stretch_band(data[b], vmin, vmax, planes[b], buf)
+    for b in range(n, 3):
+        planes[b] = planes[0] if n == 1 else 0
+    alpha = planes[3]
+    if invalid is None:
+        alpha[...] = 255
+    else:
+        # alpha is 0 or 255, so AND-ing it in zeroes the colour of invalid pixels
+        np.multiply(~invalid, 255, out=alpha, casting="unsafe")
+        np.bitwise_and(planes[:3], alpha, out=planes[:3])
+    return planes
+
+
+def encode_tile(planes: np.ndarray, fmt: str = "png", png_level: int = 6, quality: int = 80) -> bytes:
+    """Encode (4, h, w) RGBA planes. `png_level` is the zlib level (0-9); `quality` applies to WebP / JPEG."""
+    buf = BytesIO()
+    if fmt == "jpg":
+        # no alpha in JPEG: invalid pixels come out black
+        Image.merge("RGB", [Image.fromarray(p) for p in planes[:3]]).save(buf, format="JPEG", quality=int(quality))
+        return buf.getvalue()
+    im = Image.merge("RGBA", [Image.fromarray(p) for p in planes])
+    if fmt == "png":
+        im.save(buf, format="PNG", compress_level=int(png_level))
+    elif fmt == "webp":
+        im.save(buf, format="WEBP", quality=int(quality), method=4)
+    else:
+        raise ValueError(f"unknown tile format {fmt!r}")
+    return buf.getvalue()
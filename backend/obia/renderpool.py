@@ -0,0 +1,116 @@
+# backend/obia/renderpool.py
+"""
+Bounded executor for tile rendering.
+
+Tile renders are GDAL reads plus encoding; run in Starlette's shared
+threadpool, a burst of map pans can take every thread and starve the API.
+Here they get their own fixed set of threads (`max_workers` renders at once),
+so the rest of the API keeps its threadpool.
+
+Concurrent requests for the same key share one render: the first caller
+submits it, later ones wait on the same future. Every waiter holds a
+reference; when the last one leaves (client disconnected) a render that is
+still queued is cancelled before it reads anything. Renders already running
+finish and are simply not waited for.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RenderAbandoned(Exception):
+    """The client went away before its render finished."""
+
+
+class RenderPool:
+    """
+    Parameters:
+        max_workers (int): renders running at once.
+        disconnect_poll (float): seconds between client-disconnect checks while waiting.
+    """
+
+    def __init__(self, max_workers: int = 4, disconnect_poll: float = 0.1):
+        self.max_workers = max(1, int(max_workers))
+        self.disconnect_poll = float(disconnect_poll)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tile-render")
+        self._inflight: dict[str, list] = {}     # key -> [concurrent future, waiters]
+        self._lock = threading.RLock()   # future callbacks may run under it
+        self._running = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def _call(self, fn, args):
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _acquire(self, key: str, fn, args):
+        with self._lock:
+            ent = self._inflight.get(key)
+            if ent is not None and not ent[0].cancelled():
+                ent[1] += 1
+                self.coalesced += 1
+                return ent
+            fut = self._executor.submit(self._call, fn, args)
+            ent = self._inflight[key] = [fut, 1]
+            self.submitted += 1
+        fut.add_done_callback(lambda f, k=key, e=ent: self._forget(k, e))
+        return ent
+
+    def _forget(self, key: str, ent: list):
+        with self._lock:
+            if self._inflight.get(key) is ent:
+                del self._inflight[key]
+
+    def _release(self, key: str, ent: list, abandoned: bool):
+        with self._lock:
+            ent[1] -= 1
+            if abandoned and ent[1] == 0 and ent[0].cancel():
+                self.cancelled += 1
+
+    async def run(self, key: str, fn, *args, is_disconnected=None):
+        """
+        Result of `fn(*args)` rendered on the pool, shared with concurrent callers
+        of the same `key`. `is_disconnected` (async callable, e.g.
+        `request.is_disconnected`) is polled while waiting; on disconnect the
+        caller stops waiting and RenderAbandoned is raised.
+        """
+        ent = self._acquire(key, fn, args)
+        waiter = asyncio.wrap_future(ent[0])
+        # never cancel `waiter` itself: that would cancel the render shared with other callers
+        waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+        abandoned = True
+        try:
+            if is_disconnected is None:
+                await asyncio.shield(waiter)
+            else:
+                while not waiter.done():
+                    await asyncio.wait({waiter}, timeout=self.disconnect_poll)
+                    if not waiter.done() and await is_disconnected():
+                        raise RenderAbandoned(key)
+            abandoned = False
+            return waiter.result()
+        finally:
+            self._release(key, ent, abandoned)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": sum(1 for f, _ in self._inflight.values() if not f.running() and not f.done()),
+                "inflight": len(self._inflight),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+            }
@@ -0,0 +1,111 @@
+# backend/obia/renderstats.py
+"""
+Per-band statistics used to stretch raster tiles for display.
+
+They are computed once when a raster is ingested, from a read of at most
+`max_size` pixels on the long side (GDAL serves that from the overviews of a
+COG), and stored with the raster record. Each band keeps min / max / mean /
+std, a few exact percentiles and a histogram, so a stretch for other
+percentiles can be derived later without touching the raster again.
+"""
+from __future__ import annotations
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+STATS_VERSION = 1
+PERCENTILES = (0.5, 1, 2, 5, 95, 98, 99, 99.5)
+DEFAULT_STRETCH = (2.0, 98.0)
+
+
+def _pkey(p: float) -> str:
+    return f"{float(p):g}"
+
+
+def _band_stats(vals: np.ndarray, integer: bool, bins: int) -> dict:
+    if vals.size == 0:
+        return {"valid": 0}
+    lo, hi = float(vals.min()), float(vals.max())
+    if integer and hi - lo + 1 <= bins:
+        # one bin per integer value: percentiles from the histogram are exact
+        edges_hi, nbins = hi + 1, int(hi - lo + 1)
+    else:
+        edges_hi, nbins = (hi if hi > lo else lo + 1), bins
+    counts, _ = np.histogram(vals, bins=nbins, range=(lo, edges_hi))
+    pct = np.percentile(vals, PERCENTILES)
+    return {
+        "valid": int(vals.size),
+        "min": lo,
+        "max": hi,
+        "mean": float(vals.mean(dtype="float64")),
+        "std": float(vals.std(dtype="float64")),
+        "percentiles": {_pkey(p): float(v) for p, v in zip(PERCENTILES, pct)},
+        "histogram": {"min": lo, "max": float(edges_hi), "counts": counts.astype("int64").tolist()},
+    }
+
+
+def compute_render_stats(path, max_size: int = 1024, bins: int = 256) -> dict:
+    """Stats of every band of `path`, from a nearest-neighbour read of at most `max_size` px."""
+    with rasterio.open(path) as ds:
+        scale = max(ds.width, ds.height) / max_size if max(ds.width, ds.height) > max_size else 1.0
+        out_h = max(1, int(ds.height / scale))
+        out_w = max(1, int(ds.width / scale))
+        integer = np.issubdtype(np.dtype(ds.dtypes[0]), np.integer)
+        invalid = np.zeros((out_h, out_w), dtype=bool)
+        bands = []
+        for b in range(1, ds.count + 1):
+            arr = ds.read(b, out_shape=(out_h, out_w), resampling=Resampling.nearest, masked=True)
+            mask = np.ma.getmaskarray(arr)
+            if np.issubdtype(arr.dtype, np.floating):
+                mask |= ~np.isfinite(arr.data)
+            invalid |= mask
+            bands.append({"band": b, **_band_stats(arr.data[~mask], integer, bins)})
+    return {
+        "version": STATS_VERSION,
+        "sample": [out_h, out_w],
+        "nodata_fraction": float(invalid.mean()),
+        "bands": bands,
+    }
+
+
+def _hist_percentile(hist: dict, p: float) -> float:
+    """Percentile `p` interpolated linearly inside the histogram bin it falls in."""
+    counts = np.asarray(hist["counts"], dtype="float64")
+    cum = np.cumsum(counts)
+    target = p / 100.0 * cum[-1]
+    i = int(np.searchsorted(cum, target, side="left"))
+    i = min(i, counts.size - 1)
+    width = (hist["max"] - hist["min"]) / counts.size
+    before = cum[i] - counts[i]
+    frac = (target - before) / counts[i] if counts[i] > 0 else 0.0
+    return float(hist["min"] + (i + frac) * width)
+
+
+def band_percentile(band: dict, p: float) -> float:
+    """Stored percentile if it was computed exactly, else read off the histogram."""
+    exact = band.get("percentiles", {}).get(_pkey(p))
+    if exact is not None:
+        return float(exact)
+    if p <= 0:
+        return float(band["min"])
+    if p >= 100:
+        return float(band["max"])
+    return _hist_percentile(band["histogram"], p)
+
+
+def stretch(stats: dict, bands, pmin: float | None = None, pmax: float | None = None) -> tuple[list, list]:
+    """(vmins, vmaxs) of `bands` (1-based) for a pmin..pmax percentile stretch."""
+    pmin = DEFAULT_STRETCH[0] if pmin is None else float(pmin)
+    pmax = DEFAULT_STRETCH[1] if pmax is None else float(pmax)
+    vmins, vmaxs = [], []
+    for b in bands:
+        band = stats["bands"][b - 1]
+        if not band.get("valid"):
+            vmins.append(0.0); vmaxs.append(1.0)
+            continue
+        vmin, vmax = band_percentile(band, pmin), band_percentile(band, pmax)
+        if vmax <= vmin:
+            vmax = vmin + 1.0
+        vmins.append(vmin); vmaxs.append(vmax)
+    return vmins, vmaxs
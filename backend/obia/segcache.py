@@ -0,0 +1,148 @@
+# backend/obia/segcache.py
+"""
+Content-addressed cache of segmentation results.
+
+A segment layer is identified by the sha1 of the source raster plus every
+parameter that changes the output (scale, compactness, working resolution,
+block settings). The index is a small JSON file mapping that key to the
+layer's file in results/segments; the store is bounded by total bytes (the
+layer plus its sidecars) and entry count, evicting the least recently used
+layers first. Hit statistics are kept in memory and persisted with the next
+index write (put, eviction, forget_file or flush), not on every lookup.
+"""
+from __future__ import annotations
+
+import glob
+import json
+import threading
+import time
+from pathlib import Path
+
+from .features import segment_sidecars
+from .tilecache import tile_key
+
+
+def segment_key(sha1: str, **params) -> str:
+    """Cache key for a raster hash + segmentation parameters (order-independent)."""
+    norm = {k: (float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v)
+            for k, v in sorted(params.items())}
+    return tile_key("segment", sha1, norm)
+
+
+class SegmentCache:
+    """
+    Parameters:
+        index_path (str | Path): JSON index file.
+        segments_dir (str | Path): where the cached layers live.
+        max_bytes (int): total size budget of cached layers.
+        max_entries (int): maximum number of cached layers.
+        is_protected (callable): stem -> bool; protected layers (e.g. with samples)
+            are dropped from the index on eviction but their files are kept.
+    """
+
+    def __init__(self, index_path, segments_dir, max_bytes: int, max_entries: int, is_protected=None):
+        self.index_path = Path(index_path)
+        self.segments_dir = Path(segments_dir)
+        self.max_bytes = int(max_bytes)
+        self.max_entries = int(max_entries)
+        self.is_protected = is_protected or (lambda stem: False)
+        self._lock = threading.Lock()
+        self._db = self._read()
+        self._dirty = False
+
+    def _read(self) -> dict:
+        try:
+            db = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            db = {}
+        db.setdefault("entries", {})
+        db.setdefault("hits", 0)
+        db.setdefault("misses", 0)
+        return db
+
+    def _write(self):
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._db, indent=2), encoding="utf-8")
+        tmp.replace(self.index_path)
+        self._dirty = False
+
+    def _size(self, file_name: str) -> int:
+        """Bytes of a layer and its sidecars (labels raster, RAG, feature table)."""
+        p = self.segments_dir / file_name
+        return sum(f.stat().st_size for f in [p, *segment_sidecars(p)] if f.exists())
+
+    def lookup(self, key: str) -> dict | None:
+        """Entry for `key` if its layer still exists (counts a hit or a miss)."""
+        with self._lock:
+            ent = self._db["entries"].get(key)
+            if ent is not None and not (self.segments_dir / ent["file"]).exists():
+                self._db["entries"].pop(key, None)
+                ent = None
+            if ent is None:
+                self._db["misses"] += 1
+            else:
+                self._db["hits"] += 1
+                ent["last_hit"] = time.time()
+                ent["hit_count"] = ent.get("hit_count", 0) + 1
+            self._dirty = True
+            return dict(ent) if ent else None
+
+    def flush(self):
+        """Persist hit statistics gathered since the last index write."""
+        with self._lock:
+            if self._dirty:
+                self._write()
+
+    def put(self, key: str, file_name: str, params: dict | None = None):
+        with self._lock:
+            now = time.time()
+            self._db["entries"][key] = {
+                "file": file_name,
+                "bytes": self._size(file_name),
+                "created": now,
+                "last_hit": now,
+                "hit_count": 0,
+                "params": params or {},
+            }
+            self._evict(keep=key)
+            self._write()
+
+    def forget_file(self, file_name: str):
+        """Drop index entries pointing at a layer that was deleted elsewhere."""
+        with self._lock:
+            ents = self._db["entries"]
+            for k in [k for k, e in ents.items() if e["file"] == file_name]:
+                ents.pop(k)
+            self._write()
+
+    def _evict(self, keep: str):
+        ents = self._db["entries"]
+        # sidecars can be added after put (e.g. features computed on demand)
+        for e in ents.values():
+            e["bytes"] = self._size(e["file"])
+        total = sum(e["bytes"] for e in ents.values())
+        for k in sorted(ents, key=lambda k: ents[k]["last_hit"]):
+            if total <= self.max_bytes and len(ents) <= self.max_entries:
+                break
+            if k == keep:
+                continue
+            e = ents.pop(k)
+            total -= e["bytes"]
+            stem = Path(e["file"]).stem
+            if not self.is_protected(stem):
+                # the layer plus its sidecars (<stem>.labels.tif, <stem>.features.parquet, ...)
+                (self.segments_dir / e["file"]).unlink(missing_ok=True)
+                for side in self.segments_dir.glob(f"{glob.escape(stem)}.*"):
+                    side.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            ents = self._db["entries"]
+            return {
+                "entries": len(ents),
+                "bytes": sum(e["bytes"] for e in ents.values()),
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self._db["hits"],
+                "misses": self._db["misses"],
+            }
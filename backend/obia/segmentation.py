@@ -4,21 +4,109 @@ from pathlib import Path
 import json
 from copy import deepcopy
 
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from skimage import segmentation
 from nickyspatial import read_raster, LayerManager, SlicSegmentation, layer_to_vector
+from .windowed_segmentation import run_windowed_slic_segmentation
+from .tracing import span
+
+def read_raster_at(raster_path: str, downscale: float = 1.0):
+    """
+    Like nickyspatial's read_raster, but at 1/downscale of the native resolution.
+    Decimated reads are served from the file's internal overviews when present,
+    so the original on disk is never touched.
+    """
+    with span("raster_read") as sp:
+        if not downscale or downscale <= 1:
+            image_data, transform, crs = read_raster(raster_path)
+        else:
+            with rasterio.open(raster_path) as src:
+                out_h = max(1, int(src.height / downscale))
+                out_w = max(1, int(src.width / downscale))
+                image_data = src.read(out_shape=(src.count, out_h, out_w), resampling=Resampling.average)
+                transform = src.transform * src.transform.scale(src.width / out_w, src.height / out_h)
+                crs = src.crs
+        sp.set(pixels=int(image_data.shape[1] * image_data.shape[2]))
+    return image_data, transform, crs
 
-def run_slic_segmentation(raster_path: str, scale: float, compactness: float, layer_name="Solar_OBIA_Segments"):
-    image_array, transform, crs = read_raster(raster_path)
+def run_slic_segmentation(raster_path: str, scale: float, compactness: float, layer_name="Solar_OBIA_Segments",
+                          downscale: float = 1.0, block_size: int | None = None, overlap: int = 64,
+                          workers: int | None = None, labels_path: str | None = None):
+    """
+    SLIC segmentation of a raster file. With `block_size` set, the raster is
+    processed in overlapping windows (see windowed_segmentation.py) instead of
+    being loaded into memory as one array. With `labels_path` set, the label
+    raster (values = segment_id) is kept there as a GeoTIFF.
+    """
+    if block_size:
+        return run_windowed_slic_segmentation(
+            raster_path, scale, compactness, layer_name=layer_name, downscale=downscale,
+            block_size=block_size, overlap=overlap, workers=workers, labels_path=labels_path,
+        )
+    image_array, transform, crs = read_raster_at(raster_path, downscale)
     manager = LayerManager()
     segmenter = SlicSegmentation(scale=scale, compactness=compactness)
-    seg_layer = segmenter.execute(
-        image_array,
-        transform,
-        crs,
-        layer_manager=manager,
-        layer_name=layer_name,
-    )
+    # SLIC, polygons and per-segment statistics in one call
+    with span("slic", pixels=int(image_array.shape[1] * image_array.shape[2])) as sp:
+        seg_layer = segmenter.execute(
+            image_array,
+            transform,
+            crs,
+            layer_manager=manager,
+            layer_name=layer_name,
+        )
+        sp.set(polygons=int(len(seg_layer.objects)))
+    if labels_path:
+        with span("write_labels"):
+            save_labels(seg_layer, labels_path)
     return seg_layer
 
+def write_labels(labels, crs, transform, out_path: str | Path) -> str:
+    """Write a label array as a tiled int32 GeoTIFF (0 = no segment)."""
+    profile = {
+        "driver": "GTiff", "width": labels.shape[1], "height": labels.shape[0], "count": 1, "dtype": "int32",
+        "crs": crs, "transform": transform, "nodata": 0,
+        "tiled": True, "blockxsize": 512, "blockysize": 512, "compress": "deflate",
+    }
+    with rasterio.open(out_path, "w", **profile) as dst:
+        dst.write(labels.astype("int32", copy=False), 1)
+    return str(out_path)
+
+def save_labels(seg_layer, out_path: str | Path):
+    """Write an in-memory segmentation's label array as a tiled int32 GeoTIFF."""
+    write_labels(seg_layer.raster, seg_layer.crs, seg_layer.transform, out_path)
+    seg_layer.metadata["labels_path"] = str(out_path)
+    return str(out_path)
+
+def slic_labels(raster_path: str, scale: float, compactness: float, labels_path: str | Path,
+                downscale: float = 1.0) -> str:
+    """
+    The label raster of run_slic_segmentation (same normalisation and SLIC
+    parameters as SlicSegmentation) without building segment polygons or
+    per-segment statistics; for pipelines that stay in the raster domain.
+    """
+    image_array, transform, crs = read_raster_at(raster_path, downscale)
+    bands, height, width = image_array.shape
+    img = np.zeros((height, width, bands), dtype="float64")
+    for b in range(bands):
+        band = image_array[b]
+        lo, hi = band.min(), band.max()
+        if hi > lo:
+            img[..., b] = (band - lo) / (hi - lo)
+    del image_array
+    with warnings.catch_warnings(), span("slic", pixels=int(width * height)):
+        warnings.simplefilter("ignore")
+        labels = segmentation.slic(
+            img, n_segments=int(width * height / (scale * scale)), compactness=compactness,
+            sigma=1.0, start_label=1, channel_axis=-1,
+        )
+    with span("write_labels"):
+        return write_labels(labels, crs, transform, labels_path)
+
 def layer_to_geojson(seg_layer):
     gdf = seg_layer.objects.to_crs(epsg=4326)
     return json.loads(gdf.to_json())
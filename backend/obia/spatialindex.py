@@ -0,0 +1,185 @@
+# backend/obia/spatialindex.py
+"""
+Point / bbox / polygon queries against stored result layers.
+
+Each queried layer is loaded once, in its stored CRS (EPSG:4326 for results),
+and indexed with an STRtree; a bounded LRU keeps the most recently queried
+layers. A click on the map is then answered with the segment under it (id and
+attributes) without the client ever holding the layer's GeoJSON, which is what
+lets samples be picked on layers far too large to ship to the browser.
+
+Query geometries are always lon/lat (EPSG:4326) and are projected to the
+layer's CRS when it differs.
+"""
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+from .storage import read_layer
+from .tracing import span
+
+MAX_FEATURES = 5000                  # hard cap on features returned by one query
+PREDICATES = ("intersects", "within", "centroid")
+
+
+def as_geometry(obj):
+    """A GeoJSON geometry (dict or text) as a shapely geometry; ValueError when it isn't one."""
+    if isinstance(obj, shapely.Geometry):
+        return obj
+    try:
+        geom = shapely.from_geojson(obj if isinstance(obj, str) else json.dumps(obj))
+    except (shapely.errors.GEOSException, TypeError) as e:
+        raise ValueError(f"invalid GeoJSON geometry: {e}") from None
+    if geom is None or geom.is_empty:
+        raise ValueError("empty geometry")
+    return geom
+
+
+class LayerIndex:
+    """One stored layer with an STRtree over its geometries."""
+
+    def __init__(self, path):
+        with span("index_build") as sp:
+            gdf = read_layer(path)
+            self.geoms = np.asarray(gdf.geometry.values, dtype=object)
+            self.attrs = gdf.drop(columns=gdf.geometry.name)
+            self.ids = (gdf["segment_id"].to_numpy() if "segment_id" in gdf.columns
+                        else np.arange(len(gdf)))
+            self.tree = shapely.STRtree(self.geoms)
+            self._to_layer = None
+            if gdf.crs is not None and not CRS.from_user_input(gdf.crs).equals(CRS.from_epsg(4326)):
+                tr = Transformer.from_crs(4326, gdf.crs, always_xy=True)
+                self._to_layer = lambda c: np.column_stack(tr.transform(c[:, 0], c[:, 1]))
+            sp.set(polygons=int(len(self.geoms)))
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def _project(self, geom):
+        return geom if self._to_layer is None else shapely.transform(geom, self._to_layer)
+
+    def point(self, lon: float, lat: float) -> np.ndarray:
+        """Rows whose geometry contains (or touches) the point, smallest first."""
+        idx = self.tree.query(self._project(shapely.Point(lon, lat)), predicate="intersects")
+        if idx.size > 1:
+            idx = idx[np.argsort(shapely.area(self.geoms[idx]), kind="stable")]
+        return idx
+
+    def bbox(self, minx: float, miny: float, maxx: float, maxy: float, predicate: str = "intersects") -> np.ndarray:
+        return self.geometry(shapely.box(minx, miny, maxx, maxy), predicate)
+
+    def geometry(self, geom, predicate: str = "intersects") -> np.ndarray:
+        """
+        Rows selected by a query geometry: `intersects` it, lie `within` it, or
+        have their `centroid` (a point on the surface) inside it.
+        """
+        if predicate not in PREDICATES:
+            raise ValueError(f"predicate must be one of {', '.join(PREDICATES)}")
+        geom = self._project(as_geometry(geom))
+        shapely.prepare(geom)
+        if predicate == "intersects":
+            idx = self.tree.query(geom, predicate="intersects")
+        elif predicate == "within":
+            idx = self.tree.query(geom, predicate="contains")
+        else:
+            idx = self.tree.query(geom)
+            idx = idx[shapely.contains(geom, shapely.point_on_surface(self.geoms[idx]))]
+        return np.sort(idx)
+
+    def pick(self, points: dict, geometries: dict) -> tuple[dict, int]:
+        """
+        {class: [ids]} for clicked points ({class: [[lon, lat], ...]}, the smallest
+        feature under each) and drawn GeoJSON geometries ({class: [geometry, ...]},
+        features whose centroid falls inside), plus the number of points that hit nothing.
+        """
+        found, missed = {}, 0
+        for cls, pts in points.items():
+            for lon, lat in pts:
+                idx = self.point(float(lon), float(lat))
+                if idx.size:
+                    found.setdefault(cls, []).append(self.ids[idx[0]].item())
+                else:
+                    missed += 1
+        for cls, geoms in geometries.items():
+            for g in geoms:
+                found.setdefault(cls, []).extend(self.ids[self.geometry(g, "centroid")].tolist())
+        return found, missed
+
+    def features(self, idx: np.ndarray, columns: list[str] | None = None, geometry: bool = False) -> list[dict]:
+        """{id, properties[, geometry]} for the given rows; NaN attributes become null."""
+        attrs = self.attrs
+        if columns is not None:
+            attrs = attrs[[c for c in columns if c in attrs.columns]]
+        rows = attrs.iloc[idx]
+        rows = rows.astype(object).where(rows.notna(), None).to_dict("records")
+        out = [{"id": i, "properties": p} for i, p in zip(self.ids[idx].tolist(), rows)]
+        if geometry:
+            for f, g in zip(out, shapely.to_geojson(self.geoms[idx])):
+                f["geometry"] = json.loads(g) if g is not None else None
+        return out
+
+
+class LayerIndexCache:
+    """
+    Bounded LRU of LayerIndexes, keyed by file path and rebuilt when the file changes.
+    Concurrent first queries of one layer share a single build.
+
+    Parameters:
+        max_layers (int): number of indexed layers kept in memory.
+    """
+
+    def __init__(self, max_layers: int = 8):
+        self.max_layers = max(1, int(max_layers))
+        self._layers: OrderedDict[str, tuple] = OrderedDict()
+        self._building: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _cached(self, key: str, stamp: int) -> LayerIndex | None:
+        with self._lock:
+            ent = self._layers.get(key)
+            if ent is not None and ent[0] == stamp:
+                self._layers.move_to_end(key)
+                self.hits += 1
+                return ent[1]
+        return None
+
+    def get(self, path) -> LayerIndex:
+        path = Path(path)
+        stamp = path.stat().st_mtime_ns
+        key = str(path)
+        index = self._cached(key, stamp)
+        if index is not None:
+            return index
+        with self._lock:
+            build = self._building.setdefault(key, threading.Lock())
+        with build:
+            index = self._cached(key, stamp)
+            if index is not None:
+                return index
+            index = LayerIndex(path)
+            with self._lock:
+                self.misses += 1
+                self._layers[key] = (stamp, index)
+                self._layers.move_to_end(key)
+                while len(self._layers) > self.max_layers:
+                    self._layers.popitem(last=False)
+                self._building.pop(key, None)
+        return index
+
+    def invalidate(self, path):
+        with self._lock:
+            self._layers.pop(str(Path(path)), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"layers": len(self._layers), "max_layers": self.max_layers,
+                    "features": sum(len(ent[1]) for ent in self._layers.values()),
+                    "hits": self.hits, "misses": self.misses}
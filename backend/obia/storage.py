@@ -0,0 +1,75 @@
+# backend/obia/storage.py
+"""
+On-disk format of vector results (segments, classifications, merged layers).
+
+Layers are stored as GeoParquet (`<stem>.parquet`, EPSG:4326 like the GeoJSON
+they replace): binary, columnar and compressed, so the pipeline reads and
+writes them without a text parse/serialize cycle. GeoJSON is only produced on
+export, i.e. when a client asks for `<stem>.geojson` (see app.py). Layers
+written as `.geojson` by older versions are still found and read.
+
+Sidecar files of a layer share its stem with an extra suffix
+(`<stem>.labels.tif`, `<stem>.features.parquet`) and are not layers.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import geopandas as gpd
+
+LAYER_EXT = ".parquet"
+LEGACY_EXT = ".geojson"
+_SIDECAR_SUFFIXES = (".features.parquet",)
+
+
+def is_layer_file(p: Path) -> bool:
+    if p.suffix not in (LAYER_EXT, LEGACY_EXT) or not p.is_file():
+        return False
+    return not any(p.name.endswith(s) for s in _SIDECAR_SUFFIXES)
+
+
+def layer_path(directory, stem: str) -> Path | None:
+    """Stored file of layer `stem` in `directory` (GeoParquet first, then legacy GeoJSON)."""
+    stem = os.path.basename(stem)
+    for ext in (LAYER_EXT, LEGACY_EXT):
+        if stem.endswith(ext):
+            stem = stem[: -len(ext)]
+    for ext in (LAYER_EXT, LEGACY_EXT):
+        p = Path(directory) / f"{stem}{ext}"
+        if is_layer_file(p):
+            return p
+    return None
+
+
+def iter_layers(directory, pattern: str = "*") -> list[Path]:
+    """Layer files in `directory` matching `pattern` (a stem glob), one per stem, sorted by stem."""
+    found: dict[str, Path] = {}
+    for ext in (LEGACY_EXT, LAYER_EXT):   # GeoParquet wins when both exist
+        for p in Path(directory).glob(f"{pattern}{ext}"):
+            if is_layer_file(p):
+                found[p.stem] = p
+    return [found[k] for k in sorted(found)]
+
+
+def read_layer(path) -> gpd.GeoDataFrame:
+    path = Path(path)
+    if path.suffix == LAYER_EXT:
+        return gpd.read_parquet(path)
+    return gpd.read_file(path)
+
+
+def write_layer(gdf: gpd.GeoDataFrame, path) -> Path:
+    """Write a layer as GeoParquet (atomically: readers never see a partial file)."""
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    gdf.to_parquet(tmp, compression="zstd", index=False)
+    tmp.replace(path)
+    return path
+
+
+def geojson_bytes(path) -> bytes:
+    path = Path(path)
+    if path.suffix == LEGACY_EXT:
+        return path.read_bytes()
+    return read_layer(path).to_json().encode("utf-8")
@@ -0,0 +1,454 @@
+# backend/obia/tasks.py
+"""
+Pipeline steps run by the job queue (see jobs.py).
+
+Everything here executes in a worker process, so the functions only take
+plain, picklable arguments (paths, numbers, strings) and return JSON-ready
+dicts for the API response: ids and URLs, never the layer geometry itself.
+Steps are timed as trace spans (tracing.py), which end up in /metrics.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from nickyspatial.core.layer import Layer
+
+from .jobs import progress
+from .cog import write_cog
+from .downsample import downsample_raster
+from .rasterdb import RasterStore, describe_raster
+from .renderstats import compute_render_stats
+from .segmentation import run_slic_segmentation, slic_labels
+from .storage import LAYER_EXT, LEGACY_EXT, read_layer, write_layer
+from .features import (FEATURE_GROUPS, extract_features, write_features, feature_groups, parse_groups, read_features,
+                       groups_for_columns,
+                       labels_path_for, features_path_for, rag_path_for, segment_sidecars, tag_labels_source,
+                       labels_source)
+from .rag import RegionGraph, build_rag, merge_regions, polygonize_regions
+from .classification import (classify as run_classification, predict as run_prediction, classify_table,
+                             predict_table, select_model)
+from .classmap import polygonize_classes
+from .models import ModelRegistry
+from .mergeCleanPolygons import merge_clean_polygons
+from .tracing import span
+
+logger = logging.getLogger("obia")
+
+
+def _claim_unique(directory: Path, stem: str, ext: str) -> tuple[Path, Path]:
+    """
+    Reserve `<stem><ext>` (or `<stem>_1<ext>`, ...) so concurrent jobs never share a name:
+    (layer path, reservation). The reservation is `<layer path>.tmp`, created exclusively
+    and ignored by the catalog; write the layer into it and move it onto the layer path.
+    Stems of existing or legacy GeoJSON layers count as taken.
+    """
+    i = 0
+    while True:
+        candidate = directory / (f"{stem}{ext}" if i == 0 else f"{stem}_{i}{ext}")
+        i += 1
+        claim = candidate.with_name(candidate.name + ".tmp")
+        try:
+            with claim.open("x", encoding="utf-8"):
+                pass
+        except FileExistsError:
+            continue
+        # checked after the claim exists: a job finishing this name moved its claim away first
+        if candidate.exists() or candidate.with_name(candidate.stem + LEGACY_EXT).exists():
+            claim.unlink(missing_ok=True)
+            continue
+        return candidate, claim
+
+
+def segment_task(raster_path: str, stem: str, scale: float, compactness: float, downscale: float,
+                 segments_dir: str, url_prefix: str, block_size: int | None = None, overlap: int = 64,
+                 workers: int | None = None, features=()) -> dict:
+    """
+    SLIC-segment a raster and save the layer as `<segments_dir>/<stem>[_n].parquet`,
+    with its label raster and adjacency graph (see rag.py) alongside; `features`
+    (groups, see features.py) are extracted into `<stem>[_n].features.parquet` when given.
+    """
+    out, claim = _claim_unique(Path(segments_dir), stem, LAYER_EXT)
+    labels = labels_path_for(out)
+    try:
+        progress(0.05, "segment")
+        seg = run_slic_segmentation(raster_path, scale=scale, compactness=compactness, downscale=downscale,
+                                    block_size=block_size, overlap=overlap, workers=workers,
+                                    labels_path=str(labels))
+        tag_labels_source(labels, raster_path)
+        progress(0.55, "graph")
+        with span("graph"):
+            build_rag(labels).save(rag_path_for(out))
+        progress(0.6, "write")
+        gdf = _to_wgs84(seg.objects)
+        _write(gdf, claim).replace(out)
+        feats = features_task(out.stem, segments_dir, url_prefix, features) if parse_groups(features) else None
+    except BaseException:
+        for p in (claim, out, *segment_sidecars(out)):
+            p.unlink(missing_ok=True)
+        raise
+    return {
+        "id": out.stem,
+        "file": out.name,
+        "geojson_url": f"{url_prefix}/{out.stem}{LEGACY_EXT}",
+        "downscale": downscale,
+        "block_size": block_size or None,
+        "features_url": feats["features_url"] if feats else None,
+        "feature_groups": feats["groups"] if feats else [],
+    }
+
+
+def _to_wgs84(gdf):
+    with span("to_crs", polygons=int(len(gdf))):
+        return gdf.to_crs(epsg=4326)
+
+
+def _write(gdf, path: Path) -> Path:
+    with span("serialize", polygons=int(len(gdf))):
+        return write_layer(gdf, path)
+
+
+def features_task(segment_id: str, segments_dir: str, url_prefix: str, features=None) -> dict:
+    """(Re)compute the feature table of a segment layer from its label raster."""
+    groups = parse_groups(features)
+    layer = Path(segments_dir) / f"{segment_id}{LAYER_EXT}"
+    labels = labels_path_for(layer)
+    if not labels.exists():
+        raise FileNotFoundError(f"No label raster for segment {segment_id}; segment the raster again")
+    raster_path = labels_source(labels)
+    if not raster_path or not Path(raster_path).exists():
+        raise FileNotFoundError(f"Source raster of segment {segment_id} no longer exists")
+
+    progress(0.8, "features")
+    with span("features") as sp:
+        table, by_group = extract_features(raster_path, labels, groups=groups)
+        sp.set(segments=int(len(table)))
+
+    # keep groups computed earlier that were not asked for this time
+    out = features_path_for(layer)
+    if out.exists():
+        kept = {g: c for g, c in feature_groups(out).items() if g not in by_group}
+        if kept:
+            old = pd.read_parquet(out, columns=["segment_id", *(c for cols in kept.values() for c in cols)])
+            table = table.merge(old, on="segment_id", how="left")
+            by_group = {g: ({**kept, **by_group})[g] for g in FEATURE_GROUPS if g in kept or g in by_group}
+    write_features(table, by_group, out, source=raster_path)
+    return {
+        "id": segment_id,
+        "features_url": f"{url_prefix}/{out.name}",
+        "groups": list(by_group),
+        "columns": sum(len(c) for c in by_group.values()),
+        "segments": int(len(table)),
+    }
+
+
+def _publish_classified(res: dict, segment_id: str, classify_dir: str, url_prefix: str) -> dict:
+    """Move classification.py's temp output to `<classify_dir>/classify_<base>.parquet`."""
+    # final name: replace leading 'segment_' with 'classify_'
+    base = segment_id
+    if base.startswith("segment_"):
+        base = base[len("segment_"):]
+    out_path = Path(classify_dir) / f"classify_{base}{LAYER_EXT}"
+    try:
+        os.replace(res["output"], out_path)
+    except OSError as e:
+        raise RuntimeError(f"failed moving result: {e}") from e
+    # a legacy GeoJSON of the same name would shadow the new layer
+    out_path.with_name(out_path.stem + LEGACY_EXT).unlink(missing_ok=True)
+
+    return {"id": out_path.stem, "geojson_url": f"{url_prefix}/{out_path.stem}{LEGACY_EXT}",
+            "file": out_path.name, "accuracy": res.get("accuracy"),
+            "features": res.get("features"), "model_id": res.get("model_id"),
+            "reused_model": res.get("reused_model", False)}
+
+
+def classify_task(segment_id: str, method: str, results_dir: str, classify_dir: str, url_prefix: str,
+                  features=None, models_dir: str | None = None, retrain: bool = False) -> dict:
+    """Train + predict on a segment layer, saved as `<classify_dir>/classify_<base>.parquet`."""
+    progress(0.05, "classify")
+    res = run_classification(
+        segment_id=segment_id,
+        method=method,
+        results_dir=results_dir,        # expects results/segments and results/samples
+        classified_dir=classify_dir,    # writes temporary result here
+        features=parse_groups(features) if features else None,
+        registry=ModelRegistry(models_dir) if models_dir else None,
+        retrain=retrain,
+    )
+
+    progress(0.8, "write")
+    return _publish_classified(res, segment_id, classify_dir, url_prefix)
+
+
+def predict_task(model_id: str, segment_id: str, results_dir: str, classify_dir: str, url_prefix: str,
+                 models_dir: str) -> dict:
+    """Apply a stored model to a segment layer; same output as classify_task."""
+    progress(0.05, "predict")
+    res = run_prediction(model_id, segment_id, results_dir, classify_dir, ModelRegistry(models_dir))
+    progress(0.8, "write")
+    return _publish_classified(res, segment_id, classify_dir, url_prefix)
+
+
+def select_model_task(segment_id: str, results_dir: str, models_dir: str, methods, grid=None, folds: int = 5,
+                      scoring: str = "f1_macro", time_budget: float | None = None, features=None,
+                      workers: int | None = None, apply: bool = False, classify_dir: str | None = None,
+                      url_prefix: str | None = None) -> dict:
+    """
+    Cross-validated model selection on a segment's samples (the best model is
+    stored in the registry); with `apply`, the layer is also classified with it
+    like /classify.
+    """
+    progress(0.02, "read")
+    registry = ModelRegistry(models_dir)
+
+    def on_fold(done, total):
+        progress(0.05 + 0.85 * done / total, f"cv {done}/{total}")
+
+    res = select_model(segment_id, results_dir, registry, methods=methods, grid=grid, folds=folds, scoring=scoring,
+                       time_budget=time_budget, features=parse_groups(features) if features else None,
+                       workers=workers, on_fold=on_fold)
+    if apply:
+        progress(0.92, "predict")
+        res["classified"] = _publish_classified(
+            run_prediction(res["model_id"], segment_id, results_dir, classify_dir, registry),
+            segment_id, classify_dir, url_prefix)
+    return res
+
+
+def merge_clean_task(src_path: str, out_dir: str, class_column: str, target_class: str, area_attr: str,
+                     url_prefix: str, workers: int | None = None) -> dict:
+    """Merge & clean a classified layer into `<out_dir>/merged_<stem>.parquet`."""
+    src_path = Path(src_path)
+    progress(0.05, "read")
+    with span("read") as sp:
+        gdf = read_layer(src_path)
+        sp.set(polygons=int(len(gdf)))
+    lyr = Layer(name=src_path.stem, type="vector")
+    lyr.objects = gdf
+    lyr.crs = gdf.crs
+
+    progress(0.2, "merge")
+    cleaned = merge_clean_polygons(
+        lyr,
+        class_column=class_column,
+        target_class=target_class,
+        area_attr=area_attr,
+        workers=workers,
+        plot=False,
+    )
+
+    progress(0.9, "write")
+    out = _write(cleaned.objects, Path(out_dir) / f"merged_{src_path.stem}{LAYER_EXT}")
+    out.with_name(out.stem + LEGACY_EXT).unlink(missing_ok=True)
+    return {"geojson_url": f"{url_prefix}/{out.stem}{LEGACY_EXT}", "output": out.name}
+
+
+def _ingest_file(tmp: Path, mode: str, ds_factor: int, workers: int | None = None) -> Path:
+    """
+    Post-upload rewrite of `tmp`; returns the file that replaces it.
+    cog        -> tiled, compressed GeoTIFF with internal overviews (lossless)
+    downsample -> legacy lossy shrink by `ds_factor`
+    none       -> keep the upload as-is
+    """
+    if mode == "cog":
+        out = tmp.with_name(f"{tmp.stem}_cog.tif")
+        try:
+            write_cog(tmp, out)
+            tmp.unlink(missing_ok=True)
+            return out
+        except Exception as e:
+            out.unlink(missing_ok=True)
+            logger.warning("COG ingest skipped (%s): %s", tmp.name, e)
+    elif mode == "downsample" and ds_factor > 1:
+        out = tmp.with_name(f"{tmp.stem}_ds{int(ds_factor)}{tmp.suffix}")
+        try:
+            downsample_raster(str(tmp), str(out), ds_factor, workers=workers)
+            tmp.unlink(missing_ok=True)
+            return out
+        except Exception as e:
+            out.unlink(missing_ok=True)
+            logger.warning("Downsample skipped (%s): %s", tmp.name, e)
+    return tmp
+
+
+def ingest_task(tmp_path: str, final_path: str, rid: str, db_path: str, mode: str = "cog",
+                ds_factor: int = 1, workers: int | None = None) -> dict:
+    """
+    Background stage of an upload: rewrite the stored bytes (see _ingest_file),
+    move them to the path reserved for raster `rid` and mark its record done.
+    On failure the record is marked `state="error"` and the upload removed.
+    """
+    store = RasterStore(db_path)
+    tmp = Path(tmp_path)
+    final = Path(final_path)
+    out = tmp
+    try:
+        progress(0.05, "ingest")
+        with span("ingest", mode=mode):
+            out = _ingest_file(tmp, mode, ds_factor, workers)
+        progress(0.85, "describe")
+        meta = describe_raster(out)
+        progress(0.9, "render stats")
+        try:
+            with span("render_stats"):
+                stats = compute_render_stats(out)
+            store.set_stats(rid, stats)
+        except Exception as e:
+            # tiles compute them on first use instead
+            logger.warning("render stats skipped (%s): %s", rid, e)
+        out.replace(final)
+    except Exception as e:
+        for p in (tmp, out):
+            p.unlink(missing_ok=True)
+        store.update(rid, state="error", error=f"{type(e).__name__}: {e}")
+        raise
+    if store.update(rid, state="done", error=None, **meta) is None:
+        final.unlink(missing_ok=True)    # deleted while ingesting
+        return {"id": rid, "deleted": True}
+    return {"id": rid, "state": "done", **meta}
+
+
+def _segment_graph(layer: Path) -> RegionGraph:
+    """The layer's stored adjacency graph, built (and stored) first for layers that predate it."""
+    path = rag_path_for(layer)
+    if path.exists():
+        return RegionGraph.load(path)
+    labels = labels_path_for(layer)
+    if not labels.exists():
+        raise FileNotFoundError(f"No label raster for segment {layer.stem}; segment the raster again")
+    graph = build_rag(labels)
+    graph.save(path)
+    return graph
+
+
+def _segment_means(layer: Path, graph: RegionGraph) -> np.ndarray:
+    """Band means per graph node, from the feature table (computed if it has no spectral group)."""
+    feats = features_path_for(layer)
+    if feats.exists() and "spectral" in feature_groups(feats):
+        table, _ = read_features(feats, ["spectral"])
+    else:
+        labels = labels_path_for(layer)
+        raster_path = labels_source(labels)
+        if not raster_path or not Path(raster_path).exists():
+            raise FileNotFoundError(f"Source raster of segment {layer.stem} no longer exists")
+        table, _ = extract_features(raster_path, labels, groups=("spectral",))
+    cols = [c for c in table.columns if c.startswith("band_") and c.endswith("_mean")]
+    means = np.full((graph.n, len(cols)), np.nan)
+    idx = graph.node_index(table["segment_id"].to_numpy())
+    ok = idx >= 0
+    means[idx[ok]] = table.loc[ok, cols].to_numpy(dtype="float64")
+    return means
+
+
+def merge_regions_task(segment_id: str, segments_dir: str, out_dir: str, url_prefix: str,
+                       classified_path: str | None = None, class_column: str = "classification",
+                       threshold: float | None = None) -> dict:
+    """
+    Merge adjacent segments on the layer's adjacency graph and polygonize the
+    regions once into `<out_dir>/regions_<base>.parquet`. Segments merge when they
+    share a class in `classified_path` and/or their band means are within `threshold`.
+    """
+    if classified_path is None and threshold is None:
+        raise ValueError("Give a classified layer, a spectral threshold, or both")
+    layer = Path(segments_dir) / f"{segment_id}{LAYER_EXT}"
+    progress(0.05, "graph")
+    with span("graph"):
+        graph = _segment_graph(layer)
+
+    classes = None
+    if classified_path is not None:
+        cls = read_layer(classified_path)
+        if "segment_id" not in cls.columns or class_column not in cls.columns:
+            raise ValueError(f"Classified layer needs 'segment_id' and '{class_column}' columns")
+        classes = pd.Series([None] * graph.n, dtype=object)
+        idx = graph.node_index(cls["segment_id"].to_numpy())
+        ok = idx >= 0
+        classes.iloc[idx[ok]] = cls[class_column].to_numpy()[ok]
+    means = _segment_means(layer, graph) if threshold is not None else None
+
+    progress(0.3, "merge")
+    with span("union", segments=int(graph.n)):
+        region = merge_regions(graph, classes=classes, means=means, threshold=threshold)
+
+    progress(0.5, "polygonize")
+    with span("vectorize") as sp:
+        gdf = polygonize_regions(labels_path_for(layer), graph, region)
+        sp.set(polygons=int(len(gdf)))
+    if classes is not None:
+        _, first = np.unique(region, return_index=True)     # one member per region; all share the class
+        gdf[class_column] = classes.to_numpy()[first[gdf["region_id"].to_numpy()]]
+
+    progress(0.9, "write")
+    base = segment_id[len("segment_"):] if segment_id.startswith("segment_") else segment_id
+    out = _write(_to_wgs84(gdf), Path(out_dir) / f"regions_{base}{LAYER_EXT}")
+    out.with_name(out.stem + LEGACY_EXT).unlink(missing_ok=True)
+    return {"id": out.stem, "geojson_url": f"{url_prefix}/{out.stem}{LEGACY_EXT}", "output": out.name,
+            "segments": graph.n, "regions": int(len(gdf))}
+
+
+def _publish_classmap(labels: Path, table: pd.DataFrame, info: dict, base: str, out_dir: str,
+                      url_prefix: str) -> dict:
+    progress(0.7, "polygonize")
+    with span("vectorize", segments=int(len(table))) as sp:
+        gdf = polygonize_classes(labels, table["segment_id"].to_numpy(), table["classification"].to_numpy())
+        sp.set(polygons=int(len(gdf)))
+    progress(0.9, "write")
+    out = _write(_to_wgs84(gdf), Path(out_dir) / f"classmap_{base}{LAYER_EXT}")
+    out.with_name(out.stem + LEGACY_EXT).unlink(missing_ok=True)
+    return {"id": out.stem, "geojson_url": f"{url_prefix}/{out.stem}{LEGACY_EXT}", "output": out.name,
+            "segments": int(len(table)), "polygons": int(len(gdf)), **info}
+
+
+def classmap_task(segment_id: str, method: str, results_dir: str, out_dir: str, url_prefix: str,
+                  models_dir: str, features=None, retrain: bool = False, model_id: str | None = None) -> dict:
+    """
+    Classify a segment layer on its feature table (trained on its samples, or
+    with stored model `model_id`) and polygonize the classes once from its label
+    raster into `<out_dir>/classmap_<base>.parquet`; see classmap.py.
+    """
+    layer = Path(results_dir) / "segments" / f"{segment_id}{LAYER_EXT}"
+    labels = labels_path_for(layer)
+    if not labels.exists():
+        raise FileNotFoundError(f"No label raster for segment {segment_id}; segment the raster again")
+    registry = ModelRegistry(models_dir)
+    progress(0.1, "classify")
+    if model_id:
+        table, _ = read_features(features_path_for(layer))
+        table, info = predict_table(model_id, table, registry)
+    else:
+        table, info = classify_table(segment_id, method, results_dir, features=features,
+                                     registry=registry, retrain=retrain)
+    base = segment_id[len("segment_"):] if segment_id.startswith("segment_") else segment_id
+    return _publish_classmap(labels, table, info, base, out_dir, url_prefix)
+
+
+def raster_classmap_task(raster_path: str, stem: str, scale: float, compactness: float, downscale: float,
+                         model_id: str, models_dir: str, out_dir: str, url_prefix: str) -> dict:
+    """
+    The whole segment -> classify -> dissolve chain in the raster domain: SLIC
+    labels (no segment polygons), the features stored model `model_id` needs,
+    prediction, and one polygonization of the class raster.
+    """
+    registry = ModelRegistry(models_dir)
+    meta = registry.get(model_id)
+    if meta is None:
+        raise FileNotFoundError(f"Model not found: {model_id}")
+    groups = groups_for_columns(meta["features"])
+    if not groups:
+        raise ValueError(f"Model {model_id} was not trained on feature table columns")
+    with tempfile.TemporaryDirectory(prefix="classmap_", dir=out_dir) as tmp:
+        labels = Path(tmp) / f"{stem}.labels.tif"
+        progress(0.05, "segment")
+        slic_labels(raster_path, scale, compactness, labels, downscale=downscale)
+        progress(0.4, "features")
+        with span("features") as sp:
+            table, _ = extract_features(raster_path, labels, groups=groups)
+            sp.set(segments=int(len(table)))
+        progress(0.6, "classify")
+        table, info = predict_table(model_id, table, registry)
+        base = stem[len("segment_"):] if stem.startswith("segment_") else stem
+        return _publish_classmap(labels, table, info, base, out_dir, url_prefix)
@@ -0,0 +1,165 @@
+# backend/obia/tilecache.py
+"""
+Rendered-tile cache: an in-memory LRU bounded by a byte budget, with an
+optional on-disk layer (one sub-directory per raster id) behind it.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def tile_key(*parts) -> str:
+    """Stable hex digest for any tuple of key parts (ids, hashes, stats, z/x/y)."""
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(repr(p).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class TileCache:
+    """
+    Thread-safe LRU cache of encoded tiles.
+
+    Parameters:
+        max_bytes (int): memory budget; least recently used tiles are evicted beyond it.
+        disk_dir (str | Path | None): root of the on-disk layer, or None to keep tiles in memory only.
+        disk_max_bytes (int): budget of the on-disk layer (0 = unbounded).
+    """
+
+    def __init__(self, max_bytes: int, disk_dir=None, disk_max_bytes: int = 0):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = int(disk_max_bytes)
+        self._mem: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(p.stat().st_size for p in self.disk_dir.rglob("*.tile"))
+
+    # ---- lookups
+    def get_memory(self, rid: str, key: str) -> bytes | None:
+        """Memory layer only (no file I/O, safe on an event loop); a miss is not counted."""
+        with self._lock:
+            data = self._mem.get((rid, key))
+            if data is not None:
+                self._mem.move_to_end((rid, key))
+                self.hits += 1
+            return data
+
+    def get(self, rid: str, key: str) -> bytes | None:
+        data = self.get_memory(rid, key)
+        if data is not None:
+            return data
+        data = self._disk_get(rid, key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._mem_put(rid, key, data)
+        return data
+
+    def put(self, rid: str, key: str, data: bytes):
+        with self._lock:
+            self._mem_put(rid, key, data)
+        self._disk_put(rid, key, data)
+
+    def invalidate(self, rid: str):
+        """Drop every cached tile of one raster (memory and disk)."""
+        with self._lock:
+            for k in [k for k in self._mem if k[0] == rid]:
+                self._mem_bytes -= len(self._mem.pop(k))
+            if self.disk_dir is not None:
+                d = self.disk_dir / rid
+                if d.is_dir():
+                    self._disk_bytes -= sum(p.stat().st_size for p in d.glob("*.tile"))
+                    shutil.rmtree(d, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "bytes": self._mem_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes if self.disk_dir is not None else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else None,
+            }
+
+    # ---- memory layer (caller holds the lock)
+    def _mem_put(self, rid: str, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old = self._mem.pop((rid, key), None)
+        if old is not None:
+            self._mem_bytes -= len(old)
+        self._mem[(rid, key)] = data
+        self._mem_bytes += len(data)
+        while self._mem_bytes > self.max_bytes and self._mem:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_bytes -= len(evicted)
+
+    # ---- disk layer
+    def _disk_path(self, rid: str, key: str) -> Path:
+        return self.disk_dir / rid / f"{key}.tile"
+
+    def _disk_get(self, rid: str, key: str) -> bytes | None:
+        if self.disk_dir is None:
+            return None
+        p = self._disk_path(rid, key)
+        try:
+            data = p.read_bytes()
+            os.utime(p)  # mtime doubles as the disk layer's LRU clock
+            return data
+        except OSError:
+            return None
+
+    def _disk_put(self, rid: str, key: str, data: bytes):
+        if self.disk_dir is None:
+            return
+        p = self._disk_path(rid, key)
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            old_size = p.stat().st_size if p.exists() else 0
+            tmp = p.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(p)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - old_size
+            over = self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        # evict oldest tiles down to 90% of the budget so we don't rescan on every put
+        files = []
+        for p in self.disk_dir.rglob("*.tile"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+        total = sum(f[1] for f in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, p in files:
+            if total <= target:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
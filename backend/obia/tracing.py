@@ -0,0 +1,158 @@
+# backend/obia/tracing.py
+"""
+Lightweight request / job tracing.
+
+A Trace is a flat list of timed spans with parent links, started per HTTP
+request (see the middleware in app.py) and per job in the worker process
+(jobs.py). `span(name, **attrs)` times a block under the current trace and is
+a cheap no-op when there is none, so pipeline code can be instrumented
+unconditionally. Job traces come back with the job result and are merged into
+the trace of the request that waited for the job, so one slow /segment call
+breaks down into queueing, raster read, SLIC, vectorize, to_crs, serialize...
+
+Span attributes named `polygons` and `pixels` are also counted in /metrics.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_TRACE: ContextVar["Trace | None"] = ContextVar("obia_trace", default=None)
+_PARENT: ContextVar["int | None"] = ContextVar("obia_span", default=None)
+
+
+class Trace:
+    """
+    Parameters:
+        name (str): what is traced, e.g. "GET /tiles/{rid}/{z}/{x}/{y}.png" or "job segment".
+        trace_id (str | None): defaults to a new random id.
+    """
+
+    def __init__(self, name: str, trace_id: str | None = None):
+        self.id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms: float | None = None
+        self.attrs: dict = {}
+        self.spans: list[dict] = []
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000.0
+
+    def _add(self, name: str, start_ms: float, parent: int | None, attrs: dict) -> dict:
+        with self._lock:
+            sp = {"id": len(self.spans), "parent": parent, "name": name,
+                  "start_ms": round(start_ms, 3), "duration_ms": None, "attrs": attrs}
+            self.spans.append(sp)
+        return sp
+
+    def merge(self, other: dict, parent: int | None = None):
+        """Graft the spans of another trace's to_dict() (e.g. a job's), shifted to its wall-clock start."""
+        offset = (other["start"] - self.start) * 1000.0
+        with self._lock:
+            base = len(self.spans)
+            for sp in other["spans"]:
+                self.spans.append({**sp, "id": base + sp["id"],
+                                   "parent": parent if sp["parent"] is None else base + sp["parent"],
+                                   "start_ms": round(sp["start_ms"] + offset, 3)})
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = round(self.elapsed_ms(), 3)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [dict(sp) for sp in self.spans]
+        return {"trace_id": self.id, "name": self.name, "start": self.start,
+                "duration_ms": self.duration_ms if self.duration_ms is not None else round(self.elapsed_ms(), 3),
+                "attrs": dict(self.attrs), "spans": spans}
+
+
+class _Span:
+    def __init__(self, rec: dict | None):
+        self._rec = rec
+
+    def set(self, **attrs):
+        """Attach attributes (counts, sizes) to the span."""
+        if self._rec is not None:
+            self._rec["attrs"].update(attrs)
+
+
+@contextmanager
+def trace(name: str, trace_id: str | None = None):
+    """Make a new Trace current for the block; yields it (finished on exit)."""
+    t = Trace(name, trace_id)
+    tok, ptok = _TRACE.set(t), _PARENT.set(None)
+    try:
+        yield t
+    finally:
+        t.finish()
+        _TRACE.reset(tok)
+        _PARENT.reset(ptok)
+
+
+def current_trace() -> Trace | None:
+    return _TRACE.get()
+
+
+def current_span() -> int | None:
+    return _PARENT.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span; yields an object with .set(**attrs)."""
+    t = _TRACE.get()
+    if t is None:
+        yield _Span(None)
+        return
+    rec = t._add(name, t.elapsed_ms(), _PARENT.get(), dict(attrs))
+    tok = _PARENT.set(rec["id"])
+    t0 = time.perf_counter()
+    try:
+        yield _Span(rec)
+    except BaseException as e:
+        rec["attrs"]["error"] = type(e).__name__
+        raise
+    finally:
+        rec["duration_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+        _PARENT.reset(tok)
+
+
+class TraceBuffer:
+    """Most recent finished traces (as dicts), bounded; looked up by id."""
+
+    def __init__(self, max_traces: int = 200):
+        self.max_traces = max(1, int(max_traces))
+        self._traces: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, t: dict):
+        with self._lock:
+            self._traces[t["trace_id"]] = t
+            self._traces.move_to_end(t["trace_id"])
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, trace_id: str) -> dict | None:
+        with self._lock:
+            return self._traces.get(trace_id)
+
+    def list(self, min_ms: float = 0.0, limit: int = 50) -> list[dict]:
+        """Summaries, newest first."""
+        with self._lock:
+            items = list(reversed(self._traces.values()))
+        out = []
+        for t in items:
+            if t["duration_ms"] >= min_ms:
+                out.append({k: t[k] for k in ("trace_id", "name", "start", "duration_ms", "attrs")}
+                           | {"spans": len(t["spans"])})
+                if len(out) >= limit:
+                    break
+        return out
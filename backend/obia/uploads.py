@@ -0,0 +1,160 @@
+# backend/obia/uploads.py
+"""
+Streaming and resumable raster uploads.
+
+Bytes are written to disk and hashed in the same pass, so an upload is never
+re-read just to compute its sha1. Large files can be sent in chunks to an
+upload session: each chunk is appended at the session's current offset (the
+size of its `.part` file, so the offset survives restarts), and an interrupted
+upload resumes from `GET /uploads/{id}`. The running sha1 lives in memory; if
+the server restarted in between, the hash is recomputed once on completion.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+CHUNK = 1024 * 1024
+
+
+class UploadConflict(Exception):
+    """A chunk was sent for the wrong offset; carries the session's real offset."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"expected offset {offset}")
+        self.offset = offset
+
+
+def _write_chunk(f, hasher, chunk: bytes):
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+async def stream_to_file(chunks, f, hasher) -> int:
+    """
+    Write an async iterator of byte chunks to `f`, hashing as we go; returns bytes written.
+    Writes and hashing run in a worker thread, so the event loop never blocks on the disk.
+    """
+    n = 0
+    async for chunk in chunks:
+        if chunk:
+            await asyncio.to_thread(_write_chunk, f, hasher, chunk)
+            n += len(chunk)
+    return n
+
+
+async def iter_upload_file(upload, chunk_size: int = CHUNK):
+    """Async chunks of a Starlette UploadFile."""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class UploadSessions:
+    """
+    Parameters:
+        tmp_dir (str | Path): where `<id>.part` and `<id>.json` live.
+        max_age (float): seconds after which an untouched session is discarded.
+    """
+
+    def __init__(self, tmp_dir, max_age: float = 24 * 3600):
+        self.tmp_dir = Path(tmp_dir)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self._hashers: dict[str, tuple[int, "hashlib._Hash"]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def _paths(self, upload_id: str) -> tuple[Path, Path]:
+        name = os.path.basename(upload_id)
+        return self.tmp_dir / f"{name}.part", self.tmp_dir / f"{name}.json"
+
+    def create(self, filename: str, size: int, sha1: str | None = None) -> dict:
+        self.prune()
+        upload_id = uuid.uuid4().hex
+        part, meta = self._paths(upload_id)
+        part.touch()
+        rec = {"upload_id": upload_id, "filename": filename, "size": int(size),
+               "sha1": (sha1 or "").lower() or None, "created": time.time()}
+        meta.write_text(json.dumps(rec), encoding="utf-8")
+        self._hashers[upload_id] = (0, hashlib.sha1())
+        return {**rec, "offset": 0}
+
+    def get(self, upload_id: str) -> dict | None:
+        part, meta = self._paths(upload_id)
+        try:
+            rec = json.loads(meta.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        rec["offset"] = part.stat().st_size if part.exists() else 0
+        return rec
+
+    async def append(self, upload_id: str, offset: int | None, chunks) -> dict:
+        """Append streamed bytes at `offset` (default: current end); raises UploadConflict on a gap or overlap."""
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            rec = self.get(upload_id)
+            if rec is None:
+                raise KeyError(upload_id)
+            cur = rec["offset"]
+            if offset is not None and offset != cur:
+                raise UploadConflict(cur)
+            done, hasher = self._hashers.get(upload_id, (-1, None))
+            if done != cur:
+                hasher = None   # lost the running hash (restart): recomputed on completion
+            part, meta = self._paths(upload_id)
+            with part.open("ab") as f:
+                n = await stream_to_file(chunks, f, hasher or _NullHash())
+            if hasher is not None:
+                self._hashers[upload_id] = (cur + n, hasher)
+            os.utime(meta)
+            rec["offset"] = cur + n
+            if rec["offset"] > rec["size"]:
+                raise ValueError(f"upload exceeds declared size ({rec['offset']} > {rec['size']})")
+            return rec
+
+    def finish(self, upload_id: str) -> tuple[Path, str, dict]:
+        """(part file, sha1, record) of a complete upload; verifies the size and the client's sha1."""
+        rec = self.get(upload_id)
+        if rec is None:
+            raise KeyError(upload_id)
+        if rec["offset"] != rec["size"]:
+            raise UploadConflict(rec["offset"])
+        part, _ = self._paths(upload_id)
+        done, hasher = self._hashers.pop(upload_id, (-1, None))
+        if hasher is None or done != rec["size"]:
+            hasher = hashlib.sha1()
+            with part.open("rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK), b""):
+                    hasher.update(chunk)
+        sha1 = hasher.hexdigest()
+        if rec.get("sha1") and rec["sha1"] != sha1:
+            self.discard(upload_id)
+            raise ValueError(f"sha1 mismatch: expected {rec['sha1']}, received {sha1}")
+        return part, sha1, rec
+
+    def discard(self, upload_id: str):
+        for p in self._paths(upload_id):
+            p.unlink(missing_ok=True)
+        self._hashers.pop(upload_id, None)
+        self._locks.pop(upload_id, None)
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        for meta in self.tmp_dir.glob("*.json"):
+            try:
+                if meta.stat().st_mtime < cutoff:
+                    self.discard(meta.stem)
+            except OSError:
+                pass
+
+
+class _NullHash:
+    def update(self, _):
+        pass
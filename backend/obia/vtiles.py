@@ -0,0 +1,130 @@
+# backend/obia/vtiles.py
+"""
+Vector tiles (MVT) for stored result layers.
+
+Each layer is loaded once into Web Mercator and indexed with an STRtree. A tile
+request queries the index with the (buffered) tile box, clips the hits to it
+and encodes them with mvt.py. Geometries are simplified per zoom level
+(tolerance of a fraction of a screen pixel), and polygons that would be
+smaller than a pixel are dropped. The simplified copy of a layer is computed
+once per zoom and kept, so low zooms don't simplify the whole layer per tile.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import shapely
+
+from .mvt import encode_layer, encode_tile
+from .storage import read_layer
+
+EXTENT = 4096
+BUFFER = 64                          # tile units of overlap, hides seams at tile edges
+SIMPLIFY_PX = 0.5                    # tolerance in 256-px screen pixels
+_HALF_WORLD = math.pi * 6378137.0
+
+
+def tile_bounds_3857(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    size = 2 * _HALF_WORLD / (1 << z)
+    minx = -_HALF_WORLD + x * size
+    maxy = _HALF_WORLD - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+class VectorLayer:
+    """One stored layer, projected to EPSG:3857 and indexed for tile queries."""
+
+    def __init__(self, path, max_zoom_cache: int = 6):
+        gdf = read_layer(path)
+        if gdf.crs is not None:
+            gdf = gdf.to_crs(epsg=3857)
+        self.geoms = np.asarray(gdf.geometry.values, dtype=object)
+        self.attrs = gdf.drop(columns=gdf.geometry.name)
+        self.ids = gdf["segment_id"].to_numpy() if "segment_id" in gdf.columns else None
+        self.tree = shapely.STRtree(self.geoms)
+        self.bounds = tuple(shapely.total_bounds(self.geoms)) if len(self.geoms) else None
+        self._by_zoom: OrderedDict[int, tuple] = OrderedDict()
+        self._max_zoom_cache = max_zoom_cache
+        self._lock = threading.Lock()
+
+    def _for_zoom(self, z: int):
+        """(geometries, keep mask) simplified for zoom z; full detail once a pixel gets small."""
+        px = 2 * _HALF_WORLD / ((1 << z) * 256)
+        tol = px * SIMPLIFY_PX
+        with self._lock:
+            hit = self._by_zoom.get(z)
+            if hit is not None:
+                self._by_zoom.move_to_end(z)
+                return hit
+        simplified = shapely.simplify(self.geoms, tol, preserve_topology=True)
+        keep = shapely.area(self.geoms) >= px * px
+        with self._lock:
+            self._by_zoom[z] = (simplified, keep)
+            while len(self._by_zoom) > self._max_zoom_cache:
+                self._by_zoom.popitem(last=False)
+        return simplified, keep
+
+    def tile(self, name: str, z: int, x: int, y: int, columns: list[str] | None = None) -> bytes:
+        minx, miny, maxx, maxy = tile_bounds_3857(z, x, y)
+        buf = (maxx - minx) * BUFFER / EXTENT
+        box = shapely.box(minx - buf, miny - buf, maxx + buf, maxy + buf)
+        idx = self.tree.query(box, predicate="intersects")
+        if idx.size == 0:
+            return b""
+        geoms, keep = self._for_zoom(z)
+        idx = np.sort(idx[keep[idx]])
+        if idx.size == 0:
+            return b""
+
+        clipped = shapely.clip_by_rect(geoms[idx], minx - buf, miny - buf, maxx + buf, maxy + buf)
+        k = EXTENT / (maxx - minx)
+        local = shapely.transform(
+            clipped, lambda c: np.rint(np.column_stack(((c[:, 0] - minx) * k, (maxy - c[:, 1]) * k))))
+        ok = ~shapely.is_empty(local)
+        idx, local = idx[ok], local[ok]
+
+        attrs = self.attrs
+        if columns is not None:
+            attrs = attrs[[c for c in columns if c in attrs.columns]]
+        props = attrs.iloc[idx].to_dict("records") if len(attrs.columns) else None
+        ids = self.ids[idx] if self.ids is not None else None
+        return encode_tile([encode_layer(name, local, props, ids=ids, extent=EXTENT)])
+
+
+class VectorLayerCache:
+    """
+    Bounded LRU of loaded VectorLayers, keyed by file path and reloaded when the file changes.
+
+    Parameters:
+        max_layers (int): number of layers kept loaded.
+    """
+
+    def __init__(self, max_layers: int = 8):
+        self.max_layers = max(1, int(max_layers))
+        self._layers: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path) -> VectorLayer:
+        path = Path(path)
+        stamp = path.stat().st_mtime_ns
+        key = str(path)
+        with self._lock:
+            ent = self._layers.get(key)
+            if ent is not None and ent[0] == stamp:
+                self._layers.move_to_end(key)
+                return ent[1]
+        layer = VectorLayer(path)
+        with self._lock:
+            self._layers[key] = (stamp, layer)
+            self._layers.move_to_end(key)
+            while len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+        return layer
+
+    def invalidate(self, path):
+        with self._lock:
+            self._layers.pop(str(Path(path)), None)
@@ -0,0 +1,320 @@
+# backend/obia/windowed_segmentation.py
+"""
+Windowed SLIC segmentation for rasters larger than RAM.
+
+The working grid is cut into blocks; each block is read through a rasterio
+window padded by `overlap` pixels on every side and segmented on its own
+(in parallel across processes). Labels are kept only for the block's core,
+and segments cut by a seam are stitched back together by matching labels in
+the shared overlap zone. Per-segment band statistics are accumulated from the
+blocks as they arrive, so neither the image nor the label array ever has to be
+held in memory as a whole. The output layer has the same columns as
+nickyspatial's SlicSegmentation.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import geopandas as gpd
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import shapes
+from rasterio.windows import Window
+from shapely.geometry import Polygon
+from skimage import segmentation
+from nickyspatial.core.layer import Layer
+
+from .tracing import span
+
+
+# ---- block grid
+def _block_grid(width: int, height: int, block_size: int, overlap: int) -> list[dict]:
+    """Row-major list of blocks with core and padded extents in working-grid pixels."""
+    blocks = []
+    n_rows = -(-height // block_size)
+    n_cols = -(-width // block_size)
+    for i in range(n_rows):
+        for j in range(n_cols):
+            r0, c0 = i * block_size, j * block_size
+            r1, c1 = min(r0 + block_size, height), min(c0 + block_size, width)
+            blocks.append({
+                "i": i, "j": j, "core": (r0, r1, c0, c1),
+                "pad": (max(0, r0 - overlap), min(height, r1 + overlap),
+                        max(0, c0 - overlap), min(width, c1 + overlap)),
+            })
+    return blocks
+
+
+def _band_range(src, max_side: int = 2048):
+    """Per-band min/max for normalisation, estimated from a decimated (overview) read."""
+    f = max(1.0, max(src.width, src.height) / max_side)
+    out = (src.count, max(1, int(src.height / f)), max(1, int(src.width / f)))
+    sample = src.read(out_shape=out, resampling=Resampling.nearest)
+    return sample.reshape(src.count, -1).min(axis=1).astype("float64"), \
+        sample.reshape(src.count, -1).max(axis=1).astype("float64")
+
+
+# ---- worker
+def _segment_block(raster_path: str, pad, core, downscale: float, lo, hi, scale: float, compactness: float):
+    """SLIC on one padded block; returns its labels and per-label stats over the core."""
+    pr0, pr1, pc0, pc1 = pad
+    h, w = pr1 - pr0, pc1 - pc0
+    with rasterio.open(raster_path) as src:
+        win = Window(pc0 * downscale, pr0 * downscale, w * downscale, h * downscale)
+        data = src.read(window=win, out_shape=(src.count, h, w), resampling=Resampling.average)
+
+    # same normalisation as SlicSegmentation, but with the raster-wide range
+    img = np.empty((h, w, data.shape[0]), dtype="float32")
+    for b in range(data.shape[0]):
+        span = hi[b] - lo[b]
+        if span <= 0:
+            img[..., b] = 0.0
+        else:
+            np.subtract(data[b], lo[b], out=img[..., b], casting="unsafe")
+            img[..., b] /= span
+    np.clip(img, 0.0, 1.0, out=img)
+
+    n_segments = max(1, int(w * h / (scale * scale)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        labels = segmentation.slic(
+            img, n_segments=n_segments, compactness=compactness,
+            sigma=1.0, start_label=1, channel_axis=-1,
+        ).astype("int32")
+    del img
+
+    r0, r1, c0, c1 = core
+    core_lab = labels[r0 - pr0:r1 - pr0, c0 - pc0:c1 - pc0].ravel()
+    n = int(labels.max())
+    stats = {"count": np.bincount(core_lab, minlength=n + 1).astype("int64")}
+    starts = np.concatenate([[0], np.cumsum(stats["count"])[:-1]])
+    cnt = stats["count"]
+    for b in range(data.shape[0]):
+        v = data[b, r0 - pr0:r1 - pr0, c0 - pc0:c1 - pc0].ravel().astype("float64")
+        s = np.bincount(core_lab, weights=v, minlength=n + 1)
+        ss = np.bincount(core_lab, weights=v * v, minlength=n + 1)
+        mn = np.full(n + 1, np.inf)
+        mx = np.full(n + 1, -np.inf)
+        np.minimum.at(mn, core_lab, v)
+        np.maximum.at(mx, core_lab, v)
+        # medians: sort values within each label, take the middle element(s)
+        sv = v[np.lexsort((v, core_lab))]
+        has = cnt > 0
+        lo_i = starts + (cnt - 1) // 2
+        hi_i = starts + cnt // 2
+        med = np.zeros(n + 1)
+        med[has] = (sv[lo_i[has]] + sv[hi_i[has]]) / 2.0
+        stats[b] = (s, ss, mn, mx, med)
+    return labels, stats
+
+
+# ---- seam stitching
+class _UnionFind:
+    def __init__(self):
+        self.parent: dict[int, int] = {}
+
+    def find(self, a: int) -> int:
+        root = a
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while self.parent.get(a, a) != root:
+            self.parent[a], a = root, self.parent[a]
+        return root
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def _match_strips(uf: _UnionFind, a: np.ndarray, b: np.ndarray, min_ratio: float):
+    """Union labels that cover the same pixels of an overlap zone in two neighbouring blocks."""
+    a = a.ravel().astype("int64")
+    b = b.ravel().astype("int64")
+    pair, n_pair = np.unique((a << 32) | b, return_counts=True)
+    pa, pb = pair >> 32, pair & 0xFFFFFFFF
+    ua, na = np.unique(a, return_counts=True)
+    ub, nb = np.unique(b, return_counts=True)
+    size_a = na[np.searchsorted(ua, pa)]
+    size_b = nb[np.searchsorted(ub, pb)]
+    keep = (n_pair >= min_ratio * size_a) & (n_pair >= min_ratio * size_b)
+    for x, y in zip(pa[keep].tolist(), pb[keep].tolist()):
+        uf.union(x, y)
+
+
+# ---- main entry
+def run_windowed_slic_segmentation(raster_path: str, scale: float, compactness: float,
+                                   layer_name="Solar_OBIA_Segments", downscale: float = 1.0,
+                                   block_size: int = 2048, overlap: int = 64, workers: int | None = None,
+                                   labels_path: str | None = None, min_ratio: float = 0.5):
+    """
+    Segment a raster block by block with bounded memory.
+
+    Parameters:
+        raster_path (str): Input raster.
+        scale, compactness (float): SLIC parameters, as for SlicSegmentation.
+        downscale (float): Working resolution factor (1 = native).
+        block_size (int): Core block size in working pixels.
+        overlap (int): Padding read around each block, used for seam stitching.
+        workers (int): Parallel block processes (default: all cores).
+        labels_path (str): Optional GeoTIFF to keep the final label raster in.
+        min_ratio (float): Share of the overlap zone two labels must have in common to be joined.
+    """
+    downscale = max(1.0, float(downscale or 1.0))
+    block_size = max(64, int(block_size))
+    overlap = max(0, min(int(overlap), block_size // 2))
+    workers = max(1, int(workers or os.cpu_count() or 1))
+
+    with rasterio.open(raster_path) as src:
+        height = max(1, int(src.height / downscale))
+        width = max(1, int(src.width / downscale))
+        transform = src.transform * src.transform.scale(src.width / width, src.height / height)
+        crs = src.crs
+        n_bands = src.count
+        lo, hi = _band_range(src)
+
+    tmpdir = Path(tempfile.mkdtemp(prefix="obia_wslic_"))
+    try:
+        asm = np.lib.format.open_memmap(tmpdir / "labels.npy", mode="w+", dtype="int32", shape=(height, width))
+        blocks = _block_grid(width, height, block_size, overlap)
+        uf = _UnionFind()
+        counts, band_acc = [], {b: ([], [], [], [], []) for b in range(n_bands)}
+        right_strip: dict[tuple, np.ndarray] = {}
+        bottom_strip: dict[tuple, np.ndarray] = {}
+        offset = 0
+
+        def _consume(blk, labels, stats):
+            nonlocal offset
+            n = int(labels.max())
+            labels += offset
+            (r0, r1, c0, c1), (pr0, pr1, pc0, pc1) = blk["core"], blk["pad"]
+            asm[r0:r1, c0:c1] = labels[r0 - pr0:r1 - pr0, c0 - pc0:c1 - pc0]
+
+            # stitch with the left and upper neighbours over their shared overlap zones
+            key = (blk["i"], blk["j"])
+            left = right_strip.pop((blk["i"], blk["j"] - 1), None)
+            if left is not None:
+                _match_strips(uf, left, labels[:, :left.shape[1]], min_ratio)
+            up = bottom_strip.pop((blk["i"] - 1, blk["j"]), None)
+            if up is not None:
+                _match_strips(uf, up, labels[:up.shape[0], :], min_ratio)
+            if overlap and c1 < width:
+                right_strip[key] = labels[:, (c1 - overlap) - pc0:].copy()
+            if overlap and r1 < height:
+                bottom_strip[key] = labels[(r1 - overlap) - pr0:, :].copy()
+
+            counts.append(stats["count"][1:n + 1])
+            for b in range(n_bands):
+                for acc, arr in zip(band_acc[b], stats[b]):
+                    acc.append(arr[1:n + 1])
+            offset += n
+
+        # bounded number of blocks in flight keeps memory flat (block reads happen in the workers)
+        with span("slic", pixels=int(width * height), blocks=len(blocks)), \
+                ProcessPoolExecutor(max_workers=workers) as ex:
+            pending = []
+            for blk in blocks:
+                pending.append((blk, ex.submit(_segment_block, str(raster_path), blk["pad"], blk["core"],
+                                               downscale, lo, hi, scale, compactness)))
+                if len(pending) >= 2 * workers:
+                    b0, fut = pending.pop(0)
+                    _consume(b0, *fut.result())
+            for b0, fut in pending:
+                _consume(b0, *fut.result())
+        right_strip.clear()
+        bottom_strip.clear()
+
+        # resolve stitched labels -> consecutive final ids
+        n_total = offset
+        root = np.arange(n_total + 1, dtype="int64")
+        for g in list(uf.parent):
+            root[g] = uf.find(g)
+        count = np.concatenate(counts) if counts else np.zeros(0, "int64")
+        agg_count = np.bincount(root[1:], weights=count, minlength=n_total + 1)
+        alive = agg_count > 0
+        alive[0] = False
+        new_id = np.zeros(n_total + 1, dtype="int32")
+        new_id[alive] = np.arange(1, int(alive.sum()) + 1, dtype="int32")
+        lut = new_id[root]
+
+        out_labels = Path(labels_path) if labels_path else tmpdir / "labels.tif"
+        profile = {
+            "driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": "int32",
+            "crs": crs, "transform": transform, "nodata": 0,
+            "tiled": True, "blockxsize": 512, "blockysize": 512, "compress": "deflate",
+        }
+        with rasterio.open(out_labels, "w", **profile) as dst:
+            step = max(1, (64 * 1024 * 1024) // (4 * width))
+            for r in range(0, height, step):
+                r1 = min(height, r + step)
+                dst.write(lut[asm[r:r1]], 1, window=Window(0, r, width, r1 - r))
+        del asm
+
+        # per-segment attributes, aggregated over blocks and seams
+        ids = np.flatnonzero(alive)
+        px_area = abs(transform.a) * abs(transform.e)
+        attrs = {
+            "segment_id": new_id[ids].astype("int64"),
+            "area_pixels": agg_count[ids].astype("int64"),
+            "area_units": agg_count[ids] * px_area,
+        }
+        for b in range(n_bands):
+            s, ss, mn, mx, med = (np.concatenate(a) if a else np.zeros(0) for a in band_acc[b])
+            S = np.bincount(root[1:], weights=s, minlength=n_total + 1)[ids]
+            SS = np.bincount(root[1:], weights=ss, minlength=n_total + 1)[ids]
+            MN = np.full(n_total + 1, np.inf)
+            MX = np.full(n_total + 1, -np.inf)
+            np.minimum.at(MN, root[1:], mn)
+            np.maximum.at(MX, root[1:], mx)
+            # medians of seam-split segments: pixel-weighted mean of the per-block medians
+            MED = np.bincount(root[1:], weights=med * count, minlength=n_total + 1)[ids]
+            c = agg_count[ids]
+            mean = S / c
+            attrs[f"band_{b + 1}_mean"] = mean
+            attrs[f"band_{b + 1}_std"] = np.sqrt(np.maximum(SS / c - mean * mean, 0.0))
+            attrs[f"band_{b + 1}_min"] = MN[ids]
+            attrs[f"band_{b + 1}_max"] = MX[ids]
+            attrs[f"band_{b + 1}_median"] = MED / c
+
+        # one polygonize pass over the label raster (read block-wise by GDAL)
+        largest: dict[int, Polygon] = {}
+        with span("vectorize") as sp, rasterio.open(out_labels) as lab:
+            for geom, val in shapes(rasterio.band(lab, 1), mask=None, transform=transform):
+                v = int(val)
+                if v == 0:
+                    continue
+                poly = Polygon(geom["coordinates"][0])
+                if not poly.is_valid:
+                    continue
+                cur = largest.get(v)
+                if cur is None or poly.area > cur.area:
+                    largest[v] = poly
+            sp.set(polygons=len(largest))
+
+        keep = np.array([int(i) in largest for i in attrs["segment_id"]], dtype=bool)
+        data = {k: np.asarray(v)[keep] for k, v in attrs.items()}
+        gdf = gpd.GeoDataFrame(data, geometry=[largest[int(i)] for i in data["segment_id"]], crs=crs)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    layer = Layer(name=layer_name, type="segmentation")
+    layer.raster = None
+    layer.transform = transform
+    layer.crs = crs
+    layer.objects = gdf
+    layer.metadata = {
+        "scale": scale,
+        "compactness": compactness,
+        "block_size": block_size,
+        "overlap": overlap,
+        "num_blocks": len(blocks),
+        "num_segments_actual": int(len(gdf)),
+        "labels_path": str(labels_path) if labels_path else None,
+    }
+    return layer
@@ -0,0 +1,372 @@
+"""
+End-to-end benchmark of the OBIA pipeline on synthetic rasters.
+
+For every size a multi-band GeoTIFF of land-cover-like parcels is generated
+and run through each stage, timed and memory-profiled:
+
+    ingest      COG rewrite of the upload (ingest_task)
+    downsample  legacy lossy shrink (downsample_raster, factor 4)
+    slic        SLIC label raster only (slic_labels)
+    vectorize   label raster -> polygons (rasterio shapes)
+    segment     the whole /segment job: SLIC, polygons, adjacency graph, write
+    features    spectral + shape feature table
+    classify    train + predict on synthetic samples
+    merge       merge_clean_polygons on the classified layer
+    classmap    raster-domain classify + dissolve with the trained model
+    tiles       tile throughput and latency through the API, cold and warm
+                cache, at several client concurrencies
+
+Stages run in this process, one after the other, in a temporary directory;
+`peak_rss_mb` is the highest resident size sampled during a stage (worker
+processes of block segmentation / parallel merge are not included). Results
+go to a JSON file (see --out) that --compare reads back, so runs can be
+compared across commits:
+
+    python -m benchmarks.bench_pipeline --sizes 1k,4k
+    python -m benchmarks.bench_pipeline --sizes 1k --compare benchmarks/results/<old>.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.features import shapes
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+ROOT = Path(__file__).resolve().parent.parent
+STAGES = ("ingest", "downsample", "slic", "vectorize", "segment", "features", "classify", "merge", "classmap",
+          "tiles")
+PIXEL = 0.5          # metres
+PARCEL = 48          # pixels per parcel side
+CLASSES = np.array([[60, 110, 50, 30], [200, 190, 170, 120], [90, 90, 140, 60],
+                    [140, 160, 90, 200], [30, 40, 35, 10]], dtype="float32")
+
+
+# ---------------- measurement
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stage:
+    """`with Stage("name", results) as st:` records seconds and peak RSS; `st.info` takes extra fields."""
+
+    def __init__(self, name: str, results: dict, interval: float = 0.02):
+        self.name, self.results, self.interval = name, results, interval
+        self.info: dict = {}
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, _rss_bytes())
+
+    def __enter__(self):
+        self._start_rss = self._peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._t0
+        self._stop.set()
+        self._thread.join()
+        self._peak = max(self._peak, _rss_bytes())
+        rec = {"seconds": round(seconds, 4),
+               "peak_rss_mb": round(self._peak / 2**20, 1),
+               "rss_delta_mb": round((self._peak - self._start_rss) / 2**20, 1), **self.info}
+        if exc is not None:
+            rec["error"] = f"{type(exc).__name__}: {exc}"
+        self.results[self.name] = rec
+        print(f"  {self.name:<10} {seconds:9.2f} s  peak {rec['peak_rss_mb']:8.1f} MB"
+              + (f"  {rec['error']}" if exc is not None else ""), flush=True)
+        return False
+
+
+# ---------------- synthetic data
+def make_raster(path: Path, size: int, bands: int = 4, seed: int = 0, strip: int = 1024) -> Path:
+    """size x size uint8 GeoTIFF of square-ish parcels of a few spectral classes plus noise, written in strips."""
+    rng = np.random.default_rng(seed)
+    cells = size // PARCEL + 2
+    parcel_class = rng.integers(0, len(CLASSES), (cells, cells))
+    jitter = rng.integers(-PARCEL // 3, PARCEL // 3 + 1, cells)
+    profile = {"driver": "GTiff", "height": size, "width": size, "count": bands, "dtype": "uint8",
+               "crs": "EPSG:32645", "transform": from_origin(300000, 3000000, PIXEL, PIXEL),
+               "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate"}
+    cols = np.arange(size)
+    with rasterio.open(path, "w", **profile) as dst:
+        for r0 in range(0, size, strip):
+            rows = np.arange(r0, min(size, r0 + strip))
+            ci = (rows // PARCEL)[:, None]
+            cj = np.clip((cols[None, :] + jitter[ci]) // PARCEL, 0, cells - 1)
+            means = CLASSES[parcel_class[ci, cj]][..., :bands]          # (h, w, bands)
+            noise = rng.normal(0, 8, means.shape).astype("float32")
+            block = np.clip(means + noise, 0, 255).astype("uint8").transpose(2, 0, 1)
+            dst.write(block, window=Window(0, r0, size, rows.size))
+    return path
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    return int(float(s[:-1]) * 1024) if s.endswith("k") else int(s)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------- stages
+def _tiles_for(bounds, max_tiles: int):
+    """XYZ tiles covering WGS84 `bounds` at the deepest zoom with at most `max_tiles` tiles."""
+    west, south, east, north = bounds
+
+    def tile(lon, lat, z):
+        n = 2 ** z
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        return x, y
+
+    best = []
+    for z in range(0, 23):
+        x0, y0 = tile(west, north, z)
+        x1, y1 = tile(east, south, z)
+        count = (x1 - x0 + 1) * (y1 - y0 + 1)
+        if count > max_tiles:
+            break
+        best = [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    return best
+
+
+def bench_tiles(raster: Path, work: Path, concurrency, max_tiles: int) -> dict:
+    """Tiles/s and latency percentiles through the API for a registered copy of `raster`."""
+    from fastapi.testclient import TestClient
+    import backend.app as A
+    from backend.obia.rasterdb import RasterStore
+    from backend.obia.tilecache import TileCache
+    from backend.obia.renderstats import compute_render_stats
+
+    # point the app at a private raster store and tile cache: no records are added to backend/uploads
+    A.RASTERS = RasterStore(work / "_rasters.sqlite")
+    A.RENDER_STATS.clear()
+    rid = "bench"
+    rec, _ = A.RASTERS.add(rid, raster.name, None, path_for=lambda name: raster, state="done",
+                           **A.describe_raster(raster))
+    A.RASTERS.set_stats(rid, compute_render_stats(raster))
+    tiles = _tiles_for(rec["bounds_wgs84"], max_tiles)
+    out = {"tiles": len(tiles), "zoom": tiles[0][0] if tiles else None, "runs": []}
+
+    def get(t):
+        t0 = time.perf_counter()
+        r = client.get(f"/tiles/{rid}/{t[0]}/{t[1]}/{t[2]}.png")
+        return (time.perf_counter() - t0) * 1000.0, r.status_code, len(r.content)
+
+    client = TestClient(A.app)     # no lifespan: shutdown would stop the app's pools for the next size
+    for c in concurrency:
+        for cache in ("cold", "warm"):
+            if cache == "cold":
+                A.TILE_CACHE = TileCache(max_bytes=A.TILE_CACHE.max_bytes)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(c) as ex:
+                res = list(ex.map(get, tiles))
+            wall = time.perf_counter() - t0
+            lat = np.array([r[0] for r in res])
+            out["runs"].append({
+                "concurrency": c, "cache": cache,
+                "tiles_per_s": round(len(res) / wall, 1),
+                "p50_ms": round(float(np.percentile(lat, 50)), 2),
+                "p95_ms": round(float(np.percentile(lat, 95)), 2),
+                "errors": sum(1 for r in res if r[1] != 200),
+                "mb_served": round(sum(r[2] for r in res) / 2**20, 2),
+            })
+    A.DATASETS.invalidate(rid)
+    return out
+
+
+def run_size(size: int, args, work: Path, results: dict) -> dict:
+    from backend.obia import tasks
+    from backend.obia.downsample import downsample_raster
+    from backend.obia.rasterdb import RasterStore
+    from backend.obia.segmentation import slic_labels
+    from backend.obia.storage import read_layer
+
+    seg_dir = work / "results" / "segments"
+    classify_dir = work / "results" / "classify"
+    merged_dir = work / "results" / "merged_cleaned"
+    models_dir = work / "results" / "_models"
+    for d in (seg_dir, classify_dir, merged_dir, work / "results" / "samples", models_dir):
+        d.mkdir(parents=True, exist_ok=True)
+    selected = set(args.stages)
+
+    t0 = time.perf_counter()
+    src = make_raster(work / f"synthetic_{size}.tif", size, bands=args.bands)
+    print(f"  {'generate':<10} {time.perf_counter() - t0:9.2f} s  ({src.stat().st_size / 2**20:.0f} MB)", flush=True)
+
+    raster = src
+    if "ingest" in selected:
+        store = RasterStore(work / "_ingest.sqlite")
+        tmp = work / f"upload_{size}.tif"
+        shutil.copyfile(src, tmp)
+        final = work / f"ingested_{size}.tif"
+        store.add("r", final.name, None, path_for=lambda name: final, state="processing")
+        with Stage("ingest", results) as st:
+            tasks.ingest_task(str(tmp), str(final), "r", str(store.db_path), "cog")
+            st.info["mb"] = round(final.stat().st_size / 2**20, 1)
+        raster = final
+
+    if "downsample" in selected:
+        with Stage("downsample", results) as st:
+            out = work / f"ds_{size}.tif"
+            downsample_raster(str(src), str(out), 4)
+            st.info["mb"] = round(out.stat().st_size / 2**20, 1)
+
+    if "slic" in selected or "vectorize" in selected:
+        labels = work / f"slic_{size}.labels.tif"
+        with Stage("slic", results):
+            slic_labels(str(raster), args.scale, args.compactness, labels)
+        if "vectorize" in selected:
+            with Stage("vectorize", results) as st:
+                with rasterio.open(labels) as ds:
+                    lab = ds.read(1)
+                    st.info["polygons"] = sum(1 for _ in shapes(lab, mask=lab > 0, transform=ds.transform))
+
+    needs_layer = selected & {"segment", "features", "classify", "merge", "classmap"}
+    if not needs_layer:
+        return results
+    with Stage("segment", results) as st:
+        seg = tasks.segment_task(str(raster), f"segment_{size}", args.scale, args.compactness, 1.0,
+                                 str(seg_dir), "/results/segments", block_size=args.block_size or None,
+                                 features=())
+        st.info["segments"] = int(len(read_layer(seg_dir / seg["file"])))
+    sid = seg["id"]
+    with Stage("features", results) as st:
+        st.info.update(tasks.features_task(sid, str(seg_dir), "/results/segments", "spectral,shape"))
+
+    # samples: the darkest and brightest segments by band 1
+    import pandas as pd
+    ft = pd.read_parquet(seg_dir / f"{sid}.features.parquet", columns=["segment_id", "band_1_mean"])
+    q = ft.band_1_mean.quantile([0.15, 0.85])
+    samples = {"dark": ft.segment_id[ft.band_1_mean < q.iloc[0]].head(50).tolist(),
+               "bright": ft.segment_id[ft.band_1_mean > q.iloc[1]].head(50).tolist()}
+    (work / "results" / "samples" / f"{sid}.json").write_text(
+        json.dumps({"segment_id": sid, "samples": samples}), encoding="utf-8")
+
+    with Stage("classify", results) as st:
+        cls = tasks.classify_task(sid, "rf", str(work / "results"), str(classify_dir), "/results/classify",
+                                  features="spectral,shape", models_dir=str(models_dir))
+        st.info["accuracy"] = cls.get("accuracy")
+    if "merge" in selected:
+        with Stage("merge", results) as st:
+            m = tasks.merge_clean_task(str(classify_dir / cls["file"]), str(merged_dir), "classification",
+                                       "all", "area_pixels", "/results/merged_cleaned", workers=args.workers)
+            st.info["polygons"] = int(len(read_layer(merged_dir / m["output"])))
+    if "classmap" in selected:
+        with Stage("classmap", results) as st:
+            cm = tasks.classmap_task(sid, "rf", str(work / "results"), str(merged_dir), "/results/merged_cleaned",
+                                     str(models_dir), model_id=cls["model_id"])
+            st.info["polygons"] = int(len(read_layer(merged_dir / cm["output"])))
+    return results
+
+
+def compare(current: dict, baseline: dict):
+    """Print seconds of every stage against a previous results file."""
+    print(f"\ncompared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for size, stages in current["sizes"].items():
+        old = baseline.get("sizes", {}).get(size, {})
+        for name, rec in stages.items():
+            if name == "tiles" or name not in old or "seconds" not in old[name]:
+                continue
+            ratio = rec["seconds"] / old[name]["seconds"] if old[name]["seconds"] else float("nan")
+            print(f"  {size:>6} {name:<10} {old[name]['seconds']:9.2f} -> {rec['seconds']:9.2f} s  x{ratio:5.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="End-to-end OBIA pipeline benchmark on synthetic rasters.")
+    ap.add_argument("--sizes", default="1k,4k", help="raster sides in pixels, e.g. 1k,4k,16k")
+    ap.add_argument("--bands", type=int, default=4)
+    ap.add_argument("--stages", default=",".join(STAGES), help=f"subset of {','.join(STAGES)}")
+    ap.add_argument("--scale", type=float, default=10)
+    ap.add_argument("--compactness", type=float, default=0.5)
+    ap.add_argument("--block-size", type=int, default=0, help="windowed segmentation block size (0 = whole raster)")
+    ap.add_argument("--workers", type=int, default=None, help="merge processes (default: all cores)")
+    ap.add_argument("--concurrency", default="1,8,32", help="tile client concurrencies")
+    ap.add_argument("--max-tiles", type=int, default=256, help="tiles per throughput run")
+    ap.add_argument("--workdir", help="keep the generated data here instead of a temp dir")
+    ap.add_argument("--out", help="results JSON (default: benchmarks/results/<timestamp>_<commit>.json)")
+    ap.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    args = ap.parse_args()
+    args.stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        ap.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count(), "numpy": np.__version__, "rasterio": rasterio.__version__,
+                    "gdal": rasterio.__gdal_version__},
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "workdir")},
+        "sizes": {},
+    }
+    root = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="obia_bench_"))
+    try:
+        for s in args.sizes.split(","):
+            size = parse_size(s)
+            print(f"{size} x {size} px, {args.bands} bands", flush=True)
+            work = root / str(size)
+            work.mkdir(parents=True, exist_ok=True)
+            results = {}
+            try:
+                run_size(size, args, work, results)
+            except Exception as e:
+                print(f"  stopped: {type(e).__name__}: {e}", flush=True)
+            if "tiles" in args.stages:
+                raster = work / f"ingested_{size}.tif"
+                if not raster.exists():
+                    raster = work / f"synthetic_{size}.tif"
+                if raster.exists():
+                    with Stage("tiles", results) as st:
+                        st.info.update(bench_tiles(raster, work, [int(c) for c in args.concurrency.split(",")],
+                                                   args.max_tiles))
+                    for r in results["tiles"].get("runs", []):
+                        print(f"    c={r['concurrency']:<3} {r['cache']:<4} {r['tiles_per_s']:8.1f} tiles/s"
+                              f"  p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms  errors {r['errors']}")
+            report["sizes"][str(size)] = results
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    out = Path(args.out) if args.out else ROOT / "benchmarks" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}_{commit or 'nogit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nresults: {out}")
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of the tile render kernel (backend/obia/render.py).
+
+Times the stretch and encode stages on synthetic 256x256 tiles for a few
+dtypes and band counts, against the previous masked-array implementation,
+and checks that both produce the same image (within rounding).
+
+    python -m benchmarks.bench_render [--repeat 50] [--json out.json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from backend.obia.render import stretch_planes, encode_tile
+
+CASES = [("uint8", 3), ("uint16", 3), ("uint16", 1), ("float32", 3)]
+
+
+def _tile(dtype: str, bands: int, rng) -> tuple[np.ma.MaskedArray, list, list]:
+    if dtype == "uint8":
+        data = rng.integers(0, 256, (bands, 256, 256)).astype(dtype)
+        lo, hi = 20.0, 230.0
+    elif dtype == "uint16":
+        data = rng.integers(0, 4096, (bands, 256, 256)).astype(dtype)
+        lo, hi = 200.0, 3500.0
+    else:
+        data = rng.normal(0.2, 0.1, (bands, 256, 256)).astype(dtype)
+        lo, hi = 0.0, 0.45
+    mask = np.zeros(data.shape, dtype=bool)
+    mask[:, :, :40] = True     # a nodata edge, as on the border of a raster
+    return np.ma.MaskedArray(data, mask), [lo] * bands, [hi] * bands
+
+
+def legacy_rgba(data: np.ma.MaskedArray, vmins, vmaxs) -> np.ndarray:
+    """The kernel tile_png used before: float32 masked array, NaN fill, per-band loop, dstack."""
+    data = data.astype("float32")
+    mask_any = np.any(data.mask, axis=0)
+    alpha = np.where(mask_any, 0, 255).astype("uint8")
+    filled = np.where(~data.mask, data, np.nan)
+    for b in range(filled.shape[0]):
+        vmin, vmax = vmins[b], vmaxs[b]
+        filled[b] = 0.0 if vmax == vmin else (filled[b] - vmin) / (vmax - vmin)
+    filled = np.clip(filled, 0, 1)
+    filled = np.where(~data.mask, filled, 0.0)
+    if filled.shape[0] == 1:
+        filled = np.repeat(filled, 3, axis=0)
+    rgb = (filled[:3] * 255).astype("uint8")
+    return np.dstack([rgb[0], rgb[1], rgb[2], alpha])
+
+
+def legacy_png(rgba: np.ndarray) -> bytes:
+    buf = BytesIO()
+    Image.fromarray(rgba, mode="RGBA").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _ms(fn, repeat: int) -> float:
+    fn()
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat * 1000.0
+
+
+def run(repeat: int = 50) -> list[dict]:
+    rng = np.random.default_rng(0)
+    rows = []
+    for dtype, bands in CASES:
+        data, vmins, vmaxs = _tile(dtype, bands, rng)
+        invalid = np.ma.getmaskarray(data).any(axis=0)
+        new = stretch_planes(data.data, invalid, vmins, vmaxs)
+        old = legacy_rgba(data, vmins, vmaxs)
+        row = {
+            "dtype": dtype, "bands": bands,
+            "max_abs_diff": int(np.abs(new.transpose(1, 2, 0).astype(int) - old.astype(int)).max()),
+            "legacy_stretch_ms": _ms(lambda: legacy_rgba(data, vmins, vmaxs), repeat),
+            "stretch_ms": _ms(lambda: stretch_planes(data.data, invalid, vmins, vmaxs), repeat),
+            "legacy_png_ms": _ms(lambda: legacy_png(old), repeat),
+        }
+        for fmt, kw in (("png", {"png_level": 6}), ("png", {"png_level": 1}), ("webp", {}), ("jpg", {})):
+            name = f"{fmt}{kw.get('png_level', '')}"
+            row[f"{name}_ms"] = _ms(lambda: encode_tile(new, fmt, **kw), repeat)
+            row[f"{name}_bytes"] = len(encode_tile(new, fmt, **kw))
+        rows.append(row)
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args()
+    rows = run(args.repeat)
+    for r in rows:
+        print(f"{r['dtype']:>8} x{r['bands']}  stretch {r['legacy_stretch_ms']:6.2f} -> {r['stretch_ms']:5.2f} ms"
+              f"  (max diff {r['max_abs_diff']})  png {r['legacy_png_ms']:5.2f} / png1 {r['png1_ms']:5.2f}"
+              f" / webp {r['webp_ms']:5.2f} / jpg {r['jpg_ms']:5.2f} ms"
+              f"  bytes png {r['png6_bytes']} png1 {r['png1_bytes']} webp {r['webp_bytes']} jpg {r['jpg_bytes']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
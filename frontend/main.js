@@ -353,6 +353,7 @@ async function rasterStatusOrDirect(item) {
     const r = await fetch(BACKEND() + "/rasters/" + item.id + "/status", { cache: "no-store" });
     if (r.ok) {
       const st = await r.json();
+      if (st.status && st.status.state === "error") return { ok: false, error: st.status.error || "ingest failed" };
       if (st.tile_url) {
         return {
           ok: true,
@@ -399,14 +400,51 @@ async function loadExistingRasters() {
   }
   refreshRasterDropdown();
 }
-async function uploadRasterImage(file, name) {
+// files above this go through the resumable /uploads API in chunks
+const CHUNKED_UPLOAD_BYTES = 64 * 1024 * 1024;
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024;
+
+async function uploadRasterChunked(file) {
   const fd = new FormData();
-  fd.append("file", file);
-  const resp = await fetch(BACKEND() + "/rasters", { method: "POST", body: fd });
-  if (!resp.ok) { notifyWarning("Upload failed"); return; }
-  const info = await resp.json();
+  fd.append("filename", file.name);
+  fd.append("size", String(file.size));
+  let r = await fetch(BACKEND() + "/uploads", { method: "POST", body: fd });
+  if (!r.ok) return null;
+  const sess = await r.json();
+  if (sess.dedup) return sess;
+  const url = BACKEND() + "/uploads/" + sess.upload_id;
+  let offset = sess.offset || 0, failures = 0;
+  while (offset < file.size) {
+    const end = Math.min(offset + UPLOAD_CHUNK_BYTES, file.size);
+    try {
+      r = await fetch(url + "?offset=" + offset, { method: "PUT", body: file.slice(offset, end) });
+    } catch (e) { r = null; }
+    if (r && r.ok) { offset = (await r.json()).offset; failures = 0; continue; }
+    // dropped connection or offset conflict: resume from what the server has
+    if (++failures > 5) return null;
+    await new Promise(res => setTimeout(res, 1000 * failures));
+    const g = await fetch(url, { cache: "no-store" }).catch(() => null);
+    if (g && g.ok) offset = (await g.json()).offset;
+    else if (g && g.status === 404) return null;
+  }
+  r = await fetch(url + "/complete", { method: "POST" });
+  return r.ok ? await r.json() : null;
+}
+
+async function uploadRasterImage(file, name) {
+  let info;
+  if (file.size > CHUNKED_UPLOAD_BYTES) {
+    info = await uploadRasterChunked(file);
+  } else {
+    const fd = new FormData();
+    fd.append("file", file);
+    const resp = await fetch(BACKEND() + "/rasters", { method: "POST", body: fd });
+    info = resp.ok ? await resp.json() : null;
+  }
+  if (!info) { notifyWarning("Upload failed"); return; }
   while (true) {
     const st = await rasterStatusOrDirect(info);
+    if (st.error) { notifyWarning("Upload failed: " + st.error); return; }
     if (st.ok) {
       const minZ = st.zooms.length ? Math.min(...st.zooms) : 0;
       const maxZ = st.zooms.length ? Math.max(...st.zooms) : 22;
@@ -647,42 +685,69 @@ function updateClassIds() {
   });
 }
 
-// map click → pick
+// map click → pick: the server answers which segment is under the click from the layer's
+// spatial index; the bounds hit-test on the loaded GeoJSON is only a fallback
+async function segmentIdAt(layerId, latlng) {
+  try {
+    const q = `point=${latlng.lng},${latlng.lat}&props=segment_id&limit=1`;
+    const r = await fetch(BACKEND() + `/layers/${encodeURIComponent(layerId)}/query?${q}`);
+    if (!r.ok) return undefined;
+    const j = await r.json();
+    return j.ids && j.ids.length ? j.ids[0] : null;
+  } catch (e) {
+    return undefined;
+  }
+}
+function nearestFeatureAt(rec, latlng) {
+  let nearest = null, nearestDist = Infinity;
+  rec.leafletLayer.eachLayer(function (layer) {
+    if (!layer.getBounds) return;
+    const bounds = layer.getBounds();
+    if (!bounds || !bounds.contains(latlng)) return;
+    const c = bounds.getCenter();
+    const d = Math.hypot(c.lat - latlng.lat, c.lng - latlng.lng);
+    if (d < nearestDist) { nearestDist = d; nearest = layer; }
+  });
+  return nearest;
+}
+function featureFid(layer) {
+  return (layer.feature && layer.feature.properties && layer.feature.properties.segment_id) || layer._leaflet_id;
+}
 function bindMapPicking() {
   if (!map) return;
-  map.on("click", function (e) {
+  map.on("click", async function (e) {
     if (!currentClassKey || !activeSamplingLayerName) return;
+    const classKey = currentClassKey;
     const rec = layers[activeSamplingLayerName];
-    if (!rec || !rec.leafletLayer || !rec.geojson) return;
-
-    let nearest = null, nearestDist = Infinity, nearestFid = null;
-    rec.leafletLayer.eachLayer(function (layer) {
-      if (!layer.getBounds) return;
-      const bounds = layer.getBounds();
-      if (!bounds || !bounds.contains(e.latlng)) return;
-      const c = bounds.getCenter();
-      const d = Math.hypot(c.lat - e.latlng.lat, c.lng - e.latlng.lng);
-      const fid = (layer.feature && layer.feature.properties && layer.feature.properties.segment_id) || layer._leaflet_id;
-      if (d < nearestDist) { nearestDist = d; nearest = layer; nearestFid = fid; }
-    });
+    if (!rec) return;
+
+    let nearest = null, nearestFid = await segmentIdAt(rec.segmentId || activeSamplingLayerName, e.latlng);
+    if (nearestFid === null) return;
+    if (rec.leafletLayer) {
+      if (nearestFid === undefined) {
+        nearest = nearestFeatureAt(rec, e.latlng);
+        nearestFid = nearest ? featureFid(nearest) : null;
+      } else {
+        rec.leafletLayer.eachLayer(function (lyr) { if (featureFid(lyr) === nearestFid) nearest = lyr; });
+      }
+    }
 
-    if (nearest && nearestFid != null) {
+    if (nearestFid != null) {
       // unique across classes
       Object.keys(classData).forEach(k => {
-        if (k === currentClassKey) return;
+        if (k === classKey) return;
         const arr = classData[k]; const ix = arr.indexOf(nearestFid);
         if (ix !== -1) arr.splice(ix, 1);
       });
 
-      const ids = classData[currentClassKey] || (classData[currentClassKey] = []);
+      const ids = classData[classKey] || (classData[classKey] = []);
       const idx = ids.indexOf(nearestFid);
       if (idx === -1) {
         ids.push(nearestFid);
-        nearest.setStyle({ color: "#111", fillColor: classColors[currentClassKey] || "#ff0000", fillOpacity: 0.65, weight: 1, opacity: 1 });
+        if (nearest) nearest.setStyle({ color: "#111", fillColor: classColors[classKey] || "#ff0000", fillOpacity: 0.65, weight: 1, opacity: 1 });
       } else {
         ids.splice(idx, 1);
-        const style = baseStyle(rec, nearest.feature);
-        nearest.setStyle(style);
+        if (nearest) nearest.setStyle(baseStyle(rec, nearest.feature));
       }
       updateClassIds();
     }